@@ -1,7 +1,14 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import Profile
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.functional import cached_property
+from .models import OutgoingEmail, Profile
+from .outbox import build_outgoing_email, enqueue_emails
+from .profile_cache import invalidate_profiles
+from .user_cache import invalidate_users
+from .utils import ACTIVATION_FROM_EMAIL, render_activation_email
 
 
 class ProfileInline(admin.StackedInline):
@@ -11,14 +18,92 @@ class ProfileInline(admin.StackedInline):
     fk_name = 'user'
 
 
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the row count of an unfiltered changelist from the
+    PostgreSQL planner statistics instead of running COUNT(*) over the whole
+    table, once the table is larger than `estimate_threshold` rows.
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 for a table that was never analyzed.
+            if row and row[0] >= self.estimate_threshold:
+                return row[0]
+        return super().count
+
+
 class CustomUserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
+    list_display = BaseUserAdmin.list_display + ('email_confirmed',)
+    list_filter = BaseUserAdmin.list_filter + ('profile__email_confirmed',)
+    list_select_related = ('profile',)
+    paginator = EstimatedCountPaginator
+    # Avoids a second COUNT(*) over the whole table when a filter is applied.
+    show_full_result_count = False
+    actions = ('confirm_email', 'resend_activation_email')
+    batch_size = 1000
 
     def get_inline_instances(self, request, obj=None):
         if not obj:
             return list()
         return super().get_inline_instances(request, obj)
 
+    @admin.display(boolean=True, ordering='profile__email_confirmed', description='Email confirmed')
+    def email_confirmed(self, obj):
+        profile = getattr(obj, 'profile', None)
+        return profile is not None and profile.email_confirmed
+
+    def iter_pk_batches(self, queryset):
+        pks = queryset.order_by().values_list('pk', flat=True)
+        batch = []
+        for pk in pks.iterator(chunk_size=self.batch_size):
+            batch.append(pk)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @admin.action(description='Mark email as confirmed for selected users')
+    def confirm_email(self, request, queryset):
+        confirmed = 0
+        for pks in self.iter_pk_batches(queryset.filter(profile__email_confirmed=False)):
+            with transaction.atomic():
+                confirmed += Profile.objects.filter(user_id__in=pks).update(email_confirmed=True)
+            # update() skips post_save, so the profile pages are invalidated here.
+            invalidate_profiles(pks)
+            invalidate_users(pks)
+        self.message_user(request, f'Confirmed {confirmed} account(s).', messages.SUCCESS)
+
+    @admin.action(description='Queue activation email for selected unconfirmed users')
+    def resend_activation_email(self, request, queryset):
+        users = queryset.filter(profile__email_confirmed=False).exclude(email='').order_by()
+        queued = enqueue_emails(
+            (
+                build_outgoing_email(*render_activation_email(request, user), ACTIVATION_FROM_EMAIL, [user.email])
+                for user in users.iterator(chunk_size=self.batch_size)
+            ),
+            batch_size=self.batch_size,
+        )
+        self.message_user(request, f'Queued {queued} activation email(s).', messages.SUCCESS)
+
 # Re-register UserAdmin
 admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
+
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
@@ -0,0 +1,53 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+
+from .hashing import run_hashing
+
+UserModel = get_user_model()
+
+
+class HashingPoolBackend(ModelBackend):
+    """
+    ModelBackend whose async authentication verifies passwords in the
+    bounded hashing pool. The stock aauthenticate hashes on the event loop.
+    """
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing
+            # difference between an existing and a nonexistent user (#20760).
+            await run_hashing(make_password, password)
+            return
+
+        outdated = []
+        if not await run_hashing(check_password, password, user.password, outdated.append):
+            return
+        if outdated:
+            # The stored hash uses an old algorithm or work factor.
+            user.password = await run_hashing(make_password, password)
+            await user.asave(update_fields=['password'])
+        if self.user_can_authenticate(user):
+            return user
+
+    def get_user(self, user_id):
+        # The profile is needed on nearly every page (email verification,
+        # navbar), so it is fetched with the user instead of lazily.
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        try:
+            user = await UserModel._default_manager.select_related('profile').aget(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
@@ -1,6 +1,16 @@
 from django import forms
+from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth import aauthenticate
+from django.contrib.auth.forms import AuthenticationForm, PasswordChangeForm, PasswordResetForm, UserCreationForm
+from django.contrib.auth.hashers import check_password, make_password
+from django.template import loader
+from .hashing import run_hashing
+from core.routers import replica_reads
+from .models import Profile, normalize_email_key
+from .outbox import enqueue_email
+
+DUPLICATE_EMAIL_ERROR = "Użytkownik z tym adresem email już istnieje."
 
 
 class CustomUserCreationForm(UserCreationForm):
@@ -12,6 +22,98 @@ class CustomUserCreationForm(UserCreationForm):
 
     def clean_email(self):
         email = self.cleaned_data.get('email')
-        if User.objects.filter(email__iexact=email).exists():
-            raise forms.ValidationError("Użytkownik z tym adresem email już istnieje.")
-        return email
\ No newline at end of file
+        # Index lookup on the unique Profile.email_normalized column
+        # rather than a case-insensitive scan of auth_user. A replica may lag
+        # behind; the unique constraint still catches what it misses.
+        with replica_reads():
+            taken = Profile.objects.filter(email_normalized=normalize_email_key(email)).exists()
+        if taken:
+            raise forms.ValidationError(DUPLICATE_EMAIL_ERROR)
+        return email
+
+
+class BaseCurrencyForm(forms.ModelForm):
+    base_currency = forms.ChoiceField(
+        label='Base currency',
+        choices=lambda: [(code, code) for code in settings.CURRENCIES],
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+    class Meta:
+        model = Profile
+        fields = ('base_currency',)
+
+
+class OutboxPasswordResetForm(PasswordResetForm):
+    """
+    Password reset form that puts the reset email in the outbox
+    instead of sending it during the request.
+    """
+
+    def send_mail(self, subject_template_name, email_template_name, context,
+                  from_email, to_email, html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        # Email subject *must not* contain newlines
+        subject = ''.join(subject.splitlines())
+        body = loader.render_to_string(email_template_name, context)
+        html_body = None
+        if html_email_template_name is not None:
+            html_body = loader.render_to_string(html_email_template_name, context)
+        enqueue_email(subject, body, from_email, [to_email], html_message=html_body)
+
+
+class AsyncAuthenticationForm(AuthenticationForm):
+    """
+    Authentication form for async views. `is_valid()` only checks the fields;
+    the credentials are checked by awaiting `aauthenticate()`, which hashes
+    in the bounded hashing pool.
+    """
+
+    def clean(self):
+        return self.cleaned_data
+
+    async def aauthenticate(self):
+        self.user_cache = await aauthenticate(
+            self.request,
+            username=self.cleaned_data.get('username'),
+            password=self.cleaned_data.get('password'),
+        )
+        if self.user_cache is None:
+            self.add_error(None, self.get_invalid_login_error())
+            return False
+        try:
+            self.confirm_login_allowed(self.user_cache)
+        except forms.ValidationError as error:
+            self.add_error(None, error)
+            return False
+        return True
+
+
+class AsyncPasswordChangeForm(PasswordChangeForm):
+    """
+    Password change form for async views. The old password must be checked
+    by awaiting `acheck_old_password()` before `is_valid()`, and the form is
+    saved with `asave()`, so both hashes run in the bounded hashing pool.
+    """
+    old_password_valid = False
+
+    async def acheck_old_password(self):
+        self.old_password_valid = await run_hashing(
+            check_password, self.data.get('old_password', ''), self.user.password
+        )
+
+    def clean_old_password(self):
+        if not self.old_password_valid:
+            raise forms.ValidationError(
+                self.error_messages['password_incorrect'],
+                code='password_incorrect',
+            )
+        return self.cleaned_data['old_password']
+
+    async def asave(self):
+        password = self.cleaned_data['new_password1']
+        self.user.password = await run_hashing(make_password, password)
+        # Lets AbstractBaseUser.save() notify the password validators.
+        self.user._password = password
+        await self.user.asave()
+        return self.user
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 hasher whose work factor comes from the PASSWORD_HASHER_ITERATIONS
+    setting, so each environment can pick its own cost. It keeps the
+    'pbkdf2_sha256' algorithm name: existing hashes stay valid and are
+    re-hashed to the configured cost on the next successful login.
+    """
+
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHER_ITERATIONS
@@ -0,0 +1,68 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import HttpResponse
+
+
+class HashingBusy(Exception):
+    """
+    Raised when PASSWORD_HASHING_MAX_PENDING jobs are already queued or running.
+    """
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Returns the process-wide (executor, slots) pair, created on first use.
+    The executor bounds how many hashes run at once, the slots bound how many
+    may wait for it, so a login burst is rejected instead of piling up.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = (
+                    ThreadPoolExecutor(
+                        max_workers=settings.PASSWORD_HASHING_WORKERS,
+                        thread_name_prefix='password-hashing',
+                    ),
+                    threading.BoundedSemaphore(settings.PASSWORD_HASHING_MAX_PENDING),
+                )
+    return _pool
+
+
+async def run_hashing(func, *args):
+    """
+    Runs a CPU-bound hashing call in the hashing pool without blocking the
+    event loop. The hashlib PBKDF2 implementation releases the GIL, so the
+    pool's threads hash in parallel. Raises HashingBusy when the pool is full.
+    """
+    executor, slots = get_pool()
+    if not slots.acquire(blocking=False):
+        raise HashingBusy
+    try:
+        return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(func, *args))
+    finally:
+        slots.release()
+
+
+def reject_when_hashing_busy(view):
+    """
+    Decorator for async views that answers 503 with Retry-After
+    instead of queueing more work when the hashing pool is full.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            return await view(request, *args, **kwargs)
+        except HashingBusy:
+            response = HttpResponse('Too many requests, please try again shortly.', status=503)
+            response.headers['Retry-After'] = '1'
+            return response
+    return wrapper
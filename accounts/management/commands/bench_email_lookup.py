@@ -0,0 +1,46 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Profile, create_users_with_profiles, normalize_email_key
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a large user table inside a rolled back transaction and compares '
+        'the old email__iexact duplicate check with the indexed Profile.email_normalized lookup.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200000)
+        parser.add_argument('--lookups', type=int, default=200)
+
+    def handle(self, *args, **options):
+        count = options['users']
+        lookups = options['lookups']
+        with transaction.atomic():
+            self.stdout.write(f'Seeding {count} users...')
+            for start in range(0, count, 10000):
+                create_users_with_profiles([
+                    User(username=f'bench-lookup-{i}', email=f'Bench.Lookup.{i}@Example.com')
+                    for i in range(start, min(start + 10000, count))
+                ])
+            # Half of the probes hit an existing address, half miss.
+            emails = [
+                f'bench.lookup.{i * count // lookups}@example.com' if i % 2 else f'missing-{i}@example.com'
+                for i in range(lookups)
+            ]
+
+            for label, check in (
+                ('email__iexact', lambda email: User.objects.filter(email__iexact=email).exists()),
+                ('email_normalized', lambda email: Profile.objects.filter(
+                    email_normalized=normalize_email_key(email)).exists()),
+            ):
+                start = time.perf_counter()
+                for email in emails:
+                    check(email)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f'{label:>17}: {elapsed / lookups * 1e3:8.3f} ms/lookup')
+            transaction.set_rollback(True)
@@ -0,0 +1,82 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.shortcuts import redirect
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from accounts.middleware import EmailVerificationMiddleware
+
+
+def legacy_middleware(get_response):
+    """
+    The middleware as it was before the route policy was compiled,
+    kept here as the 'before' side of the benchmark.
+    """
+    def middleware(request):
+        allowed_url_names = [
+            'accounts:logout',
+            'accounts:account_activation_sent',
+            'accounts:resend_activation_email',
+        ]
+        allowed_path_prefixes = [
+            '/admin/',
+            '/accounts/activate/',
+        ]
+        if (
+            request.user.is_authenticated and
+            not request.user.profile.email_confirmed and
+            request.path not in [reverse(name) for name in allowed_url_names] and
+            not any(request.path.startswith(prefix) for prefix in allowed_path_prefixes)
+        ):
+            return redirect('accounts:account_activation_sent')
+        return get_response(request)
+    return middleware
+
+
+class Command(BaseCommand):
+    help = 'Measures the per-request cost of EmailVerificationMiddleware before and after the compiled route policy.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        with transaction.atomic():
+            user = User.objects.create_user('bench-email-verification', 'bench@example.com')
+            user.profile.email_confirmed = True
+            user.profile.save()
+
+            for label, factory in (
+                ('before', legacy_middleware),
+                ('after', EmailVerificationMiddleware),
+            ):
+                elapsed, queries = self.run(factory(lambda request: HttpResponse()), user, iterations)
+                self.stdout.write(
+                    f'{label:>6}: {elapsed / iterations * 1e6:8.2f} us/request, '
+                    f'{queries / iterations:.2f} queries/request'
+                )
+            transaction.set_rollback(True)
+
+    def run(self, middleware, user, iterations):
+        factory = RequestFactory()
+        session = {}
+        requests = []
+        for _ in range(iterations):
+            request = factory.get('/')
+            # A fresh user instance per request mirrors AuthenticationMiddleware,
+            # which never reuses the cached profile between requests.
+            request.user = User.objects.get(pk=user.pk)
+            request.session = session
+            requests.append(request)
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for request in requests:
+                middleware(request)
+            elapsed = time.perf_counter() - start
+        return elapsed, len(queries)
@@ -0,0 +1,74 @@
+import asyncio
+import statistics
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from accounts.backends import HashingPoolBackend
+from accounts.hashing import HashingBusy
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures logins per second through the stock ModelBackend, which hashes on '
+        'the event loop, and through HashingPoolBackend, at increasing concurrency. '
+        'Reports the best throughput whose p99 latency stays under --max-latency-ms.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+        parser.add_argument('--logins', type=int, default=200, help='Logins per concurrency level.')
+        parser.add_argument('--max-latency-ms', type=float, default=500.0)
+
+    def handle(self, *args, **options):
+        password = 'BenchLoginPass123'
+        user = User.objects.create_user('bench-login-throughput', 'bench-login@example.com', password)
+        try:
+            for label, backend in (('ModelBackend', ModelBackend()), ('HashingPoolBackend', HashingPoolBackend())):
+                best = None
+                for concurrency in options['concurrency']:
+                    rate, p50, p99, rejected = asyncio.run(
+                        self.run(backend, user.username, password, concurrency, options['logins'])
+                    )
+                    self.stdout.write(
+                        f'{label:>18} c={concurrency:<3} {rate:8.1f} logins/s  '
+                        f'p50 {p50:7.1f} ms  p99 {p99:7.1f} ms  rejected {rejected}'
+                    )
+                    if p99 <= options['max_latency_ms'] and (best is None or rate > best[0]):
+                        best = (rate, concurrency)
+                if best:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'{label}: {best[0]:.1f} logins/s at p99 <= {options["max_latency_ms"]:.0f} ms '
+                        f'(concurrency {best[1]})'
+                    ))
+                else:
+                    self.stdout.write(self.style.WARNING(f'{label}: no level met the latency target'))
+        finally:
+            user.delete()
+
+    async def run(self, backend, username, password, concurrency, logins):
+        latencies = []
+        rejected = 0
+        remaining = iter(range(logins))
+
+        async def worker():
+            nonlocal rejected
+            for _ in remaining:
+                start = time.perf_counter()
+                try:
+                    user = await backend.aauthenticate(None, username=username, password=password)
+                except HashingBusy:
+                    # Back-pressure: a real client would get 503 and retry.
+                    rejected += 1
+                    continue
+                latencies.append((time.perf_counter() - start) * 1000)
+                assert user is not None
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return len(latencies) / elapsed, statistics.median(latencies), p99, rejected
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import deliver_pending, queue_depth
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued emails from the outbox. Use --loop to run as a background sender.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling the outbox instead of exiting.')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = deliver_pending(options['batch_size'])
+            if sent or failed or not options['loop']:
+                self.stdout.write(f'Sent {sent}, failed {failed}, queue depth {queue_depth()}')
+            if not options['loop']:
+                break
+            if not sent and not failed:
+                time.sleep(options['interval'])
@@ -1,6 +1,84 @@
+import time
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import cache
 from django.shortcuts import redirect
 from django.urls import reverse
-from django.urls import reverse_lazy
+from django.utils.functional import SimpleLazyObject, cached_property
+
+from .user_cache import aget_user, get_user
+
+# Session key caching [pk, time] of the user whose email is known to be
+# confirmed, and when that was seen.
+EMAIL_CONFIRMED_SESSION_KEY = '_email_confirmed'
+# When the email of a user was last unconfirmed; flags cached in sessions
+# before then no longer count. Kept as long as a session can live.
+EMAIL_REVOKED_KEY = 'accounts:email-revoked:{}'
+
+
+def mark_email_confirmed(request, user):
+    """
+    Records in the session that the user's email is confirmed, so the
+    middleware no longer needs to look at the profile for this session.
+    """
+    session = getattr(request, 'session', None)
+    if session is not None:
+        session[EMAIL_CONFIRMED_SESSION_KEY] = [user.pk, time.time()]
+
+
+def revoke_email_confirmed(user_pk):
+    cache.set(EMAIL_REVOKED_KEY.format(user_pk), time.time(), settings.SESSION_COOKIE_AGE)
+
+
+def is_marked_confirmed(session, user_pk):
+    marked = session.get(EMAIL_CONFIRMED_SESSION_KEY)
+    # Sessions from before revocation hold the bare pk; they check again.
+    if not isinstance(marked, list) or marked[0] != user_pk:
+        return False
+    revoked = cache.get(EMAIL_REVOKED_KEY.format(user_pk))
+    return revoked is None or marked[1] > revoked
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """
+    AuthenticationMiddleware that loads request.user together with its
+    profile and serves it from the per-process `user_cache` afterwards.
+    """
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: cached_user(request))
+        request.auser = partial(acached_user, request)
+
+
+def cached_user(request):
+    if not hasattr(request, '_cached_user'):
+        request._cached_user = get_user(request)
+    return request._cached_user
+
+
+async def acached_user(request):
+    if not hasattr(request, '_acached_user'):
+        request._acached_user = await aget_user(request)
+    return request._acached_user
+
+
+class RoutePolicy:
+    """
+    Compiled allow-list of paths that unconfirmed users may visit.
+    Exact paths are kept in a frozenset and prefixes in a tuple, so
+    a check is one set lookup plus one str.startswith call.
+    """
+
+    def __init__(self, url_names, path_prefixes):
+        self.paths = frozenset(reverse(name) for name in url_names)
+        self.prefixes = tuple(path_prefixes)
+
+    def allows(self, path):
+        return path in self.paths or path.startswith(self.prefixes)
+
 
 class EmailVerificationMiddleware:
     """
@@ -9,30 +87,48 @@ class EmailVerificationMiddleware:
     they are redirected to the 'account_activation_sent' page.
     """
 
+    allowed_url_names = (
+        'accounts:logout',
+        'accounts:account_activation_sent',
+        'accounts:resend_activation_email',
+        'core:metrics',
+    )
+
+    # Define URL path prefixes that are always allowed.
+    allowed_path_prefixes = (
+        '/admin/',
+        '/accounts/activate/',
+    )
+
     def __init__(self, get_response):
         self.get_response = get_response
 
-    def __call__(self, request):
-        allowed_url_names = [
-            'accounts:logout',
-            'accounts:account_activation_sent',
-            'accounts:resend_activation_email',
-        ]
-        
-        # Define URL path prefixes that are always allowed.
-        allowed_path_prefixes = [
-            '/admin/',
-            '/accounts/activate/',
-        ]
+    @cached_property
+    def policy(self):
+        # Resolved on first use rather than in __init__ so that the URLconf
+        # is not imported while the middleware chain is being built.
+        return RoutePolicy(self.allowed_url_names, self.allowed_path_prefixes)
 
+    def __call__(self, request):
         if (
+            not self.policy.allows(request.path) and
             request.user.is_authenticated and
-            not request.user.profile.email_confirmed and
-            request.path not in [reverse(name) for name in allowed_url_names] and
-            not any(request.path.startswith(prefix) for prefix in allowed_path_prefixes)
+            not self.is_email_confirmed(request)
         ):
             return redirect('accounts:account_activation_sent')
-        
+
         response = self.get_response(request)
         return response
-    
\ No newline at end of file
+
+    def is_email_confirmed(self, request):
+        user = request.user
+        session = getattr(request, 'session', None)
+        if session is not None and is_marked_confirmed(session, user.pk):
+            return True
+        # Only the confirmed state is cached, so other sessions of a user
+        # that activates elsewhere are not left stale. Unconfirming an
+        # account revokes what sessions cached before.
+        if user.profile.email_confirmed:
+            mark_email_confirmed(request, user)
+            return True
+        return False
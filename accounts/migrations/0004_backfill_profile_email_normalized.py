@@ -0,0 +1,63 @@
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def normalize_email_key(email):
+    # Frozen copy of accounts.models.normalize_email_key.
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def backfill_email_normalized(apps, schema_editor):
+    """
+    Fills Profile.email_normalized in primary key order, one batch per
+    transaction, so large tables are not locked for the whole run.
+    When several existing accounts share an address differing only in case,
+    the oldest keeps the key and the others are left NULL.
+    """
+    Profile = apps.get_model('accounts', 'Profile')
+    db_alias = schema_editor.connection.alias
+    profiles = Profile.objects.using(db_alias)
+
+    last_pk = 0
+    while True:
+        batch = list(
+            profiles.filter(pk__gt=last_pk, email_normalized__isnull=True)
+            .order_by('pk')
+            .values_list('pk', 'user__email')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        last_pk = batch[-1][0]
+
+        keys = {}
+        seen = set()
+        for pk, email in batch:
+            key = normalize_email_key(email)
+            if key is not None and key not in seen:
+                keys[pk] = key
+                seen.add(key)
+        taken = set(
+            profiles.filter(email_normalized__in=seen)
+            .values_list('email_normalized', flat=True)
+        )
+        updates = [
+            Profile(pk=pk, email_normalized=key)
+            for pk, key in keys.items() if key not in taken
+        ]
+        with transaction.atomic(using=db_alias):
+            profiles.bulk_update(updates, ['email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0003_profile_email_normalized'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_backfill_profile_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='base_currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+    ]
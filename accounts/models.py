@@ -1,15 +1,191 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_init, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+from .middleware import revoke_email_confirmed
+from .profile_cache import invalidate_profile
+from .user_cache import invalidate_user
+
+
+def normalize_email_key(email):
+    """
+    Returns the case-insensitive lookup key for an email address,
+    or None for a blank address so that it is not subject to uniqueness.
+    """
+    email = (email or '').strip().lower()
+    return email or None
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     email_confirmed = models.BooleanField(default=False)
+    # Lower-cased copy of user.email. auth_user.email has no usable index
+    # for case-insensitive lookups, this column is unique and indexed. NULL
+    # when another account already holds the address in another case.
+    email_normalized = models.CharField(max_length=254, unique=True, null=True, blank=True, editable=False)
+    # Currency the dashboard shows holdings in, see core.fx.
+    base_currency = models.CharField(max_length=3, default='USD')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+    def changed_fields(self):
+        """
+        Returns the names of fields whose value differs from the last
+        state loaded from or written to the database.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+        return [
+            attname for attname, value in loaded.items()
+            if getattr(self, attname) != value
+        ]
+
+
+def create_users_with_profiles(users, batch_size=None):
+    """
+    Bulk creates users together with their profiles using one
+    `bulk_create` per table instead of one INSERT per user.
+    `bulk_create` does not send `post_save`, so profiles are created here.
+    """
+    users = User.objects.bulk_create(users, batch_size=batch_size)
+    Profile.objects.bulk_create(
+        [Profile(user=user, email_normalized=normalize_email_key(user.email)) for user in users],
+        batch_size=batch_size,
+    )
+    return users
+
+
+def write_email_key(write, email_key):
+    """
+    Calls `write` with `email_key`, or with None when another profile holds
+    the key already. Saves through the admin, createsuperuser or the shell
+    skip the signup form's duplicate check; that account keeps the key, so
+    the check still finds the address.
+    """
+    if email_key is not None:
+        try:
+            with transaction.atomic():
+                return write(email_key)
+        except IntegrityError:
+            pass
+    return write(None)
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_email(sender, instance, **kwargs):
+    # Read from __dict__ so that a deferred email field is not loaded here.
+    instance._loaded_email = instance.__dict__.get('email')
 
 
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+def create_or_update_user_profile(sender, instance, created, update_fields, **kwargs):
+    email_key = normalize_email_key(instance.email)
     if created:
-        Profile.objects.create(user=instance)
-    instance.profile.save()
+        write_email_key(lambda key: Profile.objects.create(user=instance, email_normalized=key), email_key)
+        instance._loaded_email = instance.email
+        return
+
+    email_changed = (
+        (update_fields is None or 'email' in update_fields) and
+        instance.__dict__.get('email') != instance._loaded_email
+    )
+    if email_changed:
+        instance._loaded_email = instance.email
+
+    # Only a profile that was already loaded through this user can carry
+    # unsaved changes; saving it unconditionally would cost a SELECT and an
+    # UPDATE on every User save (e.g. the last_login update on each login).
+    profile = User.profile.related.get_cached_value(instance, default=None)
+    if profile is None:
+        if email_changed:
+            write_email_key(lambda key: Profile.objects.filter(user=instance).update(email_normalized=key), email_key)
+        return
+    if email_changed:
+        profile.email_normalized = email_key
+    fields = None if profile._state.adding else profile.changed_fields()
+    if fields is not None and 'email_normalized' not in fields:
+        if fields:
+            profile.save(update_fields=fields)
+        return
+
+    def save(key):
+        profile.email_normalized = key
+        profile.save(update_fields=fields)
+
+    write_email_key(save, profile.email_normalized)
+
+
+# Fields of User shown on the public profile page.
+PROFILE_PAGE_FIELDS = frozenset({'username', 'email'})
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_profile_page(sender, instance, update_fields=None, **kwargs):
+    # Skip saves that cannot affect the page, such as the last_login update.
+    if update_fields is None or PROFILE_PAGE_FIELDS.intersection(update_fields):
+        invalidate_profile(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_page(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
+
+
+@receiver(post_save, sender=Profile)
+def revoke_cached_confirmation(sender, instance, created, **kwargs):
+    if not created and not instance.email_confirmed:
+        revoke_email_confirmed(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=Profile)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers password changes and activation; other processes pick them up
+    # when their entry expires after AUTH_USER_CACHE_TTL.
+    invalidate_user(instance.pk if sender is User else instance.user_id)
+
+
+class OutgoingEmail(models.Model):
+    """
+    A message waiting in the outbox to be delivered by the `send_outbox` command.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=254, blank=True)
+    recipients = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)}'
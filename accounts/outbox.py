@@ -0,0 +1,142 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+
+def enqueue_email(subject, message, from_email, recipient_list, html_message=None):
+    """
+    Stores a message in the outbox instead of talking to the mail server
+    inside the request. Delivery is done by `deliver_pending`.
+    """
+    outgoing = build_outgoing_email(subject, message, from_email, recipient_list, html_message)
+    outgoing.save()
+    return outgoing
+
+
+def build_outgoing_email(subject, message, from_email, recipient_list, html_message=None):
+    return OutgoingEmail(
+        subject=subject,
+        body=message,
+        html_body=html_message or '',
+        from_email=from_email or '',
+        recipients=list(recipient_list),
+    )
+
+
+def enqueue_emails(outgoing_emails, batch_size=1000):
+    """
+    Stores many messages built with `build_outgoing_email` using one INSERT
+    per batch. Returns the number of queued messages.
+    """
+    queued = 0
+    batch = []
+    for outgoing in outgoing_emails:
+        batch.append(outgoing)
+        if len(batch) >= batch_size:
+            OutgoingEmail.objects.bulk_create(batch)
+            queued += len(batch)
+            batch = []
+    if batch:
+        OutgoingEmail.objects.bulk_create(batch)
+        queued += len(batch)
+    return queued
+
+
+def queue_depth():
+    """
+    Returns the number of messages still waiting to be delivered.
+    """
+    return OutgoingEmail.objects.filter(status=OutgoingEmail.STATUS_PENDING).count()
+
+
+def retry_delay(attempts):
+    """
+    Exponential backoff: base delay doubled for every failed attempt, capped.
+    """
+    base = settings.EMAIL_OUTBOX_RETRY_DELAY
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_MAX_RETRY_DELAY))
+
+
+def claim_batch(batch_size):
+    """
+    Leases up to `batch_size` due messages so that concurrent senders skip them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            OutgoingEmail.objects
+            .select_for_update(skip_locked=True)
+            .filter(status=OutgoingEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        OutgoingEmail.objects.filter(pk__in=ids).update(
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE)
+        )
+    return list(OutgoingEmail.objects.filter(pk__in=ids).order_by('next_attempt_at', 'pk'))
+
+
+def build_message(outgoing, connection):
+    message = EmailMultiAlternatives(
+        outgoing.subject,
+        outgoing.body,
+        outgoing.from_email or None,
+        outgoing.recipients,
+        connection=connection,
+    )
+    if outgoing.html_body:
+        message.attach_alternative(outgoing.html_body, 'text/html')
+    return message
+
+
+def deliver_pending(batch_size=None):
+    """
+    Sends one batch of due messages over a single mail server connection.
+    Failed messages are rescheduled with backoff until EMAIL_OUTBOX_MAX_ATTEMPTS
+    is reached. Returns a (sent, failed) tuple.
+    """
+    batch = claim_batch(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as exc:
+        for outgoing in batch:
+            mark_failed(outgoing, exc)
+        return 0, len(batch)
+
+    try:
+        for outgoing in batch:
+            try:
+                connection.send_messages([build_message(outgoing, connection)])
+            except Exception as exc:
+                mark_failed(outgoing, exc)
+                failed += 1
+            else:
+                outgoing.status = OutgoingEmail.STATUS_SENT
+                outgoing.attempts += 1
+                outgoing.sent_at = timezone.now()
+                outgoing.last_error = ''
+                outgoing.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def mark_failed(outgoing, exc):
+    outgoing.attempts += 1
+    outgoing.last_error = repr(exc)
+    if outgoing.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        outgoing.status = OutgoingEmail.STATUS_FAILED
+    else:
+        outgoing.next_attempt_at = timezone.now() + retry_delay(outgoing.attempts)
+    outgoing.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at'])
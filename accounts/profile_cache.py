@@ -0,0 +1,36 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+
+PROFILE_VERSION_KEY = 'accounts:profile-version:{}'
+
+
+def get_profile_version(user_pk):
+    """
+    Returns the version of a user's public profile page: the timestamp of
+    its last change, used both in fragment cache keys and as Last-Modified.
+    """
+    key = PROFILE_VERSION_KEY.format(user_pk)
+    version = cache.get(key)
+    if version is None:
+        # Unknown after a cache flush, so assume it changed just now.
+        cache.add(key, time.time(), None)
+        version = cache.get(key)
+    return version
+
+
+def invalidate_profile(user_pk):
+    cache.set(PROFILE_VERSION_KEY.format(user_pk), time.time(), None)
+
+
+def invalidate_profiles(user_pks):
+    now = time.time()
+    cache.set_many({PROFILE_VERSION_KEY.format(pk): now for pk in user_pks}, None)
+
+
+def profile_etag(profile_user, version, viewer):
+    # The navbar shows the viewer, so the tag depends on who is looking too.
+    viewer_id = viewer.pk if viewer.is_authenticated else 'anonymous'
+    digest = hashlib.md5(f'{profile_user.pk}:{version}:{viewer_id}'.encode()).hexdigest()
+    return f'"{digest}"'
@@ -0,0 +1,162 @@
+import functools
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+    Parses a rate such as '5/m' or '100/h' into (limit, period in seconds).
+    """
+    limit, period = rate.split('/')
+    return int(limit), PERIODS[period]
+
+
+def window_weight(now, period):
+    # Share of the previous window that still overlaps the sliding window.
+    return 1 - (now % period) / period
+
+
+class LocalMemoryBackend:
+    """
+    Sliding window counters kept in this process. Each key holds only the
+    counts of the current and previous fixed window, so a check is O(1).
+    Keys are kept in the order they were last hit; once there are
+    `max_keys` of them, a new key evicts the least recently hit one.
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, limit, period, now):
+        window = int(now // period)
+        with self._lock:
+            start, previous, current, _ = self._windows.get(key, (window, 0, 0, period))
+            if start == window - 1:
+                previous, current = current, 0
+            elif start != window:
+                previous, current = 0, 0
+            current += 1
+            if key in self._windows:
+                self._windows.move_to_end(key)
+            elif len(self._windows) >= self.max_keys:
+                self._windows.popitem(last=False)
+            self._windows[key] = (window, previous, current, period)
+        return previous * window_weight(now, period) + current <= limit
+
+    def clear(self):
+        with self._lock:
+            self._windows.clear()
+
+
+class CacheBackend:
+    """
+    Sliding window counters in the Django cache named by RATELIMIT_CACHE, so
+    every process behind a shared cache (e.g. Redis, Memcached) sees the same
+    counts. A check is one add, one incr and one get.
+    """
+
+    def hit(self, key, limit, period, now):
+        cache = caches[settings.RATELIMIT_CACHE]
+        # Keys carry submitted usernames, hash them to keep them cache-safe.
+        key = hashlib.md5(key.encode()).hexdigest()
+        window = int(now // period)
+        current_key = f'ratelimit:{key}:{period}:{window}'
+        cache.add(current_key, 0, period * 2)
+        try:
+            current = cache.incr(current_key)
+        except ValueError:
+            # Evicted between add() and incr().
+            cache.set(current_key, 1, period * 2)
+            current = 1
+        previous = cache.get(f'ratelimit:{key}:{period}:{window - 1}', 0)
+        return previous * window_weight(now, period) + current <= limit
+
+    def clear(self):
+        caches[settings.RATELIMIT_CACHE].clear()
+
+
+@functools.cache
+def get_backend(path):
+    return import_string(path)()
+
+
+def client_ip(request):
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def client_user(request):
+    """
+    Identifies the user a request acts for: the logged in user, or for
+    anonymous forms the submitted username or email.
+    """
+    if request.user.is_authenticated:
+        return str(request.user.pk)
+    identity = request.POST.get('username') or request.POST.get('email') or ''
+    return identity.strip().lower() or None
+
+
+KEY_FUNCTIONS = {
+    'ip': client_ip,
+    'user': client_user,
+}
+
+
+def is_limited(request, view_name, rule, now=None):
+    """
+    Records a hit against every limit of `rule` and returns the number of
+    seconds to wait if any of them is exceeded, otherwise None.
+    """
+    if request.method not in rule.get('methods', ('GET', 'POST')):
+        return None
+    now = time.time() if now is None else now
+    backend = get_backend(settings.RATELIMIT_BACKEND)
+    retry_after = None
+    for key_name, key_function in KEY_FUNCTIONS.items():
+        if key_name not in rule:
+            continue
+        key_value = key_function(request)
+        if key_value is None:
+            continue
+        limit, period = parse_rate(rule[key_name])
+        if not backend.hit(f'{view_name}:{key_name}:{key_value}', limit, period, now):
+            retry_after = max(retry_after or 0, int(period - now % period) + 1)
+    return retry_after
+
+
+class RateLimitMiddleware:
+    """
+    Applies the per-route limits from the RATELIMITS setting, keyed by the
+    resolved URL name (e.g. 'accounts:login'). Routes without a rule only
+    cost a dict lookup.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not settings.RATELIMIT_ENABLED:
+            return None
+        view_name = request.resolver_match.view_name
+        rule = settings.RATELIMITS.get(view_name)
+        if rule is None:
+            return None
+        retry_after = is_limited(request, view_name, rule)
+        if retry_after is None:
+            return None
+        response = HttpResponse('Too many requests, please try again later.', status=429)
+        response.headers['Retry-After'] = str(retry_after)
+        return response
@@ -1,18 +1,35 @@
+import threading
+import time
+from io import StringIO
 from unittest.mock import patch
+from asgiref.sync import async_to_sync
+from django.conf import settings
 from django.test import TestCase, Client, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password
 from django.contrib.auth.models import AnonymousUser
 from django.contrib.messages import get_messages
 from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
 from django.http import HttpResponse
+from django.utils import timezone
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
 
+from .admin import EstimatedCountPaginator
 from .forms import CustomUserCreationForm
-from .middleware import EmailVerificationMiddleware
-from .models import Profile
+from .hashing import get_pool
+from .ratelimit import CacheBackend, LocalMemoryBackend
+from .middleware import EMAIL_CONFIRMED_SESSION_KEY, CachedAuthenticationMiddleware, EmailVerificationMiddleware
+from .models import OutgoingEmail, Profile, create_users_with_profiles
+from .outbox import deliver_pending, enqueue_email, queue_depth
+from .user_cache import UserCache, user_cache
 from .utils import send_activation_email
 
 User = get_user_model()
@@ -31,6 +48,57 @@ class ProfileModelTests(TestCase):
         self.assertTrue(Profile.objects.filter(user=user).exists())
 
 
+class NormalizedEmailTests(TestCase):
+    def test_profile_stores_normalized_email(self):
+        user = User.objects.create_user('mia', ' Mia@Example.COM', 'StrongPass123')
+        self.assertEqual(Profile.objects.get(user=user).email_normalized, 'mia@example.com')
+
+    def test_blank_email_is_not_unique(self):
+        User.objects.create_user('nina', '', 'StrongPass123')
+        User.objects.create_user('olaf', '', 'StrongPass123')
+        self.assertEqual(Profile.objects.filter(email_normalized__isnull=True).count(), 2)
+
+    def test_email_change_updates_normalized_email(self):
+        User.objects.create_user('piotr', 'piotr@example.com', 'StrongPass123')
+        user = User.objects.get(username='piotr')
+        user.email = 'Piotr.New@Example.com'
+        user.save()
+        self.assertEqual(Profile.objects.get(user=user).email_normalized, 'piotr.new@example.com')
+
+    def test_email_change_updates_loaded_profile(self):
+        user = User.objects.create_user('quinn', 'quinn@example.com', 'StrongPass123')
+        user.email = 'QUINN2@example.com'
+        user.save()
+        self.assertEqual(user.profile.email_normalized, 'quinn2@example.com')
+        self.assertEqual(Profile.objects.get(user=user).email_normalized, 'quinn2@example.com')
+
+    def test_case_duplicate_saved_outside_the_form_keeps_no_key(self):
+        rita = User.objects.create_user('rita', 'rita@example.com', 'StrongPass123')
+        # As createsuperuser, an admin edit or the shell would.
+        duplicate = User.objects.create_user('rita2', 'RITA@example.com', 'StrongPass123')
+        self.assertIsNone(Profile.objects.get(user=duplicate).email_normalized)
+        other = User.objects.create_user('rita3', 'rita3@example.com', 'StrongPass123')
+        other.email = 'Rita@Example.com'
+        other.save()
+        self.assertIsNone(Profile.objects.get(user=other).email_normalized)
+        self.assertEqual(Profile.objects.get(user=rita).email_normalized, 'rita@example.com')
+
+    @patch('accounts.views.send_activation_email')
+    def test_register_race_reports_duplicate_email(self, mock_send):
+        User.objects.create_user('sara', 'sara@example.com', 'StrongPass123')
+        with patch('accounts.forms.CustomUserCreationForm.clean_email', lambda form: form.cleaned_data['email']):
+            response = self.client.post(reverse('accounts:register'), {
+                'username': 'sara2',
+                'email': 'Sara@example.com',
+                'password1': 'StrongPass123',
+                'password2': 'StrongPass123',
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('email', response.context['form'].errors)
+        self.assertFalse(User.objects.filter(username='sara2').exists())
+        mock_send.assert_not_called()
+
+
 class CustomUserCreationFormTests(TestCase):
     def test_form_accepts_valid_payload(self):
         form = CustomUserCreationForm(data={
@@ -52,6 +120,17 @@ class CustomUserCreationFormTests(TestCase):
         self.assertFalse(form.is_valid())
         self.assertIn('email', form.errors)
 
+    def test_form_duplicate_check_uses_normalized_email(self):
+        User.objects.create_user('dana', 'Duplicate@Example.com', 'StrongPass123')
+        form = CustomUserCreationForm(data={
+            'username': 'duplicate',
+            'email': 'duplicate@example.COM',
+            'password1': 'StrongPass123',
+            'password2': 'StrongPass123',
+        })
+        form.is_valid()
+        self.assertIn('email', form.errors)
+
 
 @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
 class AccountViewTests(TestCase):
@@ -68,6 +147,15 @@ class AccountViewTests(TestCase):
         self.assertTemplateUsed(response, 'accounts/profile.html')
         self.assertEqual(response.context['profile_user'], self.confirmed_user)
 
+    def test_base_currency_is_set_from_the_profile_page(self):
+        self.client.force_login(self.confirmed_user)
+        url = reverse('accounts:base_currency')
+        response = self.client.post(url, {'base_currency': 'PLN'})
+        self.assertRedirects(response, reverse('accounts:profile', kwargs={'username': 'eve'}))
+        self.client.post(url, {'base_currency': 'XXX'})
+        self.confirmed_user.profile.refresh_from_db()
+        self.assertEqual(self.confirmed_user.profile.base_currency, 'PLN')
+
     def test_profile_view_returns_404_for_missing_user(self):
         response = self.client.get(reverse('accounts:profile', kwargs={'username': 'missing'}))
         self.assertEqual(response.status_code, 404)
@@ -179,6 +267,7 @@ class AccountViewTests(TestCase):
         self.unconfirmed_user.refresh_from_db()
         self.assertTrue(self.unconfirmed_user.profile.email_confirmed)
         self.assertTrue(response.wsgi_request.user.is_authenticated)
+        self.assertEqual(self.client.session[EMAIL_CONFIRMED_SESSION_KEY][0], self.unconfirmed_user.pk)
 
     def test_activate_view_with_invalid_token_renders_error_template(self):
         uid = urlsafe_base64_encode(force_bytes(self.unconfirmed_user.pk))
@@ -218,6 +307,7 @@ class AccountViewTests(TestCase):
 
 class EmailVerificationMiddlewareTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.factory = RequestFactory()
         self.middleware = EmailVerificationMiddleware(lambda request: HttpResponse('OK'))
         self.confirmed_user = User.objects.create_user('gina', 'gina@example.com', 'StrongPass123')
@@ -256,6 +346,59 @@ class EmailVerificationMiddlewareTests(TestCase):
         response = self.middleware(request)
         self.assertEqual(response.status_code, 200)
 
+    def test_middleware_caches_confirmed_state_in_session(self):
+        session = {}
+        request = self.factory.get('/protected/')
+        request.user = User.objects.get(pk=self.confirmed_user.pk)
+        request.session = session
+        with self.assertNumQueries(1):
+            self.middleware(request)
+        self.assertEqual(session[EMAIL_CONFIRMED_SESSION_KEY][0], self.confirmed_user.pk)
+
+        request = self.factory.get('/protected/')
+        request.user = User.objects.get(pk=self.confirmed_user.pk)
+        request.session = session
+        with self.assertNumQueries(0):
+            response = self.middleware(request)
+        self.assertEqual(response.status_code, 200)
+
+    def test_middleware_does_not_cache_unconfirmed_state(self):
+        session = {}
+        request = self.factory.get('/protected/')
+        request.user = self.unconfirmed_user
+        request.session = session
+        self.middleware(request)
+        self.assertNotIn(EMAIL_CONFIRMED_SESSION_KEY, session)
+
+    def test_middleware_ignores_cached_state_of_other_user(self):
+        request = self.factory.get('/protected/')
+        request.user = self.unconfirmed_user
+        request.session = {EMAIL_CONFIRMED_SESSION_KEY: [self.confirmed_user.pk, time.time()]}
+        response = self.middleware(request)
+        self.assertEqual(response.status_code, 302)
+
+    def test_unconfirming_revokes_cached_state(self):
+        session = {}
+        request = self.factory.get('/protected/')
+        request.user = User.objects.get(pk=self.confirmed_user.pk)
+        request.session = session
+        self.middleware(request)
+        profile = Profile.objects.get(user=self.confirmed_user)
+        profile.email_confirmed = False
+        profile.save()
+
+        request = self.factory.get('/protected/')
+        request.user = User.objects.get(pk=self.confirmed_user.pk)
+        request.session = session
+        self.assertEqual(self.middleware(request).status_code, 302)
+
+    def test_middleware_skips_user_lookup_on_whitelisted_paths(self):
+        request = self.factory.get('/admin/dashboard/')
+        request.user = self.unconfirmed_user
+        with self.assertNumQueries(0):
+            response = self.middleware(request)
+        self.assertEqual(response.status_code, 200)
+
 
 @override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
 class SendActivationEmailTests(TestCase):
@@ -266,6 +409,9 @@ class SendActivationEmailTests(TestCase):
     def test_send_activation_email_enqueues_message(self):
         request = self.factory.get('/')
         send_activation_email(request, self.user)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(queue_depth(), 1)
+        deliver_pending()
         self.assertEqual(len(mail.outbox), 1)
         message = mail.outbox[0]
         self.assertEqual(message.subject, 'Activate Your Account')
@@ -284,7 +430,10 @@ class PasswordResetFlowTests(TestCase):
     def test_password_reset_end_to_end(self):
         response = self.client.post(reverse('accounts:password_reset'), {'email': 'john@example.com'}, follow=True)
         self.assertTemplateUsed(response, 'registration/password_reset_done.html')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(deliver_pending(), (1, 0))
         self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['john@example.com'])
 
         uid = urlsafe_base64_encode(force_bytes(self.user.pk))
         token = default_token_generator.make_token(self.user)
@@ -301,3 +450,447 @@ class PasswordResetFlowTests(TestCase):
         self.user.refresh_from_db()
         self.assertTrue(self.user.check_password('ResetPass123'))
         self.assertTrue(self.client.login(username='john', password='ResetPass123'))
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class OutboxTests(TestCase):
+    def test_deliver_pending_sends_batch_over_one_connection(self):
+        for i in range(3):
+            enqueue_email(f'Subject {i}', 'Body', 'from@example.com', [f'user{i}@example.com'])
+        with patch('accounts.outbox.get_connection', wraps=get_connection) as mock_connection:
+            self.assertEqual(deliver_pending(), (3, 0))
+        self.assertEqual(mock_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(queue_depth(), 0)
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.STATUS_SENT).exists())
+
+    def test_deliver_pending_respects_batch_size(self):
+        for i in range(3):
+            enqueue_email(f'Subject {i}', 'Body', 'from@example.com', [f'user{i}@example.com'])
+        self.assertEqual(deliver_pending(batch_size=2), (2, 0))
+        self.assertEqual(queue_depth(), 1)
+
+    def test_failed_message_is_retried_with_backoff(self):
+        outgoing = enqueue_email('Subject', 'Body', 'from@example.com', ['user@example.com'])
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            self.assertEqual(deliver_pending(), (0, 1))
+        outgoing.refresh_from_db()
+        self.assertEqual(outgoing.status, OutgoingEmail.STATUS_PENDING)
+        self.assertEqual(outgoing.attempts, 1)
+        self.assertIn('down', outgoing.last_error)
+        self.assertGreater(outgoing.next_attempt_at, timezone.now())
+
+        # Not due yet, so nothing is picked up.
+        self.assertEqual(deliver_pending(), (0, 0))
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(deliver_pending(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+    def test_message_is_marked_failed_after_max_attempts(self):
+        outgoing = enqueue_email('Subject', 'Body', 'from@example.com', ['user@example.com'])
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('down')):
+            deliver_pending()
+        outgoing.refresh_from_db()
+        self.assertEqual(outgoing.status, OutgoingEmail.STATUS_FAILED)
+        self.assertEqual(queue_depth(), 0)
+
+    def test_send_outbox_command_reports_queue_depth(self):
+        enqueue_email('Subject', 'Body', 'from@example.com', ['user@example.com'])
+        out = StringIO()
+        call_command('send_outbox', stdout=out)
+        self.assertIn('Sent 1, failed 0, queue depth 0', out.getvalue())
+
+
+class ProfileWriteTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('kate', 'kate@example.com', 'StrongPass123')
+
+    def test_create_user_writes_profile_once(self):
+        # INSERT user, INSERT profile in a savepoint
+        with self.assertNumQueries(4):
+            User.objects.create_user('liam', 'liam@example.com')
+
+    def test_user_save_without_loaded_profile_does_not_touch_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_user_save_with_unchanged_profile_does_not_touch_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.profile
+        with self.assertNumQueries(1):
+            user.save()
+
+    def test_user_save_writes_changed_profile_fields(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.profile.email_confirmed = True
+        with self.assertNumQueries(2):
+            user.save()
+        self.assertTrue(Profile.objects.get(user=self.user).email_confirmed)
+
+    def test_create_users_with_profiles_uses_one_insert_per_table(self):
+        users = [User(username=f'bulk{i}', email=f'bulk{i}@example.com') for i in range(20)]
+        with self.assertNumQueries(2):
+            create_users_with_profiles(users)
+        self.assertEqual(Profile.objects.filter(user__username__startswith='bulk').count(), 20)
+
+    def test_login_runs_minimum_number_of_queries(self):
+        # SELECT user, create the new session (SELECT, INSERT in a savepoint),
+        # UPDATE last_login and save the session (UPDATE in a savepoint).
+        # Nothing may touch accounts_profile.
+        with self.assertNumQueries(9):
+            response = self.client.post(reverse('accounts:login'), {
+                'username': 'kate',
+                'password': 'StrongPass123',
+            })
+        self.assertEqual(response.status_code, 302)
+
+
+class ProfilePageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.owner = User.objects.create_user('tom', 'tom@example.com', 'StrongPass123')
+        self.owner.profile.email_confirmed = True
+        self.owner.profile.save()
+        self.url = reverse('accounts:profile', kwargs={'username': 'tom'})
+
+    def test_profile_is_loaded_with_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'tom@example.com')
+
+    def test_repeat_visit_returns_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        response = self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since_returns_not_modified(self):
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, headers={'If-Modified-Since': response['Last-Modified']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_user_change_invalidates_page(self):
+        etag = self.client.get(self.url)['ETag']
+        self.owner.email = 'tom.new@example.com'
+        self.owner.save()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'tom.new@example.com')
+
+    def test_profile_change_invalidates_page(self):
+        etag = self.client.get(self.url)['ETag']
+        self.owner.profile.email_confirmed = False
+        self.owner.profile.save()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_login_update_keeps_page_cached(self):
+        etag = self.client.get(self.url)['ETag']
+        self.owner.save(update_fields=['last_login'])
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_owner_gets_full_page_without_conditional_headers(self):
+        self.client.login(username='tom', password='StrongPass123')
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertContains(response, reverse('accounts:password_change'))
+
+    def test_etag_depends_on_viewer(self):
+        anonymous_etag = self.client.get(self.url)['ETag']
+        viewer = User.objects.create_user('uma', 'uma@example.com', 'StrongPass123')
+        viewer.profile.email_confirmed = True
+        viewer.profile.save()
+        self.client.login(username='uma', password='StrongPass123')
+        response = self.client.get(self.url, headers={'If-None-Match': anonymous_etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, reverse('accounts:password_change'))
+
+
+class PasswordHashingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('vera', 'vera@example.com', 'StrongPass123')
+        self.user.profile.email_confirmed = True
+        self.user.profile.save()
+
+    def test_hasher_uses_configured_iterations(self):
+        self.assertTrue(self.user.password.startswith(f'pbkdf2_sha256${settings.PASSWORD_HASHER_ITERATIONS}$'))
+
+    def test_login_rehashes_password_with_new_work_factor(self):
+        with override_settings(PASSWORD_HASHER_ITERATIONS=settings.PASSWORD_HASHER_ITERATIONS + 1):
+            response = self.client.post(reverse('accounts:login'), {
+                'username': 'vera',
+                'password': 'StrongPass123',
+            })
+            self.assertEqual(response.status_code, 302)
+            self.user.refresh_from_db()
+            self.assertTrue(self.user.password.startswith(f'pbkdf2_sha256${settings.PASSWORD_HASHER_ITERATIONS}$'))
+
+    def test_hashing_runs_in_pool_threads(self):
+        threads = []
+
+        def record(*args):
+            threads.append(threading.current_thread().name)
+            return check_password(*args)
+
+        with patch('accounts.backends.check_password', record):
+            self.client.post(reverse('accounts:login'), {
+                'username': 'vera',
+                'password': 'StrongPass123',
+            })
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('password-hashing'))
+
+    def test_full_pool_rejects_with_service_unavailable(self):
+        _, slots = get_pool()
+        acquired = 0
+        while slots.acquire(blocking=False):
+            acquired += 1
+        try:
+            response = self.client.post(reverse('accounts:login'), {
+                'username': 'vera',
+                'password': 'StrongPass123',
+            })
+        finally:
+            for _ in range(acquired):
+                slots.release()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_password_change_rejects_wrong_old_password(self):
+        self.client.login(username='vera', password='StrongPass123')
+        response = self.client.post(reverse('accounts:password_change'), {
+            'old_password': 'WrongPass123',
+            'new_password1': 'EvenStrongerPass123',
+            'new_password2': 'EvenStrongerPass123',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('old_password', response.context['form'].errors)
+
+    def test_password_change_keeps_session(self):
+        self.client.login(username='vera', password='StrongPass123')
+        self.client.post(reverse('accounts:password_change'), {
+            'old_password': 'StrongPass123',
+            'new_password1': 'EvenStrongerPass123',
+            'new_password2': 'EvenStrongerPass123',
+        })
+        response = self.client.get(reverse('accounts:password_change'))
+        self.assertEqual(response.status_code, 200)
+
+
+class RateLimitBackendTests(TestCase):
+    def check_burst(self, backend):
+        now = 1_000_000.0
+        results = [backend.hit('burst', 5, 60, now) for _ in range(8)]
+        self.assertEqual(results, [True] * 5 + [False] * 3)
+        # Other keys have their own budget.
+        self.assertTrue(backend.hit('other', 5, 60, now))
+
+    def check_sliding_window(self, backend):
+        start = 1_000_000.0 - 1_000_000.0 % 60
+        for _ in range(5):
+            self.assertTrue(backend.hit('slide', 5, 60, start + 50))
+        # Just after the window boundary most of the previous hits still count.
+        self.assertFalse(backend.hit('slide', 5, 60, start + 61))
+        # Two windows later everything has expired.
+        self.assertTrue(backend.hit('slide', 5, 60, start + 180))
+
+    def test_local_memory_backend_burst(self):
+        self.check_burst(LocalMemoryBackend())
+
+    def test_local_memory_backend_sliding_window(self):
+        self.check_sliding_window(LocalMemoryBackend())
+
+    def test_local_memory_backend_evicts_least_recently_hit_keys(self):
+        backend = LocalMemoryBackend(max_keys=10)
+        for i in range(10):
+            backend.hit(f'key{i}', 5, 60, 0.0)
+        backend.hit('key0', 5, 60, 1.0)
+        for i in range(3):
+            backend.hit(f'fresh{i}', 5, 60, 2.0)
+        self.assertEqual(len(backend._windows), 10)
+        self.assertEqual(list(backend._windows)[:2], ['key4', 'key5'])
+        self.assertIn('key0', backend._windows)
+
+    def test_cache_backend_burst(self):
+        cache.clear()
+        self.check_burst(CacheBackend())
+
+    def test_cache_backend_sliding_window(self):
+        cache.clear()
+        self.check_sliding_window(CacheBackend())
+
+
+@override_settings(RATELIMIT_ENABLED=True, EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class RateLimitMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('walt', 'walt@example.com', 'StrongPass123')
+
+    def post_login(self, username='walt', ip='10.0.0.1'):
+        return self.client.post(reverse('accounts:login'), {
+            'username': username,
+            'password': 'WrongPass123',
+        }, REMOTE_ADDR=ip)
+
+    @override_settings(RATELIMITS={'accounts:login': {'methods': ('POST',), 'ip': '100/m', 'user': '3/m'}})
+    def test_login_burst_is_limited_per_user(self):
+        statuses = [self.post_login().status_code for _ in range(5)]
+        self.assertEqual(statuses, [200, 200, 200, 429, 429])
+        # Another username from the same address still gets through.
+        self.assertEqual(self.post_login(username='someone').status_code, 200)
+
+    @override_settings(RATELIMITS={'accounts:login': {'methods': ('POST',), 'ip': '3/m'}})
+    def test_login_burst_is_limited_per_ip(self):
+        statuses = [self.post_login(username=f'user{i}').status_code for i in range(4)]
+        self.assertEqual(statuses, [200, 200, 200, 429])
+        response = self.post_login(username='user4')
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.post_login(ip='10.0.0.2').status_code, 200)
+
+    @override_settings(RATELIMITS={'accounts:login': {'methods': ('POST',), 'ip': '1/m'}})
+    def test_get_requests_are_not_limited_by_post_rule(self):
+        for _ in range(3):
+            self.assertEqual(self.client.get(reverse('accounts:login')).status_code, 200)
+
+    @override_settings(RATELIMITS={'accounts:resend_activation_email': {'user': '2/h'}})
+    def test_resend_activation_email_is_limited_per_user(self):
+        self.client.login(username='walt', password='StrongPass123')
+        url = reverse('accounts:resend_activation_email')
+        statuses = [self.client.get(url).status_code for _ in range(3)]
+        self.assertEqual(statuses, [302, 302, 429])
+        self.assertEqual(OutgoingEmail.objects.count(), 2)
+
+    @override_settings(RATELIMITS={'accounts:password_reset': {'methods': ('POST',), 'user': '1/h'}})
+    def test_password_reset_is_limited_per_email(self):
+        url = reverse('accounts:password_reset')
+        self.assertEqual(self.client.post(url, {'email': 'walt@example.com'}).status_code, 302)
+        self.assertEqual(self.client.post(url, {'email': 'WALT@example.com'}).status_code, 429)
+
+    @override_settings(RATELIMIT_ENABLED=False, RATELIMITS={'accounts:login': {'methods': ('POST',), 'ip': '1/m'}})
+    def test_disabled_limiter_lets_everything_through(self):
+        statuses = [self.post_login().status_code for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 200])
+
+
+class UserAdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'StrongPass123')
+        self.admin.profile.email_confirmed = True
+        self.admin.profile.save()
+        self.client.force_login(self.admin)
+        create_users_with_profiles([User(username=f'member{i}', email=f'member{i}@example.com') for i in range(30)])
+        self.url = reverse('admin:auth_user_changelist')
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        create_users_with_profiles([User(username=f'extra{i}', email=f'extra{i}@example.com') for i in range(30)])
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Email confirmed')
+        self.assertEqual(len(few), len(many))
+
+    def test_changelist_filters_on_email_confirmed(self):
+        response = self.client.get(self.url, {'profile__email_confirmed__exact': '1'})
+        self.assertEqual(list(response.context['cl'].result_list), [self.admin])
+
+    def test_confirm_email_action(self):
+        pks = list(User.objects.filter(username__startswith='member').values_list('pk', flat=True)[:5])
+        self.client.post(self.url, {'action': 'confirm_email', '_selected_action': pks})
+        self.assertEqual(Profile.objects.filter(user_id__in=pks, email_confirmed=True).count(), 5)
+
+    def test_resend_activation_email_action_queues_messages_in_batches(self):
+        pks = list(User.objects.values_list('pk', flat=True))
+        with patch('accounts.admin.CustomUserAdmin.batch_size', 10), CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {'action': 'resend_activation_email', '_selected_action': pks})
+        # Only the 30 unconfirmed members, the admin is confirmed.
+        self.assertEqual(queue_depth(), 30)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "accounts_outgoingemail"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_paginator_falls_back_to_exact_count(self):
+        paginator = EstimatedCountPaginator(User.objects.order_by('pk'), 10)
+        self.assertEqual(paginator.count, 31)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user('cached', 'cached@example.com', 'StrongPass123')
+        self.user.profile.email_confirmed = True
+        self.user.profile.save()
+        self.client.force_login(self.user)
+        # Drop the entry left by the last_login update of force_login.
+        user_cache.clear()
+
+    def load_user(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        # Load the session outside of the measured blocks.
+        request.session.keys()
+        CachedAuthenticationMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def test_user_and_profile_are_loaded_in_one_query(self):
+        request = self.load_user()
+        with self.assertNumQueries(1):
+            self.assertEqual(request.user.pk, self.user.pk)
+            self.assertTrue(request.user.profile.email_confirmed)
+
+    def test_user_is_served_from_cache(self):
+        self.load_user().user.profile
+        request = self.load_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(request.user.profile.email_confirmed)
+        # Each request works on its own copy.
+        self.assertIsNot(request.user._wrapped, self.load_user().user._wrapped)
+
+    def test_async_user_is_served_from_cache(self):
+        async def load(request):
+            return await request.auser()
+
+        self.assertEqual(async_to_sync(load)(self.load_user()).pk, self.user.pk)
+        request = self.load_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(async_to_sync(load)(request).profile.email_confirmed)
+
+    @override_settings(AUTH_USER_CACHE_TTL=0)
+    def test_cache_can_be_disabled(self):
+        self.load_user().user.profile
+        request = self.load_user()
+        with self.assertNumQueries(1):
+            request.user.profile
+
+    def test_password_change_invalidates_cached_user(self):
+        self.load_user().user.profile
+        self.user.set_password('NewStrongPass456')
+        self.user.save()
+        # The session still carries the hash of the old password.
+        self.assertFalse(self.load_user().user.is_authenticated)
+
+    def test_invalidation_drops_only_that_users_entries(self):
+        cache = UserCache()
+        for key in (('1', 'backend', 'a'), ('1', 'backend', 'b'), ('2', 'backend', 'a')):
+            cache.set(key, self.user, now=0)
+        cache.invalidate([1])
+        self.assertEqual(list(cache._entries), [('2', 'backend', 'a')])
+        self.assertIsNotNone(cache.get(('2', 'backend', 'a'), now=0))
+
+    def test_activation_invalidates_cached_user(self):
+        self.user.profile.email_confirmed = False
+        self.user.profile.save()
+        self.assertFalse(self.load_user().user.profile.email_confirmed)
+        uid = urlsafe_base64_encode(force_bytes(self.user.pk))
+        token = default_token_generator.make_token(self.user)
+        self.client.get(reverse('accounts:activate', kwargs={'uidb64': uid, 'token': token}))
+        self.assertTrue(self.load_user().user.profile.email_confirmed)
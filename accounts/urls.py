@@ -1,13 +1,15 @@
 from django.urls import path, reverse_lazy
 from . import views
 from django.contrib.auth import views as auth_views
+from .forms import OutboxPasswordResetForm
 
 app_name = 'accounts'
 urlpatterns = [
-    path('login/', views.CustomLoginView.as_view(), name='login'),
+    path('login/', views.login_view, name='login'),
     path('logout/', views.logout, name='logout'),
     path('register/', views.register, name='register'),
-    path('password_change/', views.CustomPasswordChangeView.as_view(), name='password_change'),
+    path('password_change/', views.password_change, name='password_change'),
+    path('base_currency/', views.base_currency, name='base_currency'),
     
     # URLs for email verification
     path('account_activation_sent/', views.account_activation_sent, name='account_activation_sent'),
@@ -18,6 +20,7 @@ urlpatterns = [
     # URLs for password reset
     path('password_reset/',
         auth_views.PasswordResetView.as_view(
+            form_class=OutboxPasswordResetForm,
             template_name='registration/password_reset_form.html',
             email_template_name='registration/password_reset_email.html',
             subject_template_name='registration/password_reset_subject.txt',
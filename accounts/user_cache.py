@@ -0,0 +1,118 @@
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+
+
+class UserCache:
+    """
+    Per-process cache of authenticated users, with their profile, keyed by
+    the session's user id, backend and auth hash. Entries expire after
+    AUTH_USER_CACHE_TTL seconds; saves in this process drop them at once,
+    other processes see the change when the entry expires.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._entries = {}
+        # User pk -> keys of its entries, so a save drops only those.
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            return None
+        # Every request gets its own instance, so that changes a view makes
+        # to request.user are not seen by other requests.
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, user, now=None):
+        ttl = settings.AUTH_USER_CACHE_TTL
+        if ttl <= 0:
+            return
+        now = time.monotonic() if now is None else now
+        user = copy.deepcopy(user)
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries = {k: entry for k, entry in self._entries.items() if entry[0] > now}
+                self._keys = {}
+                for k in self._entries:
+                    self._keys.setdefault(k[0], set()).add(k)
+                if len(self._entries) >= self.max_entries:
+                    return
+            self._entries[key] = (now + ttl, user)
+            self._keys.setdefault(key[0], set()).add(key)
+
+    def invalidate(self, user_pks):
+        with self._lock:
+            for pk in user_pks:
+                for key in self._keys.pop(str(pk), ()):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys.clear()
+
+
+user_cache = UserCache()
+
+
+def invalidate_user(user_pk):
+    invalidate_users([user_pk])
+
+
+def invalidate_users(user_pks):
+    user_cache.invalidate(user_pks)
+
+
+def session_key(session):
+    user_id = session.get(SESSION_KEY)
+    if user_id is None:
+        return None
+    return (str(user_id), session.get(BACKEND_SESSION_KEY), session.get(HASH_SESSION_KEY))
+
+
+def get_user(request):
+    """
+    Same as django.contrib.auth.get_user(), but served from `user_cache`
+    while the session's auth hash is unchanged.
+    """
+    key = session_key(request.session)
+    if key is not None:
+        user = user_cache.get(key)
+        if user is not None:
+            return user
+    user = auth.get_user(request)
+    # Checked again, get_user() flushes the session when the hash is stale.
+    if user.is_authenticated and session_key(request.session) == key:
+        user_cache.set(key, user)
+    return user
+
+
+async def asession_key(session):
+    user_id = await session.aget(SESSION_KEY)
+    if user_id is None:
+        return None
+    return (str(user_id), await session.aget(BACKEND_SESSION_KEY), await session.aget(HASH_SESSION_KEY))
+
+
+async def aget_user(request):
+    """
+    See get_user().
+    """
+    key = await asession_key(request.session)
+    if key is not None:
+        user = user_cache.get(key)
+        if user is not None:
+            return user
+    user = await auth.aget_user(request)
+    if user.is_authenticated and await asession_key(request.session) == key:
+        user_cache.set(key, user)
+    return user
@@ -1,13 +1,16 @@
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.utils.http import urlsafe_base64_encode
 from django.utils.encoding import force_bytes
 from django.contrib.auth.tokens import default_token_generator
+from .outbox import enqueue_email
 
-def send_activation_email(request, user):
+ACTIVATION_FROM_EMAIL = 'no-reply@investments_tracker.com'
+
+
+def render_activation_email(request, user):
     """
-    Generates and sends an account activation email to the given user.
+    Returns the subject and body of the account activation email for the given user.
     """
     current_site = get_current_site(request)
     subject = 'Activate Your Account'
@@ -17,5 +20,13 @@ def send_activation_email(request, user):
         'uid': urlsafe_base64_encode(force_bytes(user.pk)),
         'token': default_token_generator.make_token(user),
     })
-    send_mail(subject, message, 'no-reply@investments_tracker.com', [user.email])
-    
\ No newline at end of file
+    return subject, message
+
+
+def send_activation_email(request, user):
+    """
+    Generates an account activation email for the given user and puts it
+    in the outbox, so the request does not wait for the mail server.
+    """
+    subject, message = render_activation_email(request, user)
+    enqueue_email(subject, message, ACTIVATION_FROM_EMAIL, [user.email])
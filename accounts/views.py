@@ -1,24 +1,59 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect
-from django.contrib.auth.views import PasswordChangeView, LoginView
-from django.urls import reverse_lazy
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import logout as auth_logout, login
-from .forms import CustomUserCreationForm
+from django.contrib.auth import logout as auth_logout, login, alogin, aupdate_session_auth_hash
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.views.decorators.cache import never_cache
+from django.views.decorators.debug import sensitive_post_parameters
+from .forms import (
+    DUPLICATE_EMAIL_ERROR, AsyncAuthenticationForm, AsyncPasswordChangeForm, BaseCurrencyForm, CustomUserCreationForm,
+)
+from .hashing import reject_when_hashing_busy, run_hashing
 from django.contrib.auth.models import User
 from django.contrib import messages
 from django.utils.http import urlsafe_base64_decode
 from django.utils.encoding import force_str
 from django.contrib.auth.tokens import default_token_generator
 from .utils import send_activation_email
+from .middleware import mark_email_confirmed
+from .profile_cache import get_profile_version, profile_etag
+from core.routers import replica_reads
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 
 
+@replica_reads()
 def profile(request, username):
-    if User.objects.filter(username=username).exists():
-        profile_user = User.objects.get(username=username)
-        return render(request, 'accounts/profile.html', {'profile_user': profile_user})
-    else:
+    try:
+        profile_user = User.objects.select_related('profile').get(username=username)
+    except User.DoesNotExist:
         return render(request, 'core/404.html', status=404)
 
+    version = get_profile_version(profile_user.pk)
+    is_owner = profile_user == request.user
+    if is_owner:
+        return render(request, 'accounts/profile.html', {
+            'profile_user': profile_user,
+            'profile_version': version,
+            'is_owner': True,
+            'currency_form': BaseCurrencyForm(instance=profile_user.profile),
+        })
+
+    etag = profile_etag(profile_user, version, request.user)
+    last_modified = int(version)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = render(request, 'accounts/profile.html', {
+            'profile_user': profile_user,
+            'profile_version': version,
+            'is_owner': False,
+        })
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 
 # def user_login(request):
 #     if request.user.is_authenticated:
@@ -40,12 +75,23 @@ def profile(request, username):
 #     return render(request, 'accounts/login.html', {'form': form})
 
 
-class CustomLoginView(LoginView):
-    template_name = 'accounts/login.html'
-    redirect_authenticated_user = True
+@sensitive_post_parameters()
+@never_cache
+@reject_when_hashing_busy
+async def login_view(request):
+    user = await request.auser()
+    if user.is_authenticated:
+        return redirect('accounts:profile', username=user.username)
 
-    def get_success_url(self):
-        return reverse_lazy('accounts:profile', kwargs={'username': self.request.user.username})
+    if request.method == 'POST':
+        form = AsyncAuthenticationForm(request, data=request.POST)
+        if form.is_valid() and await form.aauthenticate():
+            user = form.get_user()
+            await alogin(request, user)
+            return redirect('accounts:profile', username=user.username)
+    else:
+        form = AsyncAuthenticationForm(request)
+    return render(request, 'accounts/login.html', {'form': form})
 
 
 def logout(request):
@@ -53,28 +99,48 @@ def logout(request):
     return render(request, 'accounts/logout.html')
 
 
-def register(request):
-    if request.user.is_authenticated:
+def save_new_user(form, user):
+    """
+    Saves a user built by the registration form. Returns False and adds a form
+    error when another registration claimed the address after clean_email ran:
+    the unique constraint on Profile.email_normalized leaves the new profile
+    without the key, and the user is rolled back.
+    """
+    with transaction.atomic():
+        user.save()
+        if user.profile.email_normalized is None:
+            transaction.set_rollback(True)
+            form.add_error('email', DUPLICATE_EMAIL_ERROR)
+            return False
+    return True
+
+
+@sensitive_post_parameters()
+@reject_when_hashing_busy
+async def register(request):
+    user = await request.auser()
+    if user.is_authenticated:
         return redirect('core:index')
 
     if request.method == 'POST':
         form = CustomUserCreationForm(request.POST)
-        if form.is_valid():
-            user = form.save(commit=False)
+        if await sync_to_async(form.is_valid)():
+            user = form.instance
+            user.password = await run_hashing(make_password, form.cleaned_data['password1'])
             user.is_active = True
-            user.save()
+            if await sync_to_async(save_new_user)(form, user):
+                await alogin(request, user)
+                await sync_to_async(send_activation_email)(request, user)
 
-            login(request, user)
-            send_activation_email(request, user)
-
-            # Redirect to the homepage, middleware will handle the rest
-            return redirect('core:index') 
+                # Redirect to the homepage, middleware will handle the rest
+                return redirect('core:index')
     else:
         form = CustomUserCreationForm()
     return render(request, 'accounts/register.html', {'form': form})
 
 
 @login_required
+@replica_reads()
 def account_activation_sent(request):
     if request.user.profile.email_confirmed:
         return redirect('accounts:profile', username=request.user.username)
@@ -104,6 +170,7 @@ def activate(request, uidb64, token):
         user.profile.email_confirmed = True
         user.profile.save()
         login(request, user)
+        mark_email_confirmed(request, user)
         return redirect('accounts:account_activation_complete')
     else:
         return render(request, 'registration/account_activation_invalid.html')
@@ -113,8 +180,31 @@ def account_activation_complete(request):
     return render(request, 'registration/account_activation_complete.html')
 
 
-class CustomPasswordChangeView(PasswordChangeView):
-    template_name = 'accounts/password_change.html'
+@login_required
+def base_currency(request):
+    """
+    Sets the currency the dashboard converts holdings into, from the form
+    on the user's profile page.
+    """
+    if request.method == 'POST':
+        form = BaseCurrencyForm(request.POST, instance=request.user.profile)
+        if form.is_valid():
+            form.save()
+    return redirect('accounts:profile', username=request.user.username)
 
-    def get_success_url(self):
-        return reverse_lazy('accounts:profile', kwargs={'username': self.request.user.username})  
+
+@sensitive_post_parameters()
+@login_required
+@reject_when_hashing_busy
+async def password_change(request):
+    user = await request.auser()
+    if request.method == 'POST':
+        form = AsyncPasswordChangeForm(user, request.POST)
+        await form.acheck_old_password()
+        if form.is_valid():
+            await form.asave()
+            await aupdate_session_auth_hash(request, user)
+            return redirect('accounts:profile', username=user.username)
+    else:
+        form = AsyncPasswordChangeForm(user)
+    return render(request, 'accounts/password_change.html', {'form': form})
@@ -0,0 +1,160 @@
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal, receiver
+
+from .caching import invalidate_now_and_on_commit
+from .models import CorporateAction, Instrument
+from .prices import DAY, date_to_ts, get_price_store, prices_appended
+
+ADJUSTMENTS_KEY = 'core:adjustments:{}'
+# Closes looked at for the one before a dividend's ex date.
+DIVIDEND_LOOKBACK = 14 * DAY
+PRICE_FIELDS = ('open', 'high', 'low', 'close')
+
+# Sent after corporate actions were stored, with the `symbols` they concern.
+actions_recorded = Signal()
+
+
+class Adjustments:
+    """
+    Cumulative adjustment factors of one instrument. `ex_ts` are the ex
+    dates of its actions as ascending epoch seconds; a bar at `ts` takes
+    `price[i]` and `volume[i]` where i = searchsorted(ex_ts, ts, 'right'),
+    the product of the factors of every action after it. The last entries
+    are 1, bars after the latest action are as stored.
+    """
+    __slots__ = ('ex_ts', 'price', 'volume')
+
+    def __init__(self, ex_ts, price, volume):
+        self.ex_ts = ex_ts
+        self.price = price
+        self.volume = volume
+
+    def __bool__(self):
+        return bool(len(self.ex_ts))
+
+    def index(self, ts):
+        return np.searchsorted(self.ex_ts, ts, 'right')
+
+
+def cumulative(factors):
+    return np.append(np.cumprod(factors[::-1])[::-1], 1.0)
+
+
+def compute_adjustments(symbols):
+    """
+    Factors of every action of `symbols`, with one query: 1 / ratio for a
+    split, and 1 - amount / close for a dividend, with the last close
+    before its ex date. Dividends without such a close are ignored.
+    Returns {symbol: Adjustments}.
+    """
+    actions = {symbol: [] for symbol in symbols}
+    rows = (
+        CorporateAction.objects.filter(instrument__symbol__in=actions)
+        .order_by('ex_date', 'pk')
+        .values_list('instrument__symbol', 'kind', 'ex_date', 'ratio', 'amount')
+    )
+    for symbol, *action in rows:
+        actions[symbol].append(action)
+    store = get_price_store()
+    adjustments = {}
+    for symbol, symbol_actions in actions.items():
+        ex_ts = np.zeros(len(symbol_actions), dtype=np.int64)
+        price = np.ones(len(symbol_actions))
+        volume = np.ones(len(symbol_actions))
+        for i, (kind, ex_date, ratio, amount) in enumerate(symbol_actions):
+            ex_ts[i] = ts = date_to_ts(ex_date)
+            if kind == CorporateAction.SPLIT:
+                price[i], volume[i] = 1 / float(ratio), float(ratio)
+                continue
+            before = store.bars(symbol, ts - DIVIDEND_LOOKBACK, ts - 1)
+            if len(before) and before['close'][-1] > float(amount):
+                price[i] = 1 - float(amount) / before['close'][-1]
+        adjustments[symbol] = Adjustments(ex_ts, cumulative(price), cumulative(volume))
+    return adjustments
+
+
+def get_adjustments(symbols):
+    """
+    Returns {symbol: Adjustments}, computed on first use and then kept in
+    the cache until an action of the symbol is recorded.
+    """
+    keys = {symbol: ADJUSTMENTS_KEY.format(symbol) for symbol in symbols}
+    cached = cache.get_many(keys.values())
+    adjustments = {symbol: cached[key] for symbol, key in keys.items() if key in cached}
+    missing = [symbol for symbol in keys if symbol not in adjustments]
+    if missing:
+        computed = compute_adjustments(missing)
+        cache.set_many({keys[symbol]: value for symbol, value in computed.items()}, None)
+        adjustments.update(computed)
+    return adjustments
+
+
+def invalidate_adjustments(symbols):
+    cache.delete_many([ADJUSTMENTS_KEY.format(symbol) for symbol in symbols])
+
+
+def adjust(adjustments, bars):
+    """
+    Returns a copy of `bars`, a BAR array, with prices and volumes
+    adjusted for later actions, or `bars` itself when there are none.
+    """
+    if not adjustments or not len(bars):
+        return bars
+    index = adjustments.index(bars['ts'])
+    adjusted = np.array(bars)
+    factor = adjustments.price[index]
+    for field in PRICE_FIELDS:
+        adjusted[field] *= factor
+    adjusted['volume'] *= adjustments.volume[index]
+    return adjusted
+
+
+def adjusted_bars(symbol, start, end, interval='1d'):
+    """
+    The bars with start <= ts <= end of the price store, adjusted for
+    splits and dividends.
+    """
+    bars = get_price_store().bars(symbol, start, end, interval)
+    return adjust(get_adjustments([symbol])[symbol], bars)
+
+
+def adjusted_close_matrix(instruments, start, days):
+    """
+    `close_matrix` of the price store with every column adjusted for
+    splits and dividends.
+    """
+    matrix = get_price_store().close_matrix(instruments, start, days)
+    adjustments = get_adjustments([symbol for _, symbol in instruments])
+    day_ts = date_to_ts(start) + np.arange(days) * DAY
+    for column, (_, symbol) in enumerate(instruments):
+        if adjustments[symbol]:
+            matrix[:, column] *= adjustments[symbol].price[adjustments[symbol].index(day_ts)]
+    return matrix
+
+
+def record_actions(actions):
+    """
+    Stores unsaved CorporateAction instances and drops the cached factors
+    of their instruments only. Returns the number of actions stored.
+    """
+    actions = list(actions)
+    if not actions:
+        return 0
+    symbols = list(
+        Instrument.objects.filter(pk__in={action.instrument_id for action in actions}).values_list('symbol', flat=True)
+    )
+    with transaction.atomic():
+        CorporateAction.objects.bulk_create(actions)
+        invalidate_now_and_on_commit(invalidate_adjustments, symbols)
+        actions_recorded.send(sender=CorporateAction, symbols=symbols)
+    return len(actions)
+
+
+@receiver(prices_appended)
+def prices_changed(sender, symbol, date, **kwargs):
+    # Closes before an ex date change the factor of its dividend.
+    adjustments = cache.get(ADJUSTMENTS_KEY.format(symbol))
+    if adjustments and date_to_ts(date) < adjustments.ex_ts[-1]:
+        invalidate_adjustments([symbol])
@@ -0,0 +1,14 @@
+import functools
+
+from django.db import transaction
+
+
+def invalidate_now_and_on_commit(invalidate, *args):
+    """
+    Calls `invalidate(*args)` now and again once the current transaction
+    commits. Now, so that this process stops serving what was changed; on
+    commit too, because a reader between the write and the commit would
+    otherwise cache the old data under the new version.
+    """
+    invalidate(*args)
+    transaction.on_commit(functools.partial(invalidate, *args))
@@ -0,0 +1,151 @@
+import datetime
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+from .fx import convert, pair_rates
+from .models import PortfolioSnapshot, Position, Transaction
+from .prices import get_price_store
+from .quotes import get_quotes
+
+# Days of history shown on the dashboard.
+DASHBOARD_DAYS = 30
+RECENT_TRANSACTIONS = 20
+# Widgets of the dashboard, each rendered by core/widgets/<name>.html and
+# refreshable on its own.
+WIDGETS = ('summary', 'holdings', 'allocation', 'transactions')
+# Parts of the dashboard valued at live quotes, the page and widgets.
+QUOTED_PARTS = frozenset({'index', 'holdings', 'allocation'})
+
+
+class Dashboard:
+    """
+    Data of the dashboard widgets of a user's `portfolios`, (pk, name)
+    pairs, with holdings also shown in the base `currency`. Every widget is
+    loaded on first use, so a widget served from the fragment cache costs
+    no queries.
+    """
+
+    def __init__(self, portfolios, currency='USD'):
+        self.portfolios = portfolios
+        self.currency = currency
+        self.portfolio_ids = [pk for pk, _ in portfolios]
+        self.today = timezone.localdate()
+
+    @cached_property
+    def summary(self):
+        """
+        Reads the precomputed snapshots for the last DASHBOARD_DAYS days,
+        plus the day before for the first day's change, with one range
+        query on the (portfolio, date) index. Snapshots are kept in
+        SNAPSHOT_CURRENCY and converted into the base currency at the rate
+        of their day; days without a rate are left out.
+        """
+        start = self.today - datetime.timedelta(days=DASHBOARD_DAYS)
+        series = {pk: [] for pk in self.portfolio_ids}
+        snapshots = list(PortfolioSnapshot.objects.filter(
+            portfolio_id__in=self.portfolio_ids, date__range=(start, self.today),
+        ).order_by('date'))
+        rates = pair_rates(settings.SNAPSHOT_CURRENCY, self.currency, [snapshot.date for snapshot in snapshots])
+        for snapshot, rate in zip(snapshots, rates):
+            if np.isnan(rate):
+                continue
+            for field in ('market_value', 'cost_basis', 'realized_gain', 'unrealized_gain'):
+                setattr(snapshot, field, float(getattr(snapshot, field)) * rate)
+            series[snapshot.portfolio_id].append(snapshot)
+
+        rows, history = [], {}
+        for pk, name in self.portfolios:
+            snapshots = series[pk]
+            row = {'pk': pk, 'name': name, 'market_value': 0, 'cost_basis': 0, 'unrealized_gain': 0,
+                   'realized_gain': 0, 'daily_pnl': 0, 'period_pnl': 0}
+            if snapshots:
+                latest = snapshots[-1]
+                # A portfolio that started within the period started at zero.
+                opening = snapshots[0].pnl if snapshots[0].date == start else 0
+                row.update(
+                    market_value=latest.market_value,
+                    cost_basis=latest.cost_basis,
+                    unrealized_gain=latest.unrealized_gain,
+                    realized_gain=latest.realized_gain,
+                    daily_pnl=latest.pnl - (snapshots[-2].pnl if len(snapshots) > 1 else 0),
+                    period_pnl=latest.pnl - opening,
+                )
+            for snapshot in snapshots:
+                if snapshot.date > start:
+                    history[snapshot.date] = history.get(snapshot.date, 0) + snapshot.market_value
+            rows.append(row)
+        return {
+            'portfolios': rows,
+            'total_value': sum(row['market_value'] for row in rows),
+            'history': sorted(history.items()),
+            'days': DASHBOARD_DAYS,
+        }
+
+    @cached_property
+    def holdings(self):
+        """
+        Open positions valued at the live quote, or the latest close where
+        there is none, and converted into the base currency at today's
+        rate, largest first. `value` is None where no rate is known.
+        """
+        positions = list(
+            Position.objects.filter(portfolio_id__in=self.portfolio_ids)
+            .exclude(quantity=0)
+            .select_related('portfolio', 'instrument')
+        )
+        instruments = sorted({(position.instrument_id, position.instrument.symbol) for position in positions})
+        quotes = get_quotes([symbol for _, symbol in instruments])
+        price = {pk: quotes[symbol].price for pk, symbol in instruments if symbol in quotes}
+        unquoted = [(pk, symbol) for pk, symbol in instruments if symbol not in quotes]
+        if unquoted:
+            closes = np.nan_to_num(get_price_store().close_matrix(unquoted, self.today, 1)[0])
+            price.update((pk, float(close)) for (pk, _), close in zip(unquoted, closes))
+        market_values = [float(position.quantity) * price[position.instrument_id] for position in positions]
+        values = convert(
+            market_values,
+            [position.instrument.currency for position in positions],
+            np.full(len(positions), np.datetime64(self.today, 'D')),
+            self.currency,
+        )
+        holdings = []
+        for position, market_value, value in zip(positions, market_values, values):
+            holdings.append({
+                'portfolio': position.portfolio.name,
+                'symbol': position.instrument.symbol,
+                'currency': position.instrument.currency,
+                'quantity': position.quantity,
+                'average_cost': position.average_cost,
+                'price': price[position.instrument_id],
+                'market_value': market_value,
+                'unrealized_gain': market_value - float(position.cost_basis),
+                'value': None if np.isnan(value) else float(value),
+            })
+        holdings.sort(key=lambda holding: -1 if holding['value'] is None else holding['value'], reverse=True)
+        return holdings
+
+    @cached_property
+    def allocation(self):
+        """
+        Share of the total value in the base currency per instrument, across
+        portfolios. Holdings without an exchange rate are left out.
+        """
+        values = {}
+        for holding in self.holdings:
+            if holding['value'] is not None:
+                values[holding['symbol']] = values.get(holding['symbol'], 0) + holding['value']
+        total = sum(values.values())
+        return [
+            {'symbol': symbol, 'market_value': value, 'share': value / total * 100 if total else 0}
+            for symbol, value in sorted(values.items(), key=lambda item: item[1], reverse=True)
+        ]
+
+    @cached_property
+    def transactions(self):
+        return list(
+            Transaction.objects.filter(portfolio_id__in=self.portfolio_ids)
+            .select_related('portfolio', 'instrument')
+            .order_by('-date', '-pk')[:RECENT_TRANSACTIONS]
+        )
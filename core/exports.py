@@ -0,0 +1,103 @@
+import csv
+import json
+import re
+import zlib
+
+from django.conf import settings
+
+from .models import Position, Transaction
+
+TRANSACTION_FIELDS = ('date', 'symbol', 'kind', 'quantity', 'price', 'fees')
+POSITION_FIELDS = ('portfolio', 'symbol', 'quantity', 'cost_basis', 'realized_gain', 'last_date')
+
+# Output is handed to the server in pieces of about this size, so that
+# neither every row nor the whole file becomes a separate write.
+BUFFER_SIZE = 64 * 1024
+
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
+
+def transaction_rows(portfolio, using=None):
+    """
+    Yields the ledger of `portfolio` in date order, in the column layout the
+    CSV import reads. The query runs on a server-side cursor where the
+    database supports one, so only EXPORT_CHUNK_SIZE rows are held at a time.
+    """
+    queryset = (
+        Transaction.objects.using(using)
+        .filter(portfolio=portfolio)
+        .order_by('date', 'pk')
+        .values_list('date', 'instrument__symbol', 'kind', 'quantity', 'price', 'fees')
+    )
+    return queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+def position_rows(owner, using=None):
+    queryset = (
+        Position.objects.using(using)
+        .filter(portfolio__owner=owner)
+        .order_by('portfolio__name', 'instrument__symbol')
+        .values_list('portfolio__name', 'instrument__symbol', 'quantity', 'cost_basis', 'realized_gain', 'last_date')
+    )
+    return queryset.iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+
+class LineBuffer:
+    """
+    File-like target for csv.writer that hands back what was written.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(LineBuffer())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def jsonl_lines(header, rows):
+    for row in rows:
+        # Decimals and dates as strings, so that no precision is lost.
+        yield json.dumps(dict(zip(header, map(str, row)))) + '\n'
+
+
+FORMATS = {
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+    'jsonl': (jsonl_lines, 'application/x-ndjson; charset=utf-8'),
+}
+
+
+def encode(lines, size=None):
+    """
+    Joins text lines into UTF-8 chunks of about `size` bytes.
+    """
+    size = size or BUFFER_SIZE
+    buffer, length = [], 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        length += len(data)
+        if length >= size:
+            yield b''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Compresses a stream of byte chunks into one gzip member on the fly.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def accepts_gzip(request):
+    return bool(ACCEPTS_GZIP_RE.search(request.headers.get('Accept-Encoding', '')))
@@ -0,0 +1,8 @@
+from django import forms
+
+
+class TransactionImportForm(forms.Form):
+    file = forms.FileField(
+        label='CSV file',
+        help_text='Columns: date (YYYY-MM-DD), symbol, kind (buy or sell), quantity, price and optionally fees.',
+    )
@@ -0,0 +1,182 @@
+import collections
+import datetime
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+
+from .caching import invalidate_now_and_on_commit
+from .models import ExchangeRate
+
+FX_VERSION_KEY = 'core:fx-version'
+
+# Sent after exchange rates were stored, with the `pairs` written and the
+# earliest `date` of them.
+rates_recorded = Signal()
+
+
+class RateCache:
+    """
+    Per-process LRU of daily rate slices, one per (base, quote, year) and
+    version of the rates. A slice has a rate for every day of its year,
+    NaN before the pair's first rate, so a lookup is an index into it.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._slices = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            rates = self._slices.get(key)
+            if rates is None:
+                self.misses += 1
+                return None
+            self._slices.move_to_end(key)
+            self.hits += 1
+            return rates
+
+    def set(self, key, rates):
+        rates.setflags(write=False)
+        with self._lock:
+            self._slices[key] = rates
+            self._slices.move_to_end(key)
+            while len(self._slices) > self.max_entries:
+                self._slices.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._slices.clear()
+            self.hits = self.misses = 0
+
+
+rate_cache = RateCache()
+
+
+def get_version():
+    """
+    Version of the stored rates, the timestamp of their last change. Slices
+    of older versions are never looked up again and age out of the LRU.
+    """
+    version = cache.get(FX_VERSION_KEY)
+    if version is None:
+        # Unknown after a cache flush, so assume they changed just now.
+        cache.add(FX_VERSION_KEY, time.time(), None)
+        version = cache.get(FX_VERSION_KEY)
+    return version
+
+
+def invalidate_rates():
+    cache.set(FX_VERSION_KEY, time.time(), None)
+
+
+def record_rates(rates):
+    """
+    Stores ExchangeRate instances, replacing the rate of a pair and day that
+    is already stored. Returns the number of rows written.
+    """
+    rates = list(rates)
+    if not rates:
+        return 0
+    with transaction.atomic():
+        ExchangeRate.objects.bulk_create(
+            rates, update_conflicts=True, unique_fields=['base', 'quote', 'date'], update_fields=['rate'],
+        )
+        invalidate_now_and_on_commit(invalidate_rates)
+        rates_recorded.send(
+            sender=ExchangeRate, pairs={(rate.base, rate.quote) for rate in rates},
+            date=min(rate.date for rate in rates),
+        )
+    return len(rates)
+
+
+def year_bounds(year):
+    return datetime.date(year, 1, 1), datetime.date(year, 12, 31)
+
+
+def stored_slice(base, quote, year):
+    """
+    Daily rates of a pair for a year from the rates stored for it or for
+    the inverse pair, carrying the latest rate forward over days without
+    one. Four queries on the (base, quote, date) index.
+    """
+    first, last = year_bounds(year)
+    days = (last - first).days + 1
+    rates = np.full(days, np.nan)
+    for pair, invert in (((quote, base), True), ((base, quote), False)):
+        stored = ExchangeRate.objects.filter(base=pair[0], quote=pair[1])
+        # The pair as quoted comes last, so its rates win over inverted ones.
+        opening = stored.filter(date__lte=first).order_by('-date').values_list('rate', flat=True).first()
+        if opening is not None:
+            rates[0] = 1 / float(opening) if invert else float(opening)
+        rows = list(stored.filter(date__gt=first, date__lte=last).values_list('date', 'rate'))
+        if rows:
+            dates, values = zip(*rows)
+            day = (np.array(dates, dtype='datetime64[D]') - np.datetime64(first, 'D')).astype(np.int64)
+            values = np.array(values, dtype=float)
+            rates[day] = 1 / values if invert else values
+    last_known = np.where(np.isnan(rates), 0, np.arange(days))
+    np.maximum.accumulate(last_known, out=last_known)
+    return rates[last_known]
+
+
+def rate_slice(base, quote, year, version):
+    """
+    Daily rates of a pair for a year, from the LRU or the database. Pairs
+    without stored rates are crossed through FX_PIVOT_CURRENCY.
+    """
+    key = (base, quote, year, version)
+    rates = rate_cache.get(key)
+    if rates is not None:
+        return rates
+    first, last = year_bounds(year)
+    if base == quote:
+        rates = np.ones((last - first).days + 1)
+    else:
+        rates = stored_slice(base, quote, year)
+        pivot = settings.FX_PIVOT_CURRENCY
+        if np.isnan(rates).all() and pivot not in (base, quote):
+            rates = rate_slice(base, pivot, year, version) * rate_slice(pivot, quote, year, version)
+    rate_cache.set(key, rates)
+    return rates
+
+
+def pair_rates(base, quote, dates, version=None):
+    """
+    Rates of a pair on `dates`, a datetime64[D] array, as a float array.
+    NaN for days before the pair's first rate.
+    """
+    version = get_version() if version is None else version
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    if not dates.size:
+        return np.zeros(dates.shape)
+    first, last = dates.min().astype('datetime64[Y]'), dates.max().astype('datetime64[Y]')
+    # The slices of every year spanned, joined into one array indexed by day.
+    daily = np.concatenate([
+        rate_slice(base, quote, year, version) for year in range(int(str(first)), int(str(last)) + 1)
+    ])
+    return daily[(dates - first.astype('datetime64[D]')).astype(np.int64)]
+
+
+def convert(amounts, currencies, dates, to):
+    """
+    Converts `amounts` in `currencies` on `dates`, parallel arrays, into
+    the currency `to`. Each distinct currency and year costs one lookup in
+    the LRU, not one query per row. NaN where no rate is known.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    codes, inverse = np.unique(np.asarray(currencies), return_inverse=True)
+    version = get_version()
+    result = np.empty(amounts.shape)
+    for code, currency in enumerate(codes):
+        rows = inverse == code
+        result[rows] = amounts[rows] * pair_rates(str(currency), to, dates[rows], version)
+    return result
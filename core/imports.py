@@ -0,0 +1,198 @@
+import csv
+import datetime
+import hashlib
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import IntegrityError
+
+from .models import Instrument, Transaction
+from .positions import InsufficientQuantity, record_transactions
+
+REQUIRED_COLUMNS = ('date', 'symbol', 'kind', 'quantity', 'price')
+KINDS = {'buy': Transaction.BUY, 'sell': Transaction.SELL}
+# Errors kept in the report; the rest are only counted.
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    """
+    Running totals of an import, passed to the progress callback after
+    every chunk.
+    """
+    __slots__ = ('rows', 'created', 'duplicates', 'error_count', 'errors', 'aborted')
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors = []
+        self.aborted = False
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'Line {line}: {message}')
+
+    def __str__(self):
+        return (
+            f'{self.rows} row(s) read, {self.created} imported, '
+            f'{self.duplicates} already imported, {self.error_count} invalid'
+        )
+
+
+class ParsedRow:
+    __slots__ = ('line', 'date', 'symbol', 'kind', 'quantity', 'price', 'fees', 'fingerprint')
+
+    def __init__(self, line, date, symbol, kind, quantity, price, fees):
+        self.line = line
+        self.date = date
+        self.symbol = symbol
+        self.kind = kind
+        self.quantity = quantity
+        self.price = price
+        self.fees = fees
+
+    def content_key(self):
+        # Decimals are normalized so that '10' and '10.00' hash the same.
+        return '|'.join([
+            self.date.isoformat(), self.symbol, self.kind,
+            *(format(value.normalize(), 'f') for value in (self.quantity, self.price, self.fees)),
+        ])
+
+
+def read_rows(lines):
+    """
+    Yields (line number, row dict) from CSV text lines, with lower-cased
+    column names. Raises ValueError for a header without the required columns.
+    """
+    reader = csv.reader(lines)
+    header = [column.strip().lower() for column in next(reader, [])]
+    missing = [column for column in REQUIRED_COLUMNS if column not in header]
+    if missing:
+        raise ValueError(f'Missing column(s): {", ".join(missing)}.')
+    for values in reader:
+        if any(value.strip() for value in values):
+            yield reader.line_num, dict(zip(header, values))
+
+
+def parse_decimal(value, name, allow_zero=True):
+    try:
+        number = Decimal(value.strip() or '0')
+    except InvalidOperation:
+        raise ValueError(f'{name} {value!r} is not a number.')
+    if not number.is_finite() or number < 0 or (number == 0 and not allow_zero):
+        raise ValueError(f'{name} {value!r} is out of range.')
+    return number
+
+
+def parse_rows(rows, report):
+    """
+    Validates rows and yields ParsedRow objects; invalid rows are recorded
+    in `report` and skipped.
+    """
+    for line, row in rows:
+        report.rows += 1
+        try:
+            kind = KINDS.get(row['kind'].strip().lower())
+            if kind is None:
+                raise ValueError(f'kind {row["kind"]!r} is not buy or sell.')
+            symbol = row['symbol'].strip().upper()
+            if not symbol or len(symbol) > Instrument._meta.get_field('symbol').max_length:
+                raise ValueError(f'symbol {row["symbol"]!r} is invalid.')
+            yield ParsedRow(
+                line,
+                datetime.date.fromisoformat(row['date'].strip()),
+                symbol,
+                kind,
+                parse_decimal(row['quantity'], 'quantity', allow_zero=False),
+                parse_decimal(row['price'], 'price'),
+                parse_decimal(row.get('fees') or '', 'fees'),
+            )
+        except (KeyError, ValueError) as exc:
+            report.add_error(line, str(exc))
+
+
+def fingerprint_rows(parsed):
+    """
+    Sets `fingerprint` on every row: a hash of its content and of how many
+    identical rows precede it on the same date, so two equal trades stay two
+    transactions. The content includes the date, so the counts are reset
+    whenever it changes and only one date's rows are kept; broker exports
+    list a date's rows together.
+    """
+    seen = Counter()
+    date = None
+    for row in parsed:
+        if row.date != date:
+            seen.clear()
+            date = row.date
+        key = row.content_key()
+        row.fingerprint = hashlib.sha256(f'{key}|{seen[key]}'.encode()).hexdigest()
+        seen[key] += 1
+        yield row
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def instrument_ids(symbols, known):
+    """
+    Resolves symbols to instrument ids, creating missing instruments.
+    `known` caches the mapping across chunks.
+    """
+    missing = set(symbols) - known.keys()
+    if missing:
+        Instrument.objects.bulk_create([Instrument(symbol=symbol) for symbol in missing], ignore_conflicts=True)
+        known.update(Instrument.objects.filter(symbol__in=missing).values_list('symbol', 'pk'))
+    return known
+
+
+def import_transactions(portfolio, lines, chunk_size=5000, progress=None):
+    """
+    Imports broker CSV text `lines` into `portfolio` as a generator pipeline:
+    read -> validate -> fingerprint -> chunk -> deduplicate -> write. Each
+    chunk is written with `record_transactions` in its own database
+    transaction, so memory use depends on `chunk_size` and the rows of one
+    date, not the file size.
+    Rows whose fingerprint is already stored are skipped, so importing the
+    same file again writes nothing. A chunk that would sell more than is
+    held stops the import; the chunks before it stay imported.
+    """
+    report = ImportReport()
+    known = {}
+    rows = fingerprint_rows(parse_rows(read_rows(lines), report))
+    for chunk in chunked(rows, chunk_size):
+        unique = {row.fingerprint: row for row in chunk}
+        report.duplicates += len(chunk) - len(unique)
+        stored = set(
+            Transaction.objects.filter(portfolio=portfolio, fingerprint__in=list(unique))
+            .values_list('fingerprint', flat=True)
+        )
+        report.duplicates += len(stored)
+        new = [row for fingerprint, row in unique.items() if fingerprint not in stored]
+        ids = instrument_ids({row.symbol for row in new}, known)
+        try:
+            report.created += record_transactions(
+                Transaction(
+                    portfolio=portfolio, instrument_id=ids[row.symbol], kind=row.kind, date=row.date,
+                    quantity=row.quantity, price=row.price, fees=row.fees, fingerprint=row.fingerprint,
+                )
+                for row in new
+            )
+        except InsufficientQuantity as exc:
+            report.add_error(chunk[0].line, f'rows up to line {chunk[-1].line} were not imported: {exc}')
+            report.aborted = True
+        except IntegrityError:
+            report.add_error(chunk[0].line, 'the file is being imported concurrently, try again.')
+            report.aborted = True
+        if progress is not None:
+            progress(report)
+        if report.aborted:
+            break
+    return report
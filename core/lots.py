@@ -0,0 +1,181 @@
+import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractYear
+
+from .models import LotCheckpoint, RealizedGain, Transaction
+from .positions import QUANTUM, InsufficientQuantity
+
+FIFO = LotCheckpoint.FIFO
+LIFO = LotCheckpoint.LIFO
+AVERAGE = LotCheckpoint.AVERAGE
+METHODS = (FIFO, LIFO, AVERAGE)
+
+# Consumed lots at the head are dropped once there are this many of them
+# and they make up half of the arrays.
+COMPACT_AFTER = 64
+
+
+class Lots:
+    """
+    Open lots of one instrument, oldest first, as parallel arrays of
+    quantity, cost and acquisition date. FIFO sells from the head, LIFO
+    from the tail, so every lot is added and removed once. The head is an
+    index rather than a pop from the front of a list. Under average cost
+    all buys are pooled into one lot.
+    """
+    __slots__ = ('quantity', 'cost', 'acquired', 'head', 'held')
+
+    def __init__(self, quantity=None, cost=None, acquired=None):
+        self.quantity = quantity or []
+        self.cost = cost or []
+        self.acquired = acquired or []
+        self.head = 0
+        self.held = sum(self.quantity, Decimal(0))
+
+    def __len__(self):
+        return len(self.quantity) - self.head
+
+    def buy(self, quantity, cost, date, method):
+        self.held += quantity
+        if method == AVERAGE and len(self):
+            self.quantity[-1] += quantity
+            self.cost[-1] += cost
+            return
+        self.quantity.append(quantity)
+        self.cost.append(cost)
+        self.acquired.append(date)
+
+    def sell(self, quantity, method):
+        """
+        Removes `quantity` from the lots and returns their cost. A lot sold
+        in part keeps the rest of its cost, so no rounding is lost.
+        """
+        self.held -= quantity
+        removed = Decimal(0)
+        while quantity:
+            i = len(self.quantity) - 1 if method == LIFO else self.head
+            if self.quantity[i] <= quantity:
+                quantity -= self.quantity[i]
+                removed += self.cost[i]
+                self.drop(i)
+            else:
+                part = (self.cost[i] * quantity / self.quantity[i]).quantize(QUANTUM)
+                self.quantity[i] -= quantity
+                self.cost[i] -= part
+                removed += part
+                quantity = 0
+        return removed
+
+    def drop(self, i):
+        if i != self.head:
+            del self.quantity[i], self.cost[i], self.acquired[i]
+            return
+        self.head += 1
+        if not len(self):
+            self.quantity, self.cost, self.acquired, self.head = [], [], [], 0
+        elif self.head >= COMPACT_AFTER and self.head * 2 >= len(self.quantity):
+            del self.quantity[:self.head], self.cost[:self.head], self.acquired[:self.head]
+            self.head = 0
+
+    def dump(self):
+        return [
+            [str(quantity), str(cost), acquired.isoformat()]
+            for quantity, cost, acquired in zip(
+                self.quantity[self.head:], self.cost[self.head:], self.acquired[self.head:],
+            )
+        ]
+
+    @classmethod
+    def load(cls, rows):
+        return cls(
+            [Decimal(quantity) for quantity, _, _ in rows],
+            [Decimal(cost) for _, cost, _ in rows],
+            [datetime.date.fromisoformat(acquired) for _, _, acquired in rows],
+        )
+
+
+def apply(book, method, row):
+    """
+    Matches one (pk, portfolio_id, instrument_id, kind, date, quantity,
+    price, fees) transaction row against the open lots in `book`,
+    {instrument_id: Lots}, which it updates. Rows must come in (date, pk)
+    order. Returns an unsaved RealizedGain for a sell, None for a buy.
+    """
+    pk, portfolio_id, instrument_id, kind, date, quantity, price, fees = row
+    lots = book.get(instrument_id)
+    if lots is None:
+        lots = book[instrument_id] = Lots()
+    if kind == Transaction.BUY:
+        lots.buy(quantity, (quantity * price + fees).quantize(QUANTUM), date, method)
+        return None
+    if quantity > lots.held:
+        raise InsufficientQuantity(f'Cannot sell {quantity} of {instrument_id} on {date}, only {lots.held} held.')
+    cost_basis = lots.sell(quantity, method)
+    proceeds = (quantity * price - fees).quantize(QUANTUM)
+    return RealizedGain(
+        transaction_id=pk, portfolio_id=portfolio_id, instrument_id=instrument_id, method=method, date=date,
+        quantity=quantity, proceeds=proceeds, cost_basis=cost_basis, gain=proceeds - cost_basis,
+    )
+
+
+def update_lots(portfolio_id, method, batch_size=10000):
+    """
+    Brings the realized gains of a portfolio under `method` up to date,
+    resuming from its checkpoint: only transactions appended since are
+    matched. Transactions recorded since always have a higher pk, so one
+    dated before the checkpoint was backdated; then the ledger is matched
+    from its start. Returns the number of transactions processed.
+    """
+    with transaction.atomic():
+        checkpoint, _ = LotCheckpoint.objects.select_for_update().get_or_create(portfolio_id=portfolio_id, method=method)
+        history = Transaction.objects.filter(portfolio_id=portfolio_id)
+        if checkpoint.date is not None:
+            recorded = history.filter(pk__gt=checkpoint.transaction_id)
+            if recorded.filter(date__lt=checkpoint.date).exists():
+                checkpoint.date = None
+            else:
+                history = recorded
+        if checkpoint.date is None:
+            RealizedGain.objects.filter(portfolio_id=portfolio_id, method=method).delete()
+            book = {}
+        else:
+            book = {int(instrument_id): Lots.load(rows) for instrument_id, rows in checkpoint.lots.items()}
+        history = history.order_by('date', 'pk').values_list(
+            'pk', 'portfolio_id', 'instrument_id', 'kind', 'date', 'quantity', 'price', 'fees',
+        )
+
+        count, row, gains = 0, None, []
+        for row in history.iterator(chunk_size=batch_size):
+            count += 1
+            gain = apply(book, method, row)
+            if gain is not None:
+                gains.append(gain)
+                if len(gains) >= batch_size:
+                    RealizedGain.objects.bulk_create(gains)
+                    gains = []
+        RealizedGain.objects.bulk_create(gains)
+        if row is not None:
+            checkpoint.transaction_id, checkpoint.date = row[0], row[4]
+            checkpoint.lots = {str(pk): lots.dump() for pk, lots in book.items() if len(lots)}
+            checkpoint.save()
+    return count
+
+
+def yearly_report(portfolio_id, method=FIFO, by_instrument=False):
+    """
+    Realized gains of a portfolio per year, optionally per instrument too:
+    dicts of year (and instrument symbol), sales, proceeds, cost_basis and
+    gain. Brings the matching up to date first.
+    """
+    update_lots(portfolio_id, method)
+    fields = ['year', 'instrument__symbol'] if by_instrument else ['year']
+    return list(
+        RealizedGain.objects.filter(portfolio_id=portfolio_id, method=method)
+        .annotate(year=ExtractYear('date'))
+        .values(*fields)
+        .annotate(sales=Count('pk'), proceeds=Sum('proceeds'), cost_basis=Sum('cost_basis'), gain=Sum('gain'))
+        .order_by(*fields)
+    )
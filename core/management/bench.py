@@ -0,0 +1,20 @@
+from django.test.utils import override_settings
+
+# Settings the bench_* commands run under. With DEBUG on, every query would
+# be kept in connection.queries, and the default local memory cache keeps
+# only 300 entries, fewer than most benchmarks cache.
+BENCHMARK_SETTINGS = {
+    'DEBUG': False,
+    'CACHES': {'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 1000000},
+    }},
+}
+
+
+def benchmark_settings(**overrides):
+    """
+    override_settings with BENCHMARK_SETTINGS and `overrides`, as a
+    decorator of a command's handle() or as a context manager.
+    """
+    return override_settings(**{**BENCHMARK_SETTINGS, **overrides})
@@ -0,0 +1,44 @@
+import datetime
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.adjustments import record_actions
+from core.models import CorporateAction, Instrument
+
+
+class Command(BaseCommand):
+    help = (
+        'Records a split or cash dividend of an instrument. Stored prices are left '
+        'as they are, adjusted prices are computed from the actions when read.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('symbol')
+        parser.add_argument('ex_date', type=datetime.date.fromisoformat, help='ISO date, e.g. 2024-06-10.')
+        kind = parser.add_mutually_exclusive_group(required=True)
+        kind.add_argument('--split', help="New shares per old share, e.g. '2' for 2-for-1, '0.1' for 1-for-10.")
+        kind.add_argument('--dividend', help='Cash per share, in the currency of the instrument.')
+
+    def handle(self, *args, **options):
+        try:
+            instrument = Instrument.objects.get(symbol=options['symbol'])
+        except Instrument.DoesNotExist:
+            raise CommandError(f'Instrument {options["symbol"]} does not exist.')
+        try:
+            value = Decimal(options['split'] or options['dividend'])
+        except InvalidOperation:
+            raise CommandError(f'Invalid number {options["split"] or options["dividend"]!r}.')
+        if value <= 0:
+            raise CommandError('The ratio or amount must be positive.')
+
+        if options['split']:
+            action = CorporateAction(instrument=instrument, kind=CorporateAction.SPLIT, ex_date=options['ex_date'], ratio=value)
+        else:
+            action = CorporateAction(
+                instrument=instrument, kind=CorporateAction.DIVIDEND, ex_date=options['ex_date'], amount=value,
+            )
+        if CorporateAction.objects.filter(instrument=instrument, kind=action.kind, ex_date=action.ex_date).exists():
+            raise CommandError(f'A {action.kind} of {instrument} on {action.ex_date} is already recorded.')
+        record_actions([action])
+        self.stdout.write(f'Recorded {action}.')
@@ -0,0 +1,87 @@
+import csv
+import datetime
+import sys
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Instrument
+from core.prices import BAR, get_price_store
+
+
+def parse_timestamp(value):
+    """
+    Accepts epoch seconds, an ISO date (a daily bar at 00:00 UTC) or an ISO
+    datetime, taken as UTC when it has no offset.
+    """
+    value = value.strip()
+    if value.isdigit():
+        return int(value)
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp())
+
+
+class Command(BaseCommand):
+    help = (
+        'Appends bars from a CSV file to the price store. Columns: symbol (unless '
+        '--symbol is given), date or timestamp, close, and optionally open, high, '
+        'low and volume. Bars not newer than the stored series are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file, or '-' for standard input.")
+        parser.add_argument('--symbol', help='Symbol of every row, for files without a symbol column.')
+        parser.add_argument('--interval', default='1d', help="Bar interval, e.g. '1d', '1h' or '1m'.")
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Rows parsed per append.')
+
+    def handle(self, *args, **options):
+        store = get_price_store()
+        stream = sys.stdin if options['path'] == '-' else open(options['path'], newline='')
+        written = skipped = 0
+        try:
+            reader = csv.DictReader(stream)
+            columns = set(reader.fieldnames or ())
+            time_column = 'timestamp' if 'timestamp' in columns else 'date'
+            missing = {time_column, 'close'} - columns
+            if not options['symbol']:
+                missing |= {'symbol'} - columns
+            if missing:
+                raise CommandError(f'Missing column(s): {", ".join(sorted(missing))}.')
+
+            pending, count = {}, 0
+            for line, row in enumerate(reader, start=2):
+                try:
+                    close = float(row['close'])
+                    bar = (
+                        parse_timestamp(row[time_column]),
+                        float(row.get('open') or close),
+                        float(row.get('high') or close),
+                        float(row.get('low') or close),
+                        close,
+                        float(row.get('volume') or 0),
+                    )
+                except (TypeError, ValueError) as exc:
+                    raise CommandError(f'Line {line}: {exc}')
+                pending.setdefault(options['symbol'] or row['symbol'].strip(), []).append(bar)
+                count += 1
+                if count >= options['chunk_size']:
+                    appended, total = self.flush(store, pending, options['interval'])
+                    written, skipped = written + appended, skipped + total - appended
+                    pending, count = {}, 0
+            appended, total = self.flush(store, pending, options['interval'])
+            written, skipped = written + appended, skipped + total - appended
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        self.stdout.write(f'Appended {written} bar(s), skipped {skipped} already stored.')
+
+    def flush(self, store, pending, interval):
+        # Valuation maps instruments to series by symbol, so make sure they exist.
+        Instrument.objects.bulk_create([Instrument(symbol=symbol) for symbol in pending], ignore_conflicts=True)
+        appended = total = 0
+        for symbol, bars in pending.items():
+            appended += store.append(symbol, np.array(bars, dtype=BAR), interval)
+            total += len(bars)
+        return appended, total
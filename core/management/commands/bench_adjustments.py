@@ -0,0 +1,75 @@
+import datetime
+import tempfile
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.adjustments import adjusted_close_matrix, record_actions
+from core.management.bench import benchmark_settings
+from core.models import CorporateAction, Instrument
+from core.prices import BAR, DAY, date_to_ts, get_price_store
+
+START = datetime.date(2005, 1, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes --symbols daily series of --days bars to a temporary memmap store, '
+        'records --actions splits and dividends per symbol inside a rolled back '
+        'transaction and times reading a year of closes for all of them, raw and '
+        'adjusted, with the factors cold and cached.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', type=int, default=500)
+        parser.add_argument('--days', type=int, default=7000)
+        parser.add_argument('--actions', type=int, default=10)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as root, benchmark_settings(
+            PRICE_STORE='core.prices.MemmapPriceStore',
+            PRICE_STORE_DIR=root,
+        ):
+            self.run(options['symbols'], options['days'], options['actions'])
+
+    def run(self, count, days, actions_per_symbol):
+        rng = np.random.default_rng(24)
+        store = get_price_store()
+        with transaction.atomic():
+            instruments = Instrument.objects.bulk_create([Instrument(symbol=f'ADJ{i}') for i in range(count)])
+            self.stdout.write(f'Writing {count} series of {days} bars...')
+            bars = np.zeros(days, dtype=BAR)
+            bars['ts'] = date_to_ts(START) + np.arange(days) * DAY
+            for instrument in instruments:
+                bars['close'] = 100 * np.exp(rng.normal(0, 0.01, days).cumsum())
+                store.append(instrument.symbol, bars)
+            actions = []
+            for instrument in instruments:
+                for day in sorted(rng.choice(np.arange(1, days), actions_per_symbol, replace=False)):
+                    ex_date = START + datetime.timedelta(days=int(day))
+                    if rng.random() < 0.2:
+                        actions.append(CorporateAction(
+                            instrument=instrument, kind=CorporateAction.SPLIT, ex_date=ex_date, ratio=2,
+                        ))
+                    else:
+                        actions.append(CorporateAction(
+                            instrument=instrument, kind=CorporateAction.DIVIDEND, ex_date=ex_date, amount=1,
+                        ))
+            record_actions(actions)
+
+            pairs = [(instrument.pk, instrument.symbol) for instrument in instruments]
+            start = START + datetime.timedelta(days=days // 2)
+            # Maps the files, so that every read below finds them mapped.
+            store.close_matrix(pairs, start, 365)
+            began = time.perf_counter()
+            store.close_matrix(pairs, start, 365)
+            raw = time.perf_counter() - began
+            self.stdout.write(f'  raw:            {raw * 1000:.1f} ms')
+            for label in ('adjusted, cold', 'adjusted, warm'):
+                began = time.perf_counter()
+                adjusted_close_matrix(pairs, start, 365)
+                elapsed = time.perf_counter() - began
+                self.stdout.write(f'  {label}: {elapsed * 1000:.1f} ms (+{(elapsed - raw) * 1000:.1f} ms over raw)')
+            transaction.set_rollback(True)
@@ -0,0 +1,93 @@
+import datetime
+import gc
+import os
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+
+from core import exports
+from core.management.bench import benchmark_settings
+from core.models import Instrument, Portfolio, Transaction
+from core.views import export_transactions
+
+
+def rss():
+    """
+    Resident set size of this process in bytes (Linux only).
+    """
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds one portfolio with --transactions transactions inside a rolled back '
+        'transaction and exports it through the streaming view (CSV, gzipped CSV and '
+        'JSON lines) and, for comparison, by building the whole CSV in memory. '
+        'Reports the peak RSS growth of each run.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=1000000)
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        if not os.path.exists('/proc/self/statm'):
+            raise CommandError('This benchmark reads the RSS from /proc and needs Linux.')
+        count = options['transactions']
+        with transaction.atomic():
+            owner = User.objects.create_user('bench-export', 'bench-export@example.com')
+            portfolio = Portfolio.objects.create(owner=owner, name='Export')
+            instruments = Instrument.objects.bulk_create([Instrument(symbol=f'EXP{i}') for i in range(100)])
+            self.stdout.write(f'Seeding {count} transactions...')
+            day = datetime.date(2000, 1, 3)
+            for start in range(0, count, 10000):
+                Transaction.objects.bulk_create([
+                    Transaction(
+                        portfolio=portfolio, instrument=instruments[i % 100], kind=Transaction.BUY,
+                        date=day + datetime.timedelta(days=i // 500), quantity=Decimal(i % 97 + 1),
+                        price=Decimal('123.45'), fees=Decimal('1'),
+                    )
+                    for i in range(start, min(start + 10000, count))
+                ])
+
+            factory = RequestFactory()
+            for label, export_format, headers in (
+                ('streaming csv', 'csv', {}),
+                ('streaming csv gzip', 'csv', {'accept-encoding': 'gzip'}),
+                ('streaming jsonl', 'jsonl', {}),
+            ):
+                request = factory.get('/', headers=headers)
+                request.user = owner
+                self.measure(label, lambda: export_transactions(request, portfolio.pk, export_format).streaming_content)
+
+            def materialized():
+                rows = list(
+                    Transaction.objects.filter(portfolio=portfolio).order_by('date', 'pk')
+                    .values_list('date', 'instrument__symbol', 'kind', 'quantity', 'price', 'fees')
+                )
+                yield ''.join(exports.csv_lines(exports.TRANSACTION_FIELDS, rows)).encode()
+
+            # Measured last: memory Python took from the OS is rarely given back.
+            self.measure('materialized csv', materialized)
+            transaction.set_rollback(True)
+
+    def measure(self, label, produce):
+        gc.collect()
+        baseline = peak = rss()
+        size = 0
+        start = time.perf_counter()
+        for i, chunk in enumerate(produce()):
+            size += len(chunk)
+            if i % 16 == 0:
+                peak = max(peak, rss())
+        peak = max(peak, rss())
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f'{label:>19}: {size / 2**20:8.1f} MiB in {elapsed:5.1f} s, '
+            f'peak RSS growth {(peak - baseline) / 2**20:7.1f} MiB'
+        )
@@ -0,0 +1,85 @@
+import datetime
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.fx import convert, rate_cache
+from core.management.bench import benchmark_settings
+from core.models import ExchangeRate
+
+START = datetime.date(2015, 1, 1)
+YEARS = 10
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds ten years of daily EUR/USD and USD/PLN rates inside a rolled back '
+        'transaction and times converting a --rows ledger in EUR, USD and PLN into '
+        'PLN, cold and with the rate slices cached, against one query per row.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--naive', type=int, default=2000, help='Rows converted with a query each.')
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(22)
+        days = (datetime.date(START.year + YEARS, 1, 1) - START).days
+        with transaction.atomic():
+            dates = [START + datetime.timedelta(days=day) for day in range(days)]
+            ExchangeRate.objects.bulk_create(
+                [
+                    ExchangeRate(base=base, quote=quote, date=date, rate=Decimal(f'{rate:.6f}'))
+                    for base, quote, level in (('EUR', 'USD', 1.1), ('USD', 'PLN', 4.0))
+                    for date, rate in zip(dates, level + rng.normal(0, 0.01, days).cumsum() / 10)
+                    # Weekends have no fixing, their rate is carried forward.
+                    if date.weekday() < 5
+                ],
+                batch_size=5000,
+            )
+
+            rows = options['rows']
+            amounts = rng.uniform(1, 10000, rows)
+            currencies = rng.choice(np.array(['EUR', 'USD', 'PLN']), rows)
+            ledger_dates = np.datetime64(START, 'D') + rng.integers(0, days, rows)
+            self.stdout.write(f'Converting {rows:,} rows over {YEARS} years into PLN...')
+
+            rate_cache.clear()
+            for label in ('cold', 'warm'):
+                with CaptureQueriesContext(connection) as queries:
+                    began = time.perf_counter()
+                    converted = convert(amounts, currencies, ledger_dates, 'PLN')
+                    elapsed = time.perf_counter() - began
+                self.stdout.write(
+                    f'  {label}: {elapsed:.3f} s ({rows / elapsed:,.0f} rows/s), {len(queries)} queries, '
+                    f'{np.isnan(converted).sum()} without a rate'
+                )
+            self.stdout.write(f'  LRU: {rate_cache.hits} hits, {rate_cache.misses} misses')
+
+            sample = min(options['naive'], rows)
+            began = time.perf_counter()
+            for amount, currency, date in zip(amounts[:sample], currencies[:sample], ledger_dates[:sample].tolist()):
+                amount * self.naive_rate(currency, date)
+            elapsed = time.perf_counter() - began
+            self.stdout.write(f'  naive: {sample:,} rows in {elapsed:.3f} s ({sample / elapsed:,.0f} rows/s), '
+                              f'{rows / (sample / elapsed):,.0f} s for the whole ledger')
+            transaction.set_rollback(True)
+
+    def naive_rate(self, currency, date):
+        def latest(base, quote):
+            rate = (
+                ExchangeRate.objects.filter(base=base, quote=quote, date__lte=date)
+                .order_by('-date').values_list('rate', flat=True).first()
+            )
+            return float(rate)
+
+        if currency == 'PLN':
+            return 1.0
+        if currency == 'USD':
+            return latest('USD', 'PLN')
+        return latest('EUR', 'USD') * latest('USD', 'PLN')
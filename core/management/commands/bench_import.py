@@ -0,0 +1,67 @@
+import datetime
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.imports import import_transactions
+from core.management.bench import benchmark_settings
+from core.models import Portfolio
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports generated broker CSV files of increasing size inside a rolled back '
+        'transaction. Reports rows/s of a first and a second (all duplicate) import, '
+        'and the peak Python memory of a traced import into a fresh portfolio.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[50000, 200000])
+        parser.add_argument('--symbols', type=int, default=100)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        with transaction.atomic():
+            owner = User.objects.create_user('bench-import', 'bench-import@example.com')
+            for rows in options['rows']:
+                portfolio = Portfolio.objects.create(owner=owner, name=f'Import {rows}')
+                with tempfile.TemporaryFile('w+', newline='') as csv_file:
+                    self.generate(csv_file, rows, options['symbols'])
+                    for label in ('first import', 'second import'):
+                        csv_file.seek(0)
+                        start = time.perf_counter()
+                        report = import_transactions(portfolio, csv_file, chunk_size=chunk_size)
+                        elapsed = time.perf_counter() - start
+                        self.stdout.write(
+                            f'{rows:>8} rows, {label:>13}: {elapsed:6.1f} s ({rows / elapsed:8,.0f} rows/s), {report}'
+                        )
+
+                    # Traced separately, tracemalloc slows the import down several times.
+                    csv_file.seek(0)
+                    traced = Portfolio.objects.create(owner=owner, name=f'Traced {rows}')
+                    tracemalloc.start()
+                    import_transactions(traced, csv_file, chunk_size=chunk_size)
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    self.stdout.write(f'{rows:>8} rows, peak Python memory {peak / 2**20:.1f} MiB')
+            transaction.set_rollback(True)
+
+    def generate(self, csv_file, rows, symbols):
+        rng = random.Random(16)
+        day = datetime.date(2010, 1, 4)
+        csv_file.write('date,symbol,kind,quantity,price,fees\n')
+        for i in range(rows):
+            if i % 200 == 0:
+                day += datetime.timedelta(days=1)
+            # Buys only, so that any order of rows is valid.
+            csv_file.write(
+                f'{day.isoformat()},SYM{rng.randrange(symbols)},buy,{rng.randint(1, 100)},'
+                f'{rng.randint(100, 99999) / 100},1\n'
+            )
@@ -0,0 +1,71 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.management.bench import benchmark_settings
+from core.lots import METHODS, update_lots
+from core.models import Instrument, LotCheckpoint, Portfolio, Transaction
+from core.positions import record_transactions
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a portfolio with --transactions random trades inside a rolled back '
+        'transaction, matches them against tax lots with every method, then times '
+        'matching --appended more from the checkpoint.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=100000)
+        parser.add_argument('--appended', type=int, default=100)
+        parser.add_argument('--instruments', type=int, default=20)
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        rng = random.Random(23)
+        with transaction.atomic():
+            owner = User.objects.create_user('bench-lots', 'bench-lots@example.com')
+            portfolio = Portfolio.objects.create(owner=owner, name='Lots')
+            instruments = Instrument.objects.bulk_create(
+                [Instrument(symbol=f'LOT{i}') for i in range(options['instruments'])]
+            )
+            total = options['transactions'] + options['appended']
+            held = dict.fromkeys(instruments, 0)
+            ledger = []
+            for i in range(total):
+                instrument = rng.choice(instruments)
+                if held[instrument] and rng.random() < 0.4:
+                    kind, quantity = Transaction.SELL, rng.randint(1, held[instrument])
+                    held[instrument] -= quantity
+                else:
+                    kind, quantity = Transaction.BUY, rng.randint(1, 20)
+                    held[instrument] += quantity
+                ledger.append(Transaction(
+                    portfolio=portfolio, instrument=instrument, kind=kind,
+                    date=datetime.date(2000, 1, 1) + datetime.timedelta(days=i * 9000 // total),
+                    quantity=quantity, price=Decimal(rng.randint(1000, 20000)) / 100, fees=1,
+                ))
+            self.stdout.write(f'Seeding {options["transactions"]} transactions...')
+            record_transactions(ledger[:options['transactions']])
+
+            for method in METHODS:
+                began = time.perf_counter()
+                update_lots(portfolio.pk, method)
+                elapsed = time.perf_counter() - began
+                self.stdout.write(f'  {method}: full match in {elapsed:.2f} s '
+                                  f'({options["transactions"] / elapsed:,.0f} transactions/s)')
+
+            record_transactions(ledger[options['transactions']:])
+            for method in METHODS:
+                lots = sum(len(rows) for rows in LotCheckpoint.objects.get(portfolio=portfolio, method=method).lots.values())
+                began = time.perf_counter()
+                update_lots(portfolio.pk, method)
+                elapsed = time.perf_counter() - began
+                self.stdout.write(f'  {method}: {options["appended"]} appended in {elapsed * 1000:.1f} ms '
+                                  f'from a checkpoint of {lots} open lots')
+            transaction.set_rollback(True)
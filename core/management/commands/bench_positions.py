@@ -0,0 +1,97 @@
+import datetime
+import random
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+
+from core.management.bench import benchmark_settings
+from core.models import Instrument, Portfolio, Position, Transaction
+from core.positions import rebuild_position, record_transaction, record_transactions
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds one portfolio with --transactions transactions inside a rolled back '
+        'transaction and measures bulk recording, appending one transaction, reading '
+        'holdings from Position and recomputing them from the full history.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=1000000)
+        parser.add_argument('--instruments', type=int, default=50)
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--appends', type=int, default=200)
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        count = options['transactions']
+        rng = random.Random(13)
+        with transaction.atomic():
+            owner = User.objects.create_user('bench-positions', 'bench-positions@example.com')
+            portfolio = Portfolio.objects.create(owner=owner, name='Benchmark')
+            instruments = Instrument.objects.bulk_create(
+                [Instrument(symbol=f'BENCH{i}') for i in range(options['instruments'])]
+            )
+
+            start = time.perf_counter()
+            stored = record_transactions(
+                self.generate(portfolio, instruments, count, rng), batch_size=options['batch_size'],
+            )
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'record_transactions: {stored} rows in {elapsed:.1f} s ({stored / elapsed:,.0f} rows/s)')
+
+            last_date = Transaction.objects.filter(portfolio=portfolio).latest('date').date
+            timings = []
+            for _ in range(options['appends']):
+                start = time.perf_counter()
+                record_transaction(portfolio, rng.choice(instruments), Transaction.BUY, last_date, 1, 100)
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(
+                f'record_transaction:  p50 {statistics.median(timings):.3f} ms  '
+                f'max {max(timings):.3f} ms per append'
+            )
+
+            self.measure('holdings from Position', lambda: list(
+                Position.objects.filter(portfolio=portfolio).values_list('instrument_id', 'quantity', 'cost_basis')
+            ))
+            self.measure('holdings from history', lambda: list(
+                Transaction.objects.filter(portfolio=portfolio).values('instrument_id').annotate(
+                    quantity=Sum(Case(When(kind=Transaction.SELL, then=-F('quantity')), default=F('quantity'))),
+                )
+            ))
+            self.measure('rebuild one position', lambda: rebuild_position(portfolio.pk, instruments[0].pk))
+            transaction.set_rollback(True)
+
+    def measure(self, label, function, repeat=5):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - start) * 1000)
+        self.stdout.write(f'{label:>23}: {statistics.median(timings):10.3f} ms')
+
+    def generate(self, portfolio, instruments, count, rng):
+        held = {instrument.pk: Decimal(0) for instrument in instruments}
+        day = datetime.date(2000, 1, 3)
+        for i in range(count):
+            if i % 500 == 0:
+                day += datetime.timedelta(days=1)
+            instrument = rng.choice(instruments)
+            price = Decimal(rng.randint(1000, 50000)) / 100
+            quantity = Decimal(rng.randint(1, 100))
+            # Roughly one sell for every three buys, never more than is held.
+            if held[instrument.pk] >= quantity and rng.random() < 0.25:
+                kind = Transaction.SELL
+                held[instrument.pk] -= quantity
+            else:
+                kind = Transaction.BUY
+                held[instrument.pk] += quantity
+            yield Transaction(
+                portfolio=portfolio, instrument=instrument, kind=kind, date=day,
+                quantity=quantity, price=price, fees=Decimal('1.00'),
+            )
@@ -0,0 +1,48 @@
+import asyncio
+import random
+import time
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from core import quotes
+from core.management.bench import benchmark_settings
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulates --users concurrent dashboard loads of --per-user symbols each out of '
+        '--symbols, against a stub provider with --latency seconds per call. Reports '
+        'upstream calls and symbols requested, cold and with the TTL cache warm.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--symbols', type=int, default=500)
+        parser.add_argument('--per-user', type=int, default=20)
+        parser.add_argument('--latency', type=float, default=0.05)
+
+    @benchmark_settings(QUOTE_PROVIDERS=['core.quotes.StubQuoteProvider'])
+    def handle(self, *args, **options):
+        rng = random.Random(21)
+        universe = [f'Q{i}' for i in range(options['symbols'])]
+        requests = [rng.sample(universe, options['per_user']) for _ in range(options['users'])]
+        quotes.load_fetcher.cache_clear()
+        provider = quotes.get_fetcher().providers[0]
+        provider.delay = options['latency']
+
+        async def load_all():
+            return await asyncio.gather(*(quotes.aget_quotes(symbols) for symbols in requests))
+
+        for label in ('cold', 'warm'):
+            provider.calls.clear()
+            start = time.perf_counter()
+            results = async_to_sync(load_all)()
+            elapsed = time.perf_counter() - start
+            served = sum(len(result) for result in results)
+            self.stdout.write(
+                f'{label}: {options["users"]} loads, {served} quotes served in {elapsed:.2f} s; '
+                f'{len(provider.calls)} upstream call(s) for {sum(map(len, provider.calls))} symbol(s), '
+                f'naive: {served} symbol(s)'
+            )
+        quotes.load_fetcher.cache_clear()
@@ -0,0 +1,121 @@
+import datetime
+import math
+import random
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.management.bench import benchmark_settings
+from core.models import Instrument, Portfolio, Price, Transaction
+from core.positions import record_transactions
+from core.returns import compute_returns, portfolio_returns, xirr
+
+
+def reference_xirr(amounts, times):
+    """
+    Plain scalar bisection on the rate, the accuracy reference.
+    """
+    def npv(rate):
+        return sum(amount * (1 + rate) ** -t for amount, t in zip(amounts, times))
+
+    if not (min(amounts) < 0 < max(amounts)):
+        return math.nan
+    lo, hi = -0.999999, 1.0
+    while npv(hi) > 0 and hi < 1e9:
+        hi *= 2
+    if npv(lo) * npv(hi) > 0:
+        return math.nan
+    for _ in range(200):
+        mid = (lo + hi) / 2
+        if (npv(mid) > 0) == (npv(lo) > 0):
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2
+
+
+class Command(BaseCommand):
+    help = (
+        'Solves --series random monthly cash flow series with the batched XIRR solver '
+        'and checks them against a scalar bisection. Then seeds --portfolios portfolios '
+        'inside a rolled back transaction and times computing their returns, cold and memoized.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--series', type=int, default=10000)
+        parser.add_argument('--flows', type=int, default=36, help='Monthly flows per series.')
+        parser.add_argument('--reference', type=int, default=500, help='Series also solved by the reference.')
+        parser.add_argument('--portfolios', type=int, default=2000)
+
+    @benchmark_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+    def handle(self, *args, **options):
+        self.solver(options['series'], options['flows'], options['reference'])
+        self.portfolios(options['portfolios'])
+
+    def solver(self, series, flows, reference):
+        rng = np.random.default_rng(19)
+        # Contributions, a few withdrawals and the closing value.
+        amounts = -rng.uniform(0, 1000, (series, flows))
+        amounts[rng.random((series, flows)) < 0.2] *= -0.5
+        amounts[:, 0] = -rng.uniform(1000, 10000, series)
+        amounts[:, -1] = -amounts[:, :-1].sum(axis=1) * rng.uniform(0.5, 2.5, series)
+        times = np.arange(flows) / 12
+
+        start = time.perf_counter()
+        rates = xirr(amounts, times)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'batched solver: {series} series x {flows} flows in {elapsed:.3f} s '
+                          f'({series / elapsed:,.0f} series/s), {np.isnan(rates).sum()} without a rate')
+
+        sample = min(reference, series)
+        start = time.perf_counter()
+        expected = np.array([reference_xirr(amounts[i].tolist(), times.tolist()) for i in range(sample)])
+        elapsed = time.perf_counter() - start
+        error = np.nanmax(np.abs(rates[:sample] - expected))
+        self.stdout.write(f'     reference: {sample} series in {elapsed:.3f} s ({sample / elapsed:,.0f} series/s), '
+                          f'max abs difference {error:.2e}')
+
+    def portfolios(self, count):
+        rng = random.Random(19)
+        start, end = datetime.date(2023, 1, 1), datetime.date(2023, 12, 31)
+        with transaction.atomic():
+            owner = User.objects.create_user('bench-returns', 'bench-returns@example.com')
+            instruments = Instrument.objects.bulk_create([Instrument(symbol=f'RET{i}') for i in range(50)])
+            Price.objects.bulk_create(
+                [
+                    Price(instrument=instrument, date=start + datetime.timedelta(days=day),
+                          close=Decimal(100 + 10 * math.sin(day / 30 + column)).quantize(Decimal('0.01')))
+                    for column, instrument in enumerate(instruments)
+                    for day in range(365)
+                ],
+                batch_size=5000,
+            )
+            portfolios = Portfolio.objects.bulk_create([Portfolio(owner=owner, name=f'R{i}') for i in range(count)])
+            self.stdout.write(f'Seeding {count} portfolios with 5 holdings and 20 trades each...')
+            record_transactions(
+                Transaction(
+                    portfolio=portfolio, instrument=instruments[(i * 7 + trade % 5) % 50], kind=Transaction.BUY,
+                    date=start + datetime.timedelta(days=rng.randrange(365)), quantity=rng.randint(1, 50),
+                    price=100, fees=1,
+                )
+                for i, portfolio in enumerate(portfolios)
+                for trade in range(20)
+            )
+            ids = [portfolio.pk for portfolio in portfolios]
+
+            began = time.perf_counter()
+            results = compute_returns(ids, start, end)
+            elapsed = time.perf_counter() - began
+            solved = len(results) + sum(len(returns.holdings) for returns in results.values())
+            self.stdout.write(f'  cold: {count} portfolios in {elapsed:.2f} s ({count / elapsed:,.0f} portfolios/s, '
+                              f'{solved / elapsed:,.0f} series/s incl. holdings)')
+            portfolio_returns(ids, start, end)
+            began = time.perf_counter()
+            portfolio_returns(ids, start, end)
+            elapsed = time.perf_counter() - began
+            self.stdout.write(f'  memoized: {count} portfolios in {elapsed:.3f} s ({count / elapsed:,.0f} portfolios/s)')
+            transaction.set_rollback(True)
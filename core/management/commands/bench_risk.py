@@ -0,0 +1,89 @@
+import datetime
+import tempfile
+import time
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.management.bench import benchmark_settings
+from core.models import Instrument, Portfolio, Position
+from core.prices import BAR, DAY, date_to_ts, get_price_store
+from core.risk import RISK_WINDOW, portfolio_risk
+
+START = datetime.date(2020, 1, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes --instruments daily series to a temporary memmap store, seeds '
+        '--portfolios portfolios holding one of --models instrument sets inside a '
+        'rolled back transaction and times their risk in one batch, cold and with '
+        'the covariance matrices cached, against one portfolio at a time.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--instruments', type=int, default=200)
+        parser.add_argument('--portfolios', type=int, default=2000)
+        parser.add_argument('--models', type=int, default=50)
+        parser.add_argument('--holdings', type=int, default=20)
+        parser.add_argument('--days', type=int, default=2000)
+        parser.add_argument('--window', type=int, default=RISK_WINDOW)
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as root, benchmark_settings(
+            PRICE_STORE='core.prices.MemmapPriceStore',
+            PRICE_STORE_DIR=root,
+            RISK_BENCHMARK='RISK0',
+        ):
+            self.run(options)
+
+    def run(self, options):
+        rng = np.random.default_rng(25)
+        store = get_price_store()
+        days = options['days']
+        with transaction.atomic():
+            instruments = Instrument.objects.bulk_create(
+                [Instrument(symbol=f'RISK{i}') for i in range(options['instruments'])]
+            )
+            self.stdout.write(f'Writing {len(instruments)} series of {days} bars...')
+            bars = np.zeros(days, dtype=BAR)
+            bars['ts'] = date_to_ts(START) + np.arange(days) * DAY
+            market = rng.normal(0, 0.01, days)
+            for instrument in instruments:
+                bars['close'] = 100 * np.exp((rng.uniform(0.5, 1.5) * market + rng.normal(0, 0.01, days)).cumsum())
+                store.append(instrument.symbol, bars)
+
+            owner = User.objects.create_user('bench-risk', 'bench-risk@example.com')
+            portfolios = Portfolio.objects.bulk_create(
+                [Portfolio(owner=owner, name=f'Risk {i}') for i in range(options['portfolios'])]
+            )
+            models = [
+                rng.choice(len(instruments), options['holdings'], replace=False) for _ in range(options['models'])
+            ]
+            Position.objects.bulk_create([
+                Position(portfolio=portfolio, instrument=instruments[i], quantity=int(rng.integers(1, 100)))
+                for n, portfolio in enumerate(portfolios)
+                for i in models[n % len(models)]
+            ])
+
+            ids = [portfolio.pk for portfolio in portfolios]
+            end = START + datetime.timedelta(days=days - 1)
+            # Maps the files and computes the adjustment factors first, over
+            # another window so that no covariance matrix is cached yet.
+            portfolio_risk(ids, end, 30)
+            for label in ('batch, cold', 'batch, warm'):
+                began = time.perf_counter()
+                portfolio_risk(ids, end, options['window'])
+                elapsed = time.perf_counter() - began
+                self.stdout.write(f'  {label}: {elapsed * 1000:.1f} ms for {len(ids)} portfolios')
+
+            sample = ids[:100]
+            began = time.perf_counter()
+            for pk in sample:
+                portfolio_risk([pk], end, options['window'] - 1)
+            elapsed = (time.perf_counter() - began) * len(ids) / len(sample)
+            self.stdout.write(f'  one at a time: {elapsed * 1000:.1f} ms for {len(ids)} portfolios '
+                              f'(extrapolated from {len(sample)}, sharing the cache)')
+            transaction.set_rollback(True)
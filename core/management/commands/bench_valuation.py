@@ -0,0 +1,144 @@
+import datetime
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from core.management.bench import benchmark_settings
+from core.models import Instrument, Portfolio, Price, Transaction
+from core.prices import BAR, MemmapPriceStore, date_to_ts
+from core.valuation import value_portfolios
+
+
+def reference_valuation(portfolio_id, start, end):
+    """
+    The straightforward implementation: for every day and every instrument
+    held, look up the latest close with the ORM. Returns (market_value, cash)
+    lists, one entry per day.
+    """
+    trades = list(Transaction.objects.filter(portfolio_id=portfolio_id, date__lte=end).order_by('date'))
+    market_values, cash_values = [], []
+    day = start
+    while day <= end:
+        holdings = {}
+        cash = Decimal(0)
+        for trade in trades:
+            if trade.date > day:
+                break
+            gross = trade.quantity * trade.price
+            if trade.kind == Transaction.BUY:
+                holdings[trade.instrument_id] = holdings.get(trade.instrument_id, 0) + trade.quantity
+                cash -= gross + trade.fees
+            else:
+                holdings[trade.instrument_id] = holdings.get(trade.instrument_id, 0) - trade.quantity
+                cash += gross - trade.fees
+        value = Decimal(0)
+        for instrument_id, quantity in holdings.items():
+            price = Price.objects.filter(instrument_id=instrument_id, date__lte=day).order_by('-date').first()
+            if price is not None:
+                value += quantity * price.close
+        market_values.append(float(value))
+        cash_values.append(float(cash))
+        day += datetime.timedelta(days=1)
+    return market_values, cash_values
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds --portfolios portfolios with prices and trades inside a rolled back '
+        'transaction, values all of them over --days days with core.valuation, once '
+        'per price store, and compares with the per-day ORM loop on '
+        '--reference-portfolios of them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--portfolios', type=int, default=2000)
+        parser.add_argument('--instruments', type=int, default=200)
+        parser.add_argument('--holdings', type=int, default=15, help='Instruments traded per portfolio.')
+        parser.add_argument('--trades', type=int, default=100, help='Trades per portfolio.')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--reference-portfolios', type=int, default=3)
+
+    @benchmark_settings()
+    def handle(self, *args, **options):
+        rng = random.Random(14)
+        days = options['days']
+        end = datetime.date(2024, 12, 31)
+        start = end - datetime.timedelta(days=days - 1)
+        history_start = start - datetime.timedelta(days=days)
+
+        with transaction.atomic(), tempfile.TemporaryDirectory() as store_dir:
+            memmap_store = MemmapPriceStore(store_dir)
+            owner = User.objects.create_user('bench-valuation', 'bench-valuation@example.com')
+            instruments = Instrument.objects.bulk_create(
+                [Instrument(symbol=f'VAL{i}') for i in range(options['instruments'])]
+            )
+            self.stdout.write('Seeding prices...')
+            for instrument in instruments:
+                close = rng.uniform(10, 500)
+                prices = []
+                for offset in range(days * 2):
+                    date = history_start + datetime.timedelta(days=offset)
+                    close *= 1 + rng.gauss(0, 0.02)
+                    # Weekends have no price and carry Friday's close.
+                    if date.weekday() < 5:
+                        prices.append(Price(instrument=instrument, date=date, close=Decimal(f'{close:.4f}')))
+                Price.objects.bulk_create(prices)
+                bars = np.zeros(len(prices), dtype=BAR)
+                bars['ts'] = [date_to_ts(price.date) for price in prices]
+                for field in ('open', 'high', 'low', 'close'):
+                    bars[field] = [float(price.close) for price in prices]
+                memmap_store.append(instrument.symbol, bars)
+
+            self.stdout.write('Seeding portfolios...')
+            portfolios = Portfolio.objects.bulk_create(
+                [Portfolio(owner=owner, name=f'Portfolio {i}') for i in range(options['portfolios'])]
+            )
+            trades = []
+            for portfolio in portfolios:
+                for instrument in rng.sample(instruments, options['holdings']):
+                    trades.append(Transaction(
+                        portfolio=portfolio, instrument=instrument, kind=Transaction.BUY, date=history_start,
+                        quantity=Decimal(rng.randint(50, 100)), price=Decimal('100'),
+                    ))
+                for _ in range(options['trades'] - options['holdings']):
+                    trades.append(Transaction(
+                        portfolio=portfolio, instrument=rng.choice(instruments),
+                        kind=rng.choice((Transaction.BUY, Transaction.SELL)),
+                        date=history_start + datetime.timedelta(days=rng.randrange(days * 2)),
+                        quantity=Decimal(rng.randint(1, 10)), price=Decimal('100'), fees=Decimal('1'),
+                    ))
+            Transaction.objects.bulk_create(trades, batch_size=10000)
+
+            ids = [portfolio.pk for portfolio in portfolios]
+            for label, store in (('database', 'core.prices.DatabasePriceStore'),
+                                 ('memmap', 'core.prices.MemmapPriceStore')):
+                with benchmark_settings(PRICE_STORE=store, PRICE_STORE_DIR=store_dir):
+                    started = time.perf_counter()
+                    valuation = value_portfolios(ids, start, end)
+                    vectorized = time.perf_counter() - started
+                self.stdout.write(
+                    f'value_portfolios ({label:>8} prices): {len(ids)} portfolios x {days} days in '
+                    f'{vectorized * 1e3:.1f} ms ({vectorized / len(ids) * 1e3:.3f} ms/portfolio)'
+                )
+
+            reference_ids = ids[:options['reference_portfolios']]
+            started = time.perf_counter()
+            for pk in reference_ids:
+                market_value, cash = reference_valuation(pk, start, end)
+                row = valuation.row(pk)
+                if not (np.allclose(market_value, valuation.market_value[row]) and
+                        np.allclose(cash, valuation.cash[row])):
+                    raise CommandError(f'Portfolio {pk} differs from the reference implementation.')
+            naive = (time.perf_counter() - started) / max(len(reference_ids), 1)
+            self.stdout.write(
+                f'reference loop: {naive * 1e3:.1f} ms/portfolio, '
+                f'{naive * len(ids):.0f} s estimated for all, '
+                f'{naive * len(ids) / vectorized:,.0f}x slower'
+            )
+            transaction.set_rollback(True)
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.models import Position
+from core.quotes import get_fetcher, get_quotes
+
+
+class Command(BaseCommand):
+    help = (
+        'Fetches quotes of every instrument held in some portfolio (or of --symbols) '
+        'into the shared cache, so that pages find them there. Use --loop to refresh '
+        'them in the background.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--symbols', nargs='+', help='Symbols to fetch instead of the held ones.')
+        parser.add_argument('--loop', action='store_true', help='Keep refreshing instead of exiting.')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Seconds between refreshes, QUOTE_CACHE_TTL by default.')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.QUOTE_CACHE_TTL
+        while True:
+            symbols = options['symbols'] or list(
+                Position.objects.exclude(quantity=0).values_list('instrument__symbol', flat=True).distinct()
+            )
+            start = time.perf_counter()
+            quotes = get_quotes(symbols)
+            elapsed = time.perf_counter() - start
+            self.stdout.write(f'Fetched {len(quotes)} of {len(symbols)} quote(s) in {elapsed:.2f} s')
+            for provider in get_fetcher().providers:
+                if provider.breaker.is_open:
+                    self.stdout.write(f'{provider.name} is skipped after failing: {provider.breaker.last_error}')
+            if not options['loop']:
+                break
+            time.sleep(interval)
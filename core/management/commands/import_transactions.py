@@ -0,0 +1,48 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.imports import import_transactions
+from core.models import Portfolio
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports a broker CSV export (date, symbol, kind, quantity, price and '
+        'optionally fees) into a portfolio. Rows imported before are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('portfolio', type=int, help='Portfolio id.')
+        parser.add_argument('path', help="CSV file, or '-' for standard input.")
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            portfolio = Portfolio.objects.get(pk=options['portfolio'])
+        except Portfolio.DoesNotExist:
+            raise CommandError(f'Portfolio {options["portfolio"]} does not exist.')
+
+        if options['path'] == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+        else:
+            stream = open(options['path'], encoding='utf-8-sig', newline='')
+        try:
+            report = import_transactions(
+                portfolio, stream, chunk_size=options['chunk_size'],
+                progress=lambda report: self.stdout.write(str(report)),
+            )
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if options['path'] != '-':
+                stream.close()
+
+        for error in report.errors:
+            self.stderr.write(error)
+        if report.error_count > len(report.errors):
+            self.stderr.write(f'... and {report.error_count - len(report.errors)} more invalid row(s).')
+        if report.aborted:
+            raise CommandError(f'Import stopped: {report}')
+        self.stdout.write(self.style.SUCCESS(f'Done: {report}'))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.lots import FIFO, METHODS, yearly_report
+from core.models import Portfolio
+from core.positions import InsufficientQuantity
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints the realized gains of a portfolio per year, matching sells against '
+        'tax lots first in, first out (the default), last in, first out or at average cost.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('portfolio', type=int, help='Portfolio id.')
+        parser.add_argument('--method', choices=METHODS, default=FIFO)
+        parser.add_argument('--by-instrument', action='store_true', help='One line per year and instrument.')
+
+    def handle(self, *args, **options):
+        try:
+            portfolio = Portfolio.objects.get(pk=options['portfolio'])
+        except Portfolio.DoesNotExist:
+            raise CommandError(f'Portfolio {options["portfolio"]} does not exist.')
+        try:
+            report = yearly_report(portfolio.pk, options['method'], by_instrument=options['by_instrument'])
+        except InsufficientQuantity as exc:
+            raise CommandError(str(exc))
+
+        self.stdout.write(f'Realized gains of {portfolio} ({options["method"]}):')
+        for row in report:
+            label = f'{row["year"]} {row["instrument__symbol"]}' if options['by_instrument'] else str(row['year'])
+            self.stdout.write(
+                f'{label}: {row["sales"]} sale(s), proceeds {row["proceeds"]:.2f}, '
+                f'cost {row["cost_basis"]:.2f}, gain {row["gain"]:.2f}'
+            )
+        if not report:
+            self.stdout.write('No sales.')
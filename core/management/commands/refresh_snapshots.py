@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Portfolio
+from core.snapshots import mark_all_dirty, refresh_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes the daily snapshots of portfolios whose transactions or prices '
+        'changed. Use --loop to run as a background refresher.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Portfolios refreshed per transaction.')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for stale portfolios instead of exiting.')
+        parser.add_argument('--interval', type=float, default=60.0, help='Seconds to sleep when nothing is stale.')
+        parser.add_argument(
+            '--rebuild', action='store_true', help='Recompute every snapshot, e.g. after SNAPSHOT_CURRENCY changed.',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            mark_all_dirty()
+        while True:
+            refreshed = refresh_snapshots(batch_size=options['batch_size'])
+            if refreshed or not options['loop']:
+                stale = Portfolio.objects.filter(snapshot_dirty_from__isnull=False).count()
+                self.stdout.write(f'Refreshed {refreshed} portfolio(s), {stale} still stale')
+            if not options['loop']:
+                break
+            if not refreshed:
+                time.sleep(options['interval'])
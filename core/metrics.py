@@ -0,0 +1,210 @@
+import contextlib
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.template.backends.django import DjangoTemplates
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class ViewStats:
+    __slots__ = (
+        'requests', 'latency_buckets', 'latency_sum',
+        'sampled', 'queries', 'query_seconds', 'template_seconds',
+    )
+
+    def __init__(self):
+        self.requests = 0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.sampled = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+class RequestSample:
+    """
+    SQL and template timings collected for one sampled request.
+    """
+    __slots__ = ('queries', 'query_seconds', 'template_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.template_seconds = 0.0
+
+
+_current_sample = ContextVar('metrics_sample', default=None)
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricsRegistry:
+    """
+    In-process aggregates per resolved URL name. Recording is a dict lookup
+    and a few additions under a lock; nothing is kept per request.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, latency, sample=None):
+        bucket = bisect_left(LATENCY_BUCKETS, latency)
+        with self._lock:
+            stats = self._views.get(view_name)
+            if stats is None:
+                stats = self._views[view_name] = ViewStats()
+            stats.requests += 1
+            stats.latency_buckets[bucket] += 1
+            stats.latency_sum += latency
+            if sample is not None:
+                stats.sampled += 1
+                stats.queries += sample.queries
+                stats.query_seconds += sample.query_seconds
+                stats.template_seconds += sample.template_seconds
+
+    def clear(self):
+        with self._lock:
+            self._views.clear()
+
+    def render(self):
+        """
+        Returns the aggregates in the Prometheus text exposition format.
+        """
+        with self._lock:
+            views = sorted((name, self._copy(stats)) for name, stats in self._views.items())
+
+        lines = [
+            '# HELP django_view_requests_total Requests handled, by view.',
+            '# TYPE django_view_requests_total counter',
+        ]
+        for name, stats in views:
+            lines.append(f'django_view_requests_total{{view="{escape_label(name)}"}} {stats.requests}')
+
+        lines += [
+            '# HELP django_view_latency_seconds Time spent handling requests, by view.',
+            '# TYPE django_view_latency_seconds histogram',
+        ]
+        for name, stats in views:
+            label = escape_label(name)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats.latency_buckets):
+                cumulative += count
+                lines.append(f'django_view_latency_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'django_view_latency_seconds_sum{{view="{label}"}} {stats.latency_sum}')
+            lines.append(f'django_view_latency_seconds_count{{view="{label}"}} {stats.requests}')
+
+        for metric, attribute, help_text in (
+            ('django_view_sampled_requests_total', 'sampled',
+             'Requests whose SQL and template timings were sampled.'),
+            ('django_view_sql_queries_total', 'queries', 'SQL queries issued by sampled requests.'),
+            ('django_view_sql_seconds_total', 'query_seconds', 'Time spent in SQL by sampled requests.'),
+            ('django_view_template_seconds_total', 'template_seconds',
+             'Time spent rendering templates by sampled requests.'),
+        ):
+            lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} counter']
+            for name, stats in views:
+                lines.append(f'{metric}{{view="{escape_label(name)}"}} {getattr(stats, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _copy(stats):
+        copy = ViewStats()
+        for attribute in ViewStats.__slots__:
+            value = getattr(stats, attribute)
+            setattr(copy, attribute, list(value) if isinstance(value, list) else value)
+        return copy
+
+
+registry = MetricsRegistry()
+
+
+def time_query(execute, sql, params, many, context):
+    sample = _current_sample.get()
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if sample is not None:
+            sample.queries += 1
+            sample.query_seconds += time.perf_counter() - start
+
+
+class MetricsMiddleware:
+    """
+    Records latency for every request and, for a METRICS_SAMPLE_RATE share
+    of requests, SQL query count and time and template render time. The
+    aggregates are served by the `core:metrics` view.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        sample = RequestSample() if random.random() < settings.METRICS_SAMPLE_RATE else None
+        token = _current_sample.set(sample)
+        start = time.perf_counter()
+        try:
+            if sample is None:
+                response = self.get_response(request)
+            else:
+                with contextlib.ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(time_query))
+                    response = self.get_response(request)
+        finally:
+            _current_sample.reset(token)
+        latency = time.perf_counter() - start
+
+        match = request.resolver_match
+        view_name = match.view_name if match is not None else '<unresolved>'
+        registry.record(view_name, latency, sample)
+        return response
+
+
+class InstrumentedTemplate:
+    """
+    Wraps a template of the Django backend to time `render()` on sampled requests.
+    """
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        sample = _current_sample.get()
+        if sample is None:
+            return self.template.render(context, request)
+        start = time.perf_counter()
+        try:
+            return self.template.render(context, request)
+        finally:
+            sample.template_seconds += time.perf_counter() - start
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """
+    The Django template backend with render timing for MetricsMiddleware.
+    Only top-level renders are timed, templates pulled in by {% extends %}
+    or {% include %} are part of their parent's time.
+    """
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return InstrumentedTemplate(super().get_template(template_name))
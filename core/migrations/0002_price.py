@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Price',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('close', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='core.instrument')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('instrument', 'date'), name='core_price_instrument_date_uniq')],
+            },
+        ),
+    ]
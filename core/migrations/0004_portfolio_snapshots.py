@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_transaction_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='snapshot_dirty_from',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('market_value', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('cost_basis', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('realized_gain', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('unrealized_gain', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='core.portfolio')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('portfolio', 'date'), name='core_snapshot_portfolio_date_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SnapshotCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('cost_basis', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('realized_gain', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.instrument')),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_checkpoints', to='core.portfolio')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('portfolio', 'instrument'), name='core_checkpoint_portfolio_instr_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_portfolio_snapshots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base', models.CharField(max_length=3)),
+                ('quote', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=10, max_digits=24)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('base', 'quote', 'date'), name='core_fx_pair_date_uniq')],
+            },
+        ),
+    ]
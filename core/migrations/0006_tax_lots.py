@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_exchange_rate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LotCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('fifo', 'First in, first out'), ('lifo', 'Last in, first out'), ('average', 'Average cost')], max_length=7)),
+                ('date', models.DateField(blank=True, null=True)),
+                ('transaction_id', models.BigIntegerField(blank=True, null=True)),
+                ('lots', models.JSONField(default=dict)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lot_checkpoints', to='core.portfolio')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('portfolio', 'method'), name='core_lotcheckpoint_portfolio_method_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RealizedGain',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(choices=[('fifo', 'First in, first out'), ('lifo', 'Last in, first out'), ('average', 'Average cost')], max_length=7)),
+                ('date', models.DateField()),
+                ('quantity', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('proceeds', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('cost_basis', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('gain', models.DecimalField(decimal_places=8, max_digits=24)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.instrument')),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='realized_gains', to='core.portfolio')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='realized_gains', to='core.transaction')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['portfolio', 'method', 'date'], name='core_realized_portfolio_date')],
+                'constraints': [models.UniqueConstraint(fields=('transaction', 'method'), name='core_realized_tx_method_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_tax_lots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CorporateAction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('split', 'Split'), ('dividend', 'Cash dividend')], max_length=8)),
+                ('ex_date', models.DateField()),
+                ('ratio', models.DecimalField(decimal_places=10, default=1, max_digits=24)),
+                ('amount', models.DecimalField(decimal_places=10, default=0, max_digits=24)),
+                ('instrument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='corporate_actions', to='core.instrument')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('instrument', 'kind', 'ex_date'), name='core_action_instr_kind_date_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def rebuild_snapshots(apps, schema_editor):
+    # Snapshots used to add up amounts in every instrument's own currency;
+    # the next refresh rebuilds them in SNAPSHOT_CURRENCY.
+    Portfolio = apps.get_model('core', 'Portfolio')
+    SnapshotCheckpoint = apps.get_model('core', 'SnapshotCheckpoint')
+    Transaction = apps.get_model('core', 'Transaction')
+    SnapshotCheckpoint.objects.all().delete()
+    first = Transaction.objects.filter(portfolio=OuterRef('pk')).order_by('date').values('date')[:1]
+    Portfolio.objects.update(snapshot_dirty_from=Subquery(first))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_corporate_actions'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,275 @@
+from django.conf import settings
 from django.db import models
 
-# Create your models here.
+
+class Instrument(models.Model):
+    """
+    Something that can be held in a portfolio: a stock, fund, bond, ...
+    """
+    symbol = models.CharField(max_length=32, unique=True)
+    name = models.CharField(max_length=200, blank=True)
+    currency = models.CharField(max_length=3, default='USD')
+
+    def __str__(self):
+        return self.symbol
+
+
+class Portfolio(models.Model):
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='portfolios')
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Earliest day whose snapshot is stale, set by `core.snapshots` when
+    # transactions or prices change and cleared by the refresh job.
+    snapshot_dirty_from = models.DateField(null=True, blank=True, editable=False, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name'], name='core_portfolio_owner_name_uniq'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Transaction(models.Model):
+    """
+    A buy or sell of an instrument. Write these through `core.positions`,
+    which keeps the matching Position up to date.
+    """
+    BUY = 'buy'
+    SELL = 'sell'
+    KIND_CHOICES = [
+        (BUY, 'Buy'),
+        (SELL, 'Sell'),
+    ]
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='transactions')
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT, related_name='transactions')
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=24, decimal_places=8)
+    price = models.DecimalField(max_digits=24, decimal_places=8)
+    fees = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    # Hash of the imported CSV row, so that importing a file again is a no-op.
+    fingerprint = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'fingerprint'], name='core_tx_portfolio_fingerprint_uniq'),
+        ]
+        indexes = [
+            # History of one holding in date order, the position engine's
+            # rebuild and per-holding reports read along this index.
+            models.Index(fields=['portfolio', 'instrument', 'date'], name='core_tx_portfolio_instr_date'),
+            models.Index(fields=['portfolio', 'date'], name='core_tx_portfolio_date'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.quantity} {self.instrument} on {self.date}'
+
+
+class Position(models.Model):
+    """
+    Running totals of one instrument in one portfolio, maintained
+    incrementally by `core.positions` as transactions are recorded.
+    The cost basis uses the average cost method.
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='positions')
+    instrument = models.ForeignKey(Instrument, on_delete=models.PROTECT, related_name='positions')
+    quantity = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    cost_basis = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    realized_gain = models.DecimalField(max_digits=24, decimal_places=8, default=0)
+    transaction_count = models.PositiveIntegerField(default=0)
+    # Date of the latest transaction applied. Older transactions change
+    # the order of past sells, so they trigger a rebuild of the position.
+    last_date = models.DateField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'instrument'], name='core_position_portfolio_instr_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} {self.instrument}'
+
+    @property
+    def average_cost(self):
+        return self.cost_basis / self.quantity if self.quantity else None
+
+
+class Price(models.Model):
+    """
+    Closing price of an instrument on a day, in the instrument's currency.
+    """
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='prices')
+    date = models.DateField()
+    close = models.DecimalField(max_digits=24, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instrument', 'date'], name='core_price_instrument_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.instrument} {self.date}: {self.close}'
+
+
+class CorporateAction(models.Model):
+    """
+    A split or cash dividend of an instrument. Stored prices are never
+    rewritten; `core.adjustments` applies actions to prices as they are
+    read. Write these through `core.adjustments.record_actions`.
+    """
+    SPLIT = 'split'
+    DIVIDEND = 'dividend'
+    KIND_CHOICES = [
+        (SPLIT, 'Split'),
+        (DIVIDEND, 'Cash dividend'),
+    ]
+
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='corporate_actions')
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    ex_date = models.DateField()
+    # New shares per old share of a split, e.g. 2 for 2-for-1, 0.1 for a 1-for-10 reverse split.
+    ratio = models.DecimalField(max_digits=24, decimal_places=10, default=1)
+    # Cash per share of a dividend, in the instrument's currency.
+    amount = models.DecimalField(max_digits=24, decimal_places=10, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instrument', 'kind', 'ex_date'], name='core_action_instr_kind_date_uniq'),
+        ]
+
+    def __str__(self):
+        value = self.ratio if self.kind == self.SPLIT else self.amount
+        return f'{self.get_kind_display()} {value} of {self.instrument} on {self.ex_date}'
+
+
+class ExchangeRate(models.Model):
+    """
+    Price of one unit of `base` in `quote` at the end of a day, e.g. EUR in
+    USD. Write these through `core.fx.record_rates`.
+    """
+    base = models.CharField(max_length=3)
+    quote = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=24, decimal_places=10)
+
+    class Meta:
+        constraints = [
+            # Also the index of the per-pair range queries of `core.fx`.
+            models.UniqueConstraint(fields=['base', 'quote', 'date'], name='core_fx_pair_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.base}/{self.quote} {self.date}: {self.rate}'
+
+
+class PortfolioSnapshot(models.Model):
+    """
+    End of day totals of a portfolio, precomputed by `core.snapshots` so
+    that the dashboard reads a range of rows instead of valuing the ledger.
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='snapshots')
+    date = models.DateField()
+    market_value = models.DecimalField(max_digits=24, decimal_places=8)
+    cost_basis = models.DecimalField(max_digits=24, decimal_places=8)
+    realized_gain = models.DecimalField(max_digits=24, decimal_places=8)
+    unrealized_gain = models.DecimalField(max_digits=24, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            # Also the index of the dashboard's range query.
+            models.UniqueConstraint(fields=['portfolio', 'date'], name='core_snapshot_portfolio_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.portfolio} {self.date}: {self.market_value}'
+
+    @property
+    def pnl(self):
+        return self.realized_gain + self.unrealized_gain
+
+
+class SnapshotCheckpoint(models.Model):
+    """
+    Average cost state of one holding at the end of `date`, so that a
+    snapshot refresh can resume there instead of replaying the whole ledger.
+    """
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='snapshot_checkpoints')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=24, decimal_places=8)
+    cost_basis = models.DecimalField(max_digits=24, decimal_places=8)
+    realized_gain = models.DecimalField(max_digits=24, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'instrument'], name='core_checkpoint_portfolio_instr_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} {self.instrument} on {self.date}'
+
+
+class LotCheckpoint(models.Model):
+    """
+    Open tax lots of a portfolio under one matching method after its
+    transactions up to (`date`, `transaction_id`), so that `core.lots`
+    only processes transactions appended since. A null `date` means none
+    were matched yet.
+    """
+    FIFO = 'fifo'
+    LIFO = 'lifo'
+    AVERAGE = 'average'
+    METHOD_CHOICES = [
+        (FIFO, 'First in, first out'),
+        (LIFO, 'Last in, first out'),
+        (AVERAGE, 'Average cost'),
+    ]
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='lot_checkpoints')
+    method = models.CharField(max_length=7, choices=METHOD_CHOICES)
+    date = models.DateField(null=True, blank=True)
+    transaction_id = models.BigIntegerField(null=True, blank=True)
+    # {instrument_id: [[quantity, cost, acquired], ...]}, oldest lot first.
+    lots = models.JSONField(default=dict)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'method'], name='core_lotcheckpoint_portfolio_method_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.portfolio} {self.method} up to {self.date}'
+
+
+class RealizedGain(models.Model):
+    """
+    Gain realized by one sell when matched against tax lots with `method`,
+    written by `core.lots`. Proceeds are net of the sell's fees, the cost
+    basis includes the fees of the lots sold.
+    """
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, related_name='realized_gains')
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='realized_gains')
+    instrument = models.ForeignKey(Instrument, on_delete=models.CASCADE, related_name='+')
+    method = models.CharField(max_length=7, choices=LotCheckpoint.METHOD_CHOICES)
+    date = models.DateField()
+    quantity = models.DecimalField(max_digits=24, decimal_places=8)
+    proceeds = models.DecimalField(max_digits=24, decimal_places=8)
+    cost_basis = models.DecimalField(max_digits=24, decimal_places=8)
+    gain = models.DecimalField(max_digits=24, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['transaction', 'method'], name='core_realized_tx_method_uniq'),
+        ]
+        indexes = [
+            # The yearly report sums along this index.
+            models.Index(fields=['portfolio', 'method', 'date'], name='core_realized_portfolio_date'),
+        ]
+
+    def __str__(self):
+        return f'{self.gain} on {self.quantity} {self.instrument} ({self.method}, {self.date})'
@@ -0,0 +1,102 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .adjustments import actions_recorded
+from .caching import invalidate_now_and_on_commit
+from .fx import rates_recorded
+from .models import Portfolio
+from .positions import transactions_recorded
+from .prices import prices_appended
+
+PORTFOLIO_VERSION_KEY = 'core:portfolio-version:{}'
+PRICES_VERSION_KEY = 'core:prices-version'
+INSTRUMENT_VERSION_KEY = 'core:instrument-version:{}'
+
+
+def get_versions(portfolio_ids):
+    """
+    Returns the version of every portfolio and of prices, timestamps of
+    their last change, in one cache round trip. Anything derived from a
+    portfolio's ledger or from prices is cached under these versions.
+    """
+    keys = {pk: PORTFOLIO_VERSION_KEY.format(pk) for pk in portfolio_ids}
+    versions = cache.get_many([*keys.values(), PRICES_VERSION_KEY])
+    missing = {key: time.time() for key in [*keys.values(), PRICES_VERSION_KEY] if key not in versions}
+    if missing:
+        # Unknown after a cache flush, so assume they changed just now.
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return {pk: versions[key] for pk, key in keys.items()}, versions[PRICES_VERSION_KEY]
+
+
+def get_instrument_versions(symbols):
+    """
+    Returns the version of the prices of every symbol, the timestamp of the
+    last bar or corporate action recorded for it, in one cache round trip.
+    Anything derived from a few instruments' prices is cached under these.
+    """
+    keys = {symbol: INSTRUMENT_VERSION_KEY.format(symbol) for symbol in symbols}
+    versions = cache.get_many(keys.values())
+    missing = {key: time.time() for key in keys.values() if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return {symbol: versions[key] for symbol, key in keys.items()}
+
+
+def combined_version(portfolios):
+    """
+    Digest of the versions of `portfolios`, (pk, name) pairs, and of
+    prices: changes whenever a page showing all of them could.
+    """
+    versions, prices_version = get_versions([pk for pk, _ in portfolios])
+    state = ','.join(f'{pk}:{versions[pk]}' for pk, _ in portfolios)
+    return hashlib.md5(f'{state}|{prices_version}'.encode()).hexdigest()
+
+
+def dashboard_etag(user, version, part):
+    # The navbar shows the username, so it is part of the tag too.
+    digest = hashlib.md5(f'{user.pk}:{user.username}:{version}:{part}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def invalidate_portfolios(portfolio_ids):
+    now = time.time()
+    cache.set_many({PORTFOLIO_VERSION_KEY.format(pk): now for pk in portfolio_ids}, None)
+
+
+def invalidate_prices():
+    cache.set(PRICES_VERSION_KEY, time.time(), None)
+
+
+def invalidate_instruments(symbols):
+    now = time.time()
+    cache.set_many({INSTRUMENT_VERSION_KEY.format(symbol): now for symbol in symbols}, None)
+
+
+@receiver(transactions_recorded)
+def transactions_changed(sender, dates, **kwargs):
+    invalidate_now_and_on_commit(invalidate_portfolios, list(dates))
+
+
+@receiver(prices_appended)
+@receiver(rates_recorded)
+def prices_changed(sender, **kwargs):
+    invalidate_now_and_on_commit(invalidate_prices)
+
+
+@receiver(prices_appended)
+@receiver(actions_recorded)
+def instruments_changed(sender, symbol=None, symbols=(), **kwargs):
+    symbols = [symbol] if symbol is not None else list(symbols)
+    invalidate_now_and_on_commit(invalidate_instruments, symbols)
+
+
+@receiver(post_save, sender=Portfolio)
+@receiver(post_delete, sender=Portfolio)
+def portfolio_changed(sender, instance, **kwargs):
+    invalidate_portfolios([instance.pk])
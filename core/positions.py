@@ -0,0 +1,193 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.dispatch import Signal
+
+from .models import Position, Transaction
+
+QUANTUM = Decimal('1e-8')
+
+# Sent inside the database transaction that stored new transactions, with
+# `dates` mapping each affected portfolio id to its earliest new date.
+transactions_recorded = Signal()
+
+
+class InsufficientQuantity(ValueError):
+    """
+    Raised when a sell exceeds the quantity held at its date.
+    """
+
+
+def apply_transaction(position, kind, quantity, price, fees):
+    """
+    Folds one transaction into the in-memory running totals of `position`.
+    """
+    if kind == Transaction.BUY:
+        position.quantity += quantity
+        position.cost_basis += (quantity * price + fees).quantize(QUANTUM)
+    else:
+        if quantity > position.quantity:
+            raise InsufficientQuantity(
+                f'Cannot sell {quantity} of {position.instrument_id}, only {position.quantity} held.'
+            )
+        if quantity == position.quantity:
+            removed = position.cost_basis
+        else:
+            removed = (position.cost_basis * quantity / position.quantity).quantize(QUANTUM)
+        position.quantity -= quantity
+        position.cost_basis -= removed
+        position.realized_gain += (quantity * price - fees).quantize(QUANTUM) - removed
+    position.transaction_count += 1
+
+
+def reset(position):
+    position.quantity = Decimal(0)
+    position.cost_basis = Decimal(0)
+    position.realized_gain = Decimal(0)
+    position.transaction_count = 0
+    position.last_date = None
+
+
+def replay(position):
+    """
+    Recomputes `position` from its own transactions in (date, pk) order.
+    Only used for out of order inserts, the common case is incremental.
+    """
+    reset(position)
+    history = (
+        Transaction.objects
+        .filter(portfolio_id=position.portfolio_id, instrument_id=position.instrument_id)
+        .order_by('date', 'pk')
+        .values_list('kind', 'quantity', 'price', 'fees', 'date')
+    )
+    for kind, quantity, price, fees, date in history.iterator(chunk_size=10000):
+        apply_transaction(position, kind, quantity, price, fees)
+        position.last_date = date
+
+
+def rebuild_position(portfolio_id, instrument_id):
+    with transaction.atomic():
+        position, _ = Position.objects.select_for_update().get_or_create(
+            portfolio_id=portfolio_id, instrument_id=instrument_id,
+        )
+        replay(position)
+        position.save()
+    return position
+
+
+def is_in_order(position, kind, date):
+    """
+    Tells whether a transaction dated `date` can be folded into the running
+    totals directly. Later dated buys always can. An older buy can too as
+    long as no sell follows it, since buys alone commute.
+    """
+    if position.last_date is None or date >= position.last_date:
+        return True
+    if kind != Transaction.BUY:
+        return False
+    return not Transaction.objects.filter(
+        portfolio_id=position.portfolio_id,
+        instrument_id=position.instrument_id,
+        kind=Transaction.SELL,
+        date__gt=date,
+    ).exists()
+
+
+def record_transaction(portfolio, instrument, kind, date, quantity, price, fees=0):
+    """
+    Stores a transaction and updates the position it belongs to in the same
+    database transaction. The position row is locked, so concurrent writers
+    to one holding are serialized while other holdings are not blocked.
+    """
+    quantity, price, fees = Decimal(quantity), Decimal(price), Decimal(fees)
+    with transaction.atomic():
+        position, _ = Position.objects.select_for_update().get_or_create(
+            portfolio=portfolio, instrument=instrument,
+        )
+        in_order = is_in_order(position, kind, date)
+        tx = Transaction.objects.create(
+            portfolio=portfolio, instrument=instrument, kind=kind,
+            date=date, quantity=quantity, price=price, fees=fees,
+        )
+        if in_order:
+            apply_transaction(position, kind, quantity, price, fees)
+            position.last_date = max(date, position.last_date or date)
+        else:
+            replay(position)
+        position.save()
+        transactions_recorded.send(sender=Transaction, dates={portfolio.pk: date})
+    return tx
+
+
+def record_transactions(transactions, batch_size=10000):
+    """
+    Bulk version of `record_transaction` for imports: stores unsaved
+    Transaction instances with one INSERT per batch and writes every
+    affected position once at the end. Holdings that received a transaction
+    older than their latest one are replayed instead. Returns the number of
+    stored transactions.
+    """
+    positions = {}
+    out_of_order = set()
+    earliest = {}
+    stored = 0
+
+    def flush(batch):
+        keys = {(tx.portfolio_id, tx.instrument_id) for tx in batch} - positions.keys()
+        if keys:
+            load_positions(positions, keys)
+        for tx in batch:
+            key = (tx.portfolio_id, tx.instrument_id)
+            position = positions[key]
+            if key in out_of_order:
+                continue
+            if position.last_date is not None and tx.date < position.last_date:
+                out_of_order.add(key)
+                continue
+            apply_transaction(position, tx.kind, tx.quantity, tx.price, tx.fees)
+            position.last_date = tx.date
+        for tx in batch:
+            if tx.portfolio_id not in earliest or tx.date < earliest[tx.portfolio_id]:
+                earliest[tx.portfolio_id] = tx.date
+        Transaction.objects.bulk_create(batch)
+
+    with transaction.atomic():
+        batch = []
+        for tx in transactions:
+            tx.quantity, tx.price, tx.fees = Decimal(tx.quantity), Decimal(tx.price), Decimal(tx.fees)
+            batch.append(tx)
+            if len(batch) >= batch_size:
+                flush(batch)
+                stored += len(batch)
+                batch = []
+        if batch:
+            flush(batch)
+            stored += len(batch)
+
+        for key in out_of_order:
+            replay(positions[key])
+        Position.objects.bulk_update(
+            positions.values(),
+            ['quantity', 'cost_basis', 'realized_gain', 'transaction_count', 'last_date'],
+            batch_size=1000,
+        )
+        if earliest:
+            transactions_recorded.send(sender=Transaction, dates=earliest)
+    return stored
+
+
+def load_positions(positions, keys):
+    # Creates missing rows first, so that every position can be locked.
+    Position.objects.bulk_create(
+        [Position(portfolio_id=portfolio_id, instrument_id=instrument_id) for portfolio_id, instrument_id in keys],
+        ignore_conflicts=True,
+    )
+    portfolio_ids = {portfolio_id for portfolio_id, _ in keys}
+    instrument_ids = {instrument_id for _, instrument_id in keys}
+    locked = Position.objects.select_for_update().filter(
+        portfolio_id__in=portfolio_ids, instrument_id__in=instrument_ids,
+    )
+    for position in locked:
+        key = (position.portfolio_id, position.instrument_id)
+        if key in keys:
+            positions[key] = position
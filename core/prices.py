@@ -0,0 +1,258 @@
+import datetime
+import fcntl
+import functools
+import os
+import re
+import threading
+from pathlib import Path
+from urllib.parse import quote
+
+import numpy as np
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+from .models import Instrument, Price
+
+# One bar of a price series: UTC epoch seconds, then OHLCV.
+BAR = np.dtype([
+    ('ts', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+])
+
+DAY = 86400
+INTERVAL_RE = re.compile(r'^[1-9][0-9]*[smhd]$')
+EPOCH = datetime.date(1970, 1, 1)
+
+# Sent after daily bars were stored, with the `symbol` and the `date` of
+# the earliest of them.
+prices_appended = Signal()
+
+
+def date_to_ts(date):
+    return (date - EPOCH).days * DAY
+
+
+def ts_to_date(ts):
+    return EPOCH + datetime.timedelta(days=int(ts) // DAY)
+
+
+def forward_fill(matrix):
+    """
+    Replaces NaN cells of a (days, columns) array with the last value above
+    them in the same column. Leading NaNs stay NaN.
+    """
+    last = np.where(np.isnan(matrix), 0, np.arange(matrix.shape[0])[:, None])
+    np.maximum.accumulate(last, axis=0, out=last)
+    return matrix[last, np.arange(matrix.shape[1])]
+
+
+class MemmapPriceStore:
+    """
+    Keeps every series, one per symbol and interval, as a flat file of BAR
+    records under PRICE_STORE_DIR, sorted by timestamp and only ever appended
+    to. Reads memory-map the file, so a range is two binary searches on the
+    timestamp column and a view of the mapping, nothing is copied or parsed.
+    """
+
+    def __init__(self, root=None):
+        self._root = root
+        self._maps = {}
+        self._lock = threading.Lock()
+
+    @property
+    def root(self):
+        return Path(self._root or settings.PRICE_STORE_DIR)
+
+    def path(self, symbol, interval='1d'):
+        if not INTERVAL_RE.match(interval):
+            raise ValueError(f'Invalid interval {interval!r}.')
+        return self.root / f'{quote(symbol, safe="")}.{interval}.bars'
+
+    def series(self, symbol, interval='1d'):
+        """
+        Returns the whole series as a read-only structured array backed by
+        the file. The mapping is reused until the file grows.
+        """
+        path = self.path(symbol, interval)
+        try:
+            count = os.stat(path).st_size // BAR.itemsize
+        except FileNotFoundError:
+            return np.zeros(0, dtype=BAR)
+        with self._lock:
+            mapped = self._maps.get(path)
+            if mapped is None or len(mapped) != count:
+                # A concurrent append may leave a partial record at the end,
+                # it is ignored until the next call.
+                mapped = np.memmap(path, dtype=BAR, mode='r', shape=(count,)) if count else np.zeros(0, dtype=BAR)
+                self._maps[path] = mapped
+        return mapped
+
+    def bars(self, symbol, start, end, interval='1d'):
+        """
+        Returns the bars with start <= ts <= end (epoch seconds) as a view.
+        """
+        series = self.series(symbol, interval)
+        ts = series['ts']
+        return series[np.searchsorted(ts, start, 'left'):np.searchsorted(ts, end, 'right')]
+
+    def latest(self, symbol, interval='1d'):
+        """
+        The last stored bar of a series, or None.
+        """
+        series = self.series(symbol, interval)
+        return series[-1] if len(series) else None
+
+    def append(self, symbol, bars, interval='1d'):
+        """
+        Appends a BAR array to a series. Bars at or before the last stored
+        timestamp are dropped, so re-running an import is harmless. Returns
+        the number of bars written.
+
+        Appenders of a series take turns on an exclusive lock of its file
+        and compare against the last bar in the file, not in a mapping that
+        may be out of date, so concurrent appends keep it sorted.
+        """
+        bars = np.sort(np.asarray(bars, dtype=BAR), order='ts', kind='stable')
+        if len(bars):
+            # Keep the last bar of duplicated timestamps within the batch.
+            keep = np.append(bars['ts'][1:] != bars['ts'][:-1], True)
+            bars = bars[keep]
+        if not len(bars):
+            return 0
+        path = self.path(symbol, interval)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a+b') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            size = os.fstat(file.fileno()).st_size
+            count = size // BAR.itemsize
+            if size != count * BAR.itemsize:
+                # Left by a writer that died within a record.
+                file.truncate(count * BAR.itemsize)
+            if count:
+                file.seek((count - 1) * BAR.itemsize)
+                last = np.frombuffer(file.read(BAR.itemsize), dtype=BAR)['ts'][0]
+                bars = bars[bars['ts'] > last]
+            if not len(bars):
+                return 0
+            file.write(bars.tobytes())
+        if interval == '1d':
+            prices_appended.send(sender=self.__class__, symbol=symbol, date=ts_to_date(bars['ts'][0]))
+        return len(bars)
+
+    def close_matrix(self, instruments, start, days):
+        """
+        Daily closes of `instruments`, (pk, symbol) pairs, for `days` days
+        from `start` as a (days, instruments) array. Days without a bar
+        carry the previous close forward.
+        """
+        matrix = np.full((days, len(instruments)), np.nan)
+        first = date_to_ts(start)
+        for column, (_, symbol) in enumerate(instruments):
+            series = self.series(symbol)
+            ts = series['ts']
+            # The latest bar on or before `start` opens the range.
+            opening = np.searchsorted(ts, first, 'right') - 1
+            stop = np.searchsorted(ts, first + days * DAY, 'left')
+            window = series[max(opening, 0):stop]
+            if not len(window):
+                continue
+            day = np.maximum((window['ts'] - first) // DAY, 0)
+            matrix[day, column] = window['close']
+        return forward_fill(matrix)
+
+
+class DatabasePriceStore:
+    """
+    Daily closes kept in the Price table, for small installations and tests.
+    """
+
+    def bars(self, symbol, start, end, interval='1d'):
+        if interval != '1d':
+            raise ValueError('The database price store only keeps daily closes.')
+        rows = (
+            Price.objects.filter(
+                instrument__symbol=symbol,
+                date__gte=EPOCH + datetime.timedelta(seconds=start),
+                date__lte=EPOCH + datetime.timedelta(seconds=end),
+            )
+            .order_by('date')
+            .values_list('date', 'close')
+        )
+        bars = np.zeros(len(rows), dtype=BAR)
+        for i, (date, close) in enumerate(rows):
+            bars[i] = (date_to_ts(date), close, close, close, close, 0)
+        return bars
+
+    def latest(self, symbol, interval='1d'):
+        if interval != '1d':
+            raise ValueError('The database price store only keeps daily closes.')
+        row = Price.objects.filter(instrument__symbol=symbol).order_by('-date').values_list('date', 'close').first()
+        if row is None:
+            return None
+        date, close = row[0], float(row[1])
+        return np.array((date_to_ts(date), close, close, close, close, 0), dtype=BAR)[()]
+
+    def append(self, symbol, bars, interval='1d'):
+        if interval != '1d':
+            raise ValueError('The database price store only keeps daily closes.')
+        instrument, _ = Instrument.objects.get_or_create(symbol=symbol)
+        closes = {ts_to_date(bar['ts']): float(bar['close']) for bar in np.asarray(bars, dtype=BAR)}
+        # bulk_create() returns the rows ignore_conflicts skipped too, so the
+        # dates already stored are left out first.
+        stored = set(Price.objects.filter(instrument=instrument, date__in=closes).values_list('date', flat=True))
+        created = Price.objects.bulk_create(
+            [
+                Price(instrument=instrument, date=date, close=close)
+                for date, close in closes.items() if date not in stored
+            ],
+            ignore_conflicts=True,
+        )
+        if created:
+            prices_appended.send(sender=self.__class__, symbol=symbol, date=min(price.date for price in created))
+        return len(created)
+
+    def close_matrix(self, instruments, start, days):
+        matrix = np.full((days, len(instruments)), np.nan)
+        if not instruments:
+            return matrix
+        columns = {pk: column for column, (pk, _) in enumerate(instruments)}
+        end = start + datetime.timedelta(days=days - 1)
+
+        latest = Price.objects.filter(instrument=OuterRef('pk'), date__lte=start).order_by('-date')
+        opening = (
+            Instrument.objects.filter(pk__in=columns)
+            .annotate(close=Subquery(latest.values('close')[:1]))
+            .values_list('pk', 'close')
+        )
+        for pk, close in opening:
+            if close is not None:
+                matrix[0, columns[pk]] = close
+
+        rows = list(
+            Price.objects.filter(instrument_id__in=columns, date__gt=start, date__lte=end)
+            .values_list('instrument_id', 'date', 'close')
+        )
+        if rows:
+            instrument, date, close = zip(*rows)
+            day = (np.array(date, dtype='datetime64[D]') - np.datetime64(start, 'D')).astype(np.int64)
+            matrix[day, [columns[pk] for pk in instrument]] = np.array(close, dtype=float)
+        return forward_fill(matrix)
+
+
+@functools.cache
+def load_store(path):
+    return import_string(path)()
+
+
+def get_price_store():
+    """
+    Returns the store named by the PRICE_STORE setting. Valuation and
+    charting read prices through it and nothing else.
+    """
+    return load_store(settings.PRICE_STORE)
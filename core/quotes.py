@@ -0,0 +1,285 @@
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import threading
+import time
+import zlib
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .prices import get_price_store
+
+QUOTE_KEY = 'core:quote:{}'
+
+
+class Quote:
+    __slots__ = ('symbol', 'price', 'timestamp', 'provider')
+
+    def __init__(self, symbol, price, timestamp, provider):
+        self.symbol = symbol
+        self.price = price
+        # UTC epoch seconds of the price, as reported by the provider.
+        self.timestamp = timestamp
+        self.provider = provider
+
+    def __repr__(self):
+        return f'<Quote {self.symbol} {self.price} from {self.provider}>'
+
+
+class CircuitBreaker:
+    """
+    Stops calling a provider after `threshold` consecutive failures. Once
+    `reset_timeout` seconds have passed a call is let through again; if it
+    fails too the breaker opens for another period.
+    """
+    __slots__ = ('threshold', 'reset_timeout', 'failures', 'opened_at', 'last_error')
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.last_error = None
+
+    @property
+    def is_open(self):
+        return self.failures >= self.threshold and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, error):
+        self.failures += 1
+        self.last_error = error
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class QuoteProvider:
+    """
+    Source of quotes. Subclasses implement `fetch`, which is given at most
+    `batch_size` symbols and returns {symbol: Quote} for those it knows.
+    Raising, or taking longer than `timeout` seconds, counts as a failure
+    of the provider. At most `max_concurrency` batches run at once.
+    """
+    batch_size = 100
+    max_concurrency = 4
+    timeout = 5.0
+
+    def __init__(self):
+        self.name = type(self).__name__
+        self.breaker = CircuitBreaker(settings.QUOTE_BREAKER_THRESHOLD, settings.QUOTE_BREAKER_RESET)
+
+    async def fetch(self, symbols):
+        raise NotImplementedError
+
+
+class PriceStoreQuoteProvider(QuoteProvider):
+    """
+    The latest bar of each symbol in the local price store, so that quotes
+    work offline and without an account at a data vendor.
+    """
+    batch_size = 1000
+    max_concurrency = 1
+
+    async def fetch(self, symbols):
+        return await sync_to_async(self.latest)(symbols)
+
+    def latest(self, symbols):
+        store = get_price_store()
+        quotes = {}
+        for symbol in symbols:
+            bar = store.latest(symbol)
+            if bar is not None:
+                quotes[symbol] = Quote(symbol, float(bar['close']), int(bar['ts']), self.name)
+        return quotes
+
+
+class StubQuoteProvider(QuoteProvider):
+    """
+    Made up, stable prices for tests and demos: `prices` if given, else a
+    number derived from the symbol. `delay` simulates network latency and
+    every batch asked for is kept in `calls`.
+    """
+
+    def __init__(self, prices=None, delay=0):
+        super().__init__()
+        self.prices = prices
+        self.delay = delay
+        self.calls = []
+
+    async def fetch(self, symbols):
+        self.calls.append(list(symbols))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        now = int(time.time())
+        if self.prices is not None:
+            return {symbol: Quote(symbol, self.prices[symbol], now, self.name) for symbol in symbols if symbol in self.prices}
+        return {symbol: Quote(symbol, zlib.crc32(symbol.encode()) % 10000 / 100 + 1, now, self.name) for symbol in symbols}
+
+
+class LocalQuotes:
+    """
+    Per-process LRU of (expires, quote) pairs by symbol, the same pairs the
+    shared cache holds. Symbols not asked for in a while are evicted once
+    there are `max_entries` of them.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._quotes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, symbols, now):
+        """
+        Returns {symbol: quote} for the `symbols` with an unexpired entry.
+        """
+        quotes = {}
+        with self._lock:
+            for symbol in symbols:
+                entry = self._quotes.get(symbol)
+                if entry is not None and entry[0] > now:
+                    self._quotes.move_to_end(symbol)
+                    quotes[symbol] = entry[1]
+        return quotes
+
+    def set_many(self, entries):
+        with self._lock:
+            for symbol, entry in entries.items():
+                self._quotes[symbol] = entry
+                self._quotes.move_to_end(symbol)
+            while len(self._quotes) > self.max_entries:
+                self._quotes.popitem(last=False)
+
+    def __len__(self):
+        return len(self._quotes)
+
+
+class QuoteFetcher:
+    """
+    Fetches quotes of many symbols concurrently. A symbol is looked up in
+    this process's copy of the cache, then in the shared cache, then joins
+    a fetch of it already in flight in this process, on any thread and
+    event loop, and only then is requested upstream: in batches per
+    provider, all batches at once, falling back to the next provider for
+    symbols a provider did not return or whose breaker is open.
+    """
+
+    def __init__(self, providers, ttl):
+        self.providers = providers
+        self.ttl = ttl
+        # In front of the shared cache: a read from the cache costs a
+        # thread hop in async code, a read from here does not.
+        self.local = LocalQuotes()
+        # {symbol: future}. Every sync request runs on its own event loop
+        # (async_to_sync), so these are thread-safe futures, not ones bound
+        # to a loop.
+        self.inflight = {}
+        self._inflight_lock = threading.Lock()
+
+    async def fetch(self, symbols):
+        symbols = list(dict.fromkeys(symbols))
+        quotes = {}
+        if self.ttl:
+            now = time.time()
+            quotes = self.local.get_many(symbols, now)
+            keys = {symbol: QUOTE_KEY.format(symbol) for symbol in symbols if symbol not in quotes}
+            if keys:
+                cached = await cache.aget_many(list(keys.values()))
+                found = {symbol: cached[key] for symbol, key in keys.items() if key in cached and cached[key][0] > now}
+                self.local.set_many(found)
+                quotes.update((symbol, entry[1]) for symbol, entry in found.items())
+
+        with self._inflight_lock:
+            unknown = [symbol for symbol in symbols if symbol not in quotes]
+            waiting = {symbol: self.inflight[symbol] for symbol in unknown if symbol in self.inflight}
+            missing = [symbol for symbol in unknown if symbol not in waiting]
+            futures = {symbol: concurrent.futures.Future() for symbol in missing}
+            self.inflight.update(futures)
+        if missing:
+            fetched = {}
+            try:
+                fetched = await self.fetch_upstream(missing)
+                if fetched and self.ttl:
+                    expires = time.time() + self.ttl
+                    entries = {symbol: (expires, quote) for symbol, quote in fetched.items()}
+                    self.local.set_many(entries)
+                    await cache.aset_many(
+                        {QUOTE_KEY.format(symbol): entry for symbol, entry in entries.items()}, self.ttl,
+                    )
+            finally:
+                with self._inflight_lock:
+                    for symbol in missing:
+                        del self.inflight[symbol]
+                for symbol, future in futures.items():
+                    future.set_result(fetched.get(symbol))
+            quotes.update(fetched)
+        for symbol, future in waiting.items():
+            quote = await asyncio.wrap_future(future)
+            if quote is not None:
+                quotes[symbol] = quote
+        return {symbol: quotes[symbol] for symbol in symbols if symbol in quotes}
+
+    async def fetch_upstream(self, symbols):
+        quotes = {}
+        remaining = symbols
+        for provider in self.providers:
+            if not remaining:
+                break
+            semaphore = asyncio.Semaphore(provider.max_concurrency)
+            batches = [remaining[i:i + provider.batch_size] for i in range(0, len(remaining), provider.batch_size)]
+            for result in await asyncio.gather(*(self.call(provider, batch, semaphore) for batch in batches)):
+                quotes.update(result)
+            remaining = [symbol for symbol in remaining if symbol not in quotes]
+        return quotes
+
+    async def call(self, provider, batch, semaphore):
+        async with semaphore:
+            # Checked late, a failing batch may have opened the breaker meanwhile.
+            if provider.breaker.is_open:
+                return {}
+            try:
+                quotes = await asyncio.wait_for(provider.fetch(batch), provider.timeout)
+            except Exception as exc:
+                provider.breaker.record_failure(f'{type(exc).__name__}: {exc}')
+                return {}
+            provider.breaker.record_success()
+            return quotes
+
+
+@functools.cache
+def load_fetcher(paths, ttl):
+    return QuoteFetcher([import_string(path)() for path in paths], ttl)
+
+
+def get_fetcher():
+    """
+    The process-wide fetcher for QUOTE_PROVIDERS, so that breaker state
+    and in-flight requests are shared by all callers.
+    """
+    return load_fetcher(tuple(settings.QUOTE_PROVIDERS), settings.QUOTE_CACHE_TTL)
+
+
+def quote_version():
+    """
+    Changes every QUOTE_CACHE_TTL seconds, as often as a cached quote can.
+    Anything showing quotes is cached under it.
+    """
+    ttl = settings.QUOTE_CACHE_TTL
+    return int(time.time() // ttl) if ttl > 0 else time.time()
+
+
+async def aget_quotes(symbols):
+    """
+    Returns {symbol: Quote} for the `symbols` some provider could quote.
+    """
+    return await get_fetcher().fetch(symbols)
+
+
+def get_quotes(symbols):
+    return async_to_sync(aget_quotes)(symbols)
@@ -0,0 +1,216 @@
+import datetime
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, Sum
+
+from .models import Instrument, Transaction
+from .portfolio_cache import get_versions
+from .prices import get_price_store
+from .valuation import signed
+
+DAYS_PER_YEAR = 365.0
+# On log(1 + rate), about 1e-8 basis points.
+TOLERANCE = 1e-12
+MAX_ITERATIONS = 100
+# Portfolios whose daily series are built and solved together.
+BATCH_SIZE = 500
+# Entries of older versions are left to expire.
+RETURNS_CACHE_TIMEOUT = 24 * 3600
+
+RETURNS_KEY = 'core:returns:{}:{}:{}:{}:{}'
+
+
+class Returns:
+    """
+    Returns of a portfolio over a period. `xirr` is the money-weighted
+    return as an annual rate, `twr` the time-weighted return of the whole
+    period. `holdings` maps instrument ids to (xirr, twr) pairs. NaN where
+    a return is undefined, e.g. for a holding without money at work.
+    """
+    __slots__ = ('xirr', 'twr', 'holdings')
+
+    def __init__(self, xirr, twr, holdings):
+        self.xirr = xirr
+        self.twr = twr
+        self.holdings = holdings
+
+
+def npv(amounts, times, x):
+    """
+    Net present value of every row of `amounts` and its derivative, at the
+    continuously compounded rates `x`, one per row.
+    """
+    discount = np.exp(np.clip(-x[:, None] * times, -700, 700))
+    weighted = amounts * discount
+    return weighted.sum(axis=1), -(weighted * times).sum(axis=1)
+
+
+def xirr(amounts, times, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """
+    Annual internal rates of return of many cash flow series at once.
+    `amounts` is a (series, flows) array, money put in negative and taken
+    out positive; `times` are the flow dates in years, shared by all series
+    or one row per series. Solves for x = log(1 + rate) with Newton steps on
+    every unsolved series together, bisecting whenever a step would leave
+    the bracket, so that each series with a sign change converges. NaN for
+    the others.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    times = np.broadcast_to(np.asarray(times, dtype=float), amounts.shape)
+    count = len(amounts)
+    lo, hi = np.full(count, -1.0), np.full(count, 1.0)
+    f_lo, _ = npv(amounts, times, lo)
+    f_hi, _ = npv(amounts, times, hi)
+    # Widen to +-64, rates beyond e**64 a year are not worth reporting.
+    for _ in range(6):
+        closed = np.sign(f_lo) != np.sign(f_hi)
+        if closed.all():
+            break
+        lo[~closed] *= 2
+        hi[~closed] *= 2
+        f_lo[~closed], _ = npv(amounts[~closed], times[~closed], lo[~closed])
+        f_hi[~closed], _ = npv(amounts[~closed], times[~closed], hi[~closed])
+    solvable = (np.sign(f_lo) != np.sign(f_hi)) & (f_lo != 0) & (f_hi != 0)
+
+    x = np.where(solvable, np.clip(0.1, lo, hi), np.nan)
+    active = np.flatnonzero(solvable)
+    for _ in range(max_iterations):
+        if not len(active):
+            break
+        x_a, lo_a, hi_a, f_lo_a = x[active], lo[active], hi[active], f_lo[active]
+        value, slope = npv(amounts[active], times[active], x_a)
+        below = np.sign(value) == np.sign(f_lo_a)
+        lo_a = np.where(below, x_a, lo_a)
+        f_lo_a = np.where(below, value, f_lo_a)
+        hi_a = np.where(below, hi_a, x_a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            newton = x_a - value / slope
+        inside = np.isfinite(newton) & (newton > lo_a) & (newton < hi_a)
+        step = np.where(inside, newton, (lo_a + hi_a) / 2)
+        x[active], lo[active], hi[active], f_lo[active] = step, lo_a, hi_a, f_lo_a
+        done = (np.abs(step - x_a) < tolerance) | (value == 0) | (hi_a - lo_a < tolerance)
+        active = active[~done]
+    return np.expm1(x)
+
+
+def time_weighted(market_value, inflow, outflow):
+    """
+    Time-weighted returns of (series, day) arrays, whose first day is the
+    opening. Money put in counts from the start of its day and money taken
+    out from its end, so a day's return is (value + out - previous - in) /
+    (previous + in). Days without money at work are skipped; NaN for a
+    series that has none.
+    """
+    previous = market_value[:, :-1] + inflow[:, 1:]
+    gain = market_value[:, 1:] + outflow[:, 1:] - previous
+    invested = previous > 0
+    daily = np.divide(gain, previous, out=np.zeros_like(gain), where=invested)
+    growth = np.prod(1 + daily, axis=1) - 1
+    return np.where(invested.any(axis=1), growth, np.nan)
+
+
+def holding_series(portfolio_ids, start, end):
+    """
+    Daily market value, money put in (buys with fees) and taken out (sells
+    net of fees) of every holding of `portfolio_ids`, as (holding, day)
+    arrays from the day before `start` to `end`. Returns the (portfolio_id,
+    instrument_id) keys and the three arrays.
+    """
+    origin = start - datetime.timedelta(days=1)
+    days = (end - origin).days + 1
+    opening = list(
+        Transaction.objects.filter(portfolio_id__in=portfolio_ids, date__lte=origin)
+        .values('portfolio_id', 'instrument_id')
+        .annotate(net_quantity=Sum(signed(-F('quantity'), F('quantity'))))
+        .values_list('portfolio_id', 'instrument_id', 'net_quantity')
+    )
+    trades = list(
+        Transaction.objects.filter(portfolio_id__in=portfolio_ids, date__gt=origin, date__lte=end)
+        .values('portfolio_id', 'instrument_id', 'date')
+        .annotate(
+            net_quantity=Sum(signed(-F('quantity'), F('quantity'))),
+            bought=Sum(signed(0, F('quantity') * F('price') + F('fees'))),
+            sold=Sum(signed(F('quantity') * F('price') - F('fees'), 0)),
+        )
+        .values_list('portfolio_id', 'instrument_id', 'date', 'net_quantity', 'bought', 'sold')
+    )
+    keys = sorted({record[:2] for record in opening} | {record[:2] for record in trades})
+    rows = {key: row for row, key in enumerate(keys)}
+    instrument_ids = sorted({instrument_id for _, instrument_id in keys})
+    columns = {pk: column for column, pk in enumerate(instrument_ids)}
+    instruments = Instrument.objects.filter(pk__in=instrument_ids).order_by('pk').values_list('pk', 'symbol')
+    prices = np.nan_to_num(get_price_store().close_matrix(list(instruments) if instrument_ids else [], origin, days))
+
+    quantity = np.zeros((len(keys), days))
+    inflow = np.zeros((len(keys), days))
+    outflow = np.zeros((len(keys), days))
+    for portfolio_id, instrument_id, net_quantity in opening:
+        quantity[rows[portfolio_id, instrument_id], 0] += float(net_quantity)
+    for portfolio_id, instrument_id, date, net_quantity, bought, sold in trades:
+        row, day = rows[portfolio_id, instrument_id], (date - origin).days
+        quantity[row, day] += float(net_quantity)
+        inflow[row, day] += float(bought)
+        outflow[row, day] += float(sold)
+    np.cumsum(quantity, axis=1, out=quantity)
+    market_value = quantity * prices.T[[columns[instrument_id] for _, instrument_id in keys]]
+    return keys, market_value, inflow, outflow
+
+
+def solve_returns(market_value, inflow, outflow):
+    """
+    XIRR and TWR of (series, day) arrays whose first day is the opening.
+    """
+    flows = outflow - inflow
+    flows[:, 0] = -market_value[:, 0]
+    flows[:, -1] += market_value[:, -1]
+    # Days without a flow in any series do not change the NPV.
+    used = np.flatnonzero(np.any(flows != 0, axis=0))
+    rates = xirr(flows[:, used], used / DAYS_PER_YEAR)
+    return rates, time_weighted(market_value, inflow, outflow)
+
+
+def compute_returns(portfolio_ids, start, end, batch_size=BATCH_SIZE):
+    """
+    Money and time-weighted returns of `portfolio_ids` and each of their
+    holdings from `start` to `end` inclusive, `batch_size` portfolios per
+    batch of queries and solver runs. Returns {portfolio_id: Returns}.
+    """
+    portfolio_ids = list(portfolio_ids)
+    results = {}
+    for offset in range(0, len(portfolio_ids), batch_size):
+        batch = portfolio_ids[offset:offset + batch_size]
+        keys, market_value, inflow, outflow = holding_series(batch, start, end)
+        # Portfolio series are the sums of their holdings, solved in the same batch.
+        rows = {pk: row for row, pk in enumerate(batch)}
+        owner = np.array([rows[portfolio_id] for portfolio_id, _ in keys], dtype=np.int64)
+        totals = []
+        for series in (market_value, inflow, outflow):
+            total = np.zeros((len(batch), series.shape[1]))
+            np.add.at(total, owner, series)
+            totals.append(np.vstack([total, series]))
+        rates, growth = solve_returns(*totals)
+        holdings = {pk: {} for pk in batch}
+        for row, (portfolio_id, instrument_id) in enumerate(keys, start=len(batch)):
+            holdings[portfolio_id][instrument_id] = (float(rates[row]), float(growth[row]))
+        for pk, row in rows.items():
+            results[pk] = Returns(float(rates[row]), float(growth[row]), holdings[pk])
+    return results
+
+
+def portfolio_returns(portfolio_ids, start, end):
+    """
+    `compute_returns` memoized per (portfolio, period) in the cache. Entries
+    are keyed by the portfolio's version and the prices version, which
+    `core.portfolio_cache` bumps when transactions or prices are written.
+    """
+    versions, prices_version = get_versions(portfolio_ids)
+    keys = {pk: RETURNS_KEY.format(pk, start, end, version, prices_version) for pk, version in versions.items()}
+    cached = cache.get_many(keys.values())
+    results = {pk: cached[key] for pk, key in keys.items() if key in cached}
+    missing = [pk for pk in keys if pk not in results]
+    if missing:
+        computed = compute_returns(missing, start, end)
+        cache.set_many({keys[pk]: returns for pk, returns in computed.items()}, RETURNS_CACHE_TIMEOUT)
+        results.update(computed)
+    return results
@@ -0,0 +1,195 @@
+import datetime
+import hashlib
+from statistics import NormalDist
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .adjustments import adjusted_close_matrix
+from .fx import get_version as get_fx_version, pair_rates
+from .models import Instrument, Position
+from .portfolio_cache import get_instrument_versions
+from .prices import get_price_store
+
+TRADING_DAYS = 252
+# Calendar days of returns looked at.
+RISK_WINDOW = 365
+CONFIDENCE = 0.95
+# Entries of older instrument or rate versions are left to expire.
+COVARIANCE_CACHE_TIMEOUT = 24 * 3600
+
+COVARIANCE_KEY = 'core:covariance:{}:{}:{}'
+
+
+class Risk:
+    """
+    Risk of a portfolio's current holdings over a window of daily returns.
+    `value` is their market value in the requested currency; `volatility`
+    the annualized standard deviation of the portfolio's daily return;
+    `historical_var` and `parametric_var` the one day loss, in that
+    currency, exceeded with probability 1 - confidence; `beta` against the
+    benchmark. `correlation` is the correlation matrix of the holdings, in
+    `symbols` order. NaN where undefined, e.g. beta without a benchmark.
+    """
+    __slots__ = ('value', 'volatility', 'historical_var', 'parametric_var', 'beta', 'symbols', 'correlation')
+
+    def __init__(self, value, volatility, historical_var, parametric_var, beta, symbols, correlation):
+        self.value = value
+        self.volatility = volatility
+        self.historical_var = historical_var
+        self.parametric_var = parametric_var
+        self.beta = beta
+        self.symbols = symbols
+        self.correlation = correlation
+
+
+def daily_returns(closes):
+    """
+    Returns of a (days, instruments) array of closes, one row shorter.
+    Days without a close on both ends count as unchanged.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = closes[1:] / closes[:-1] - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def covariance(returns):
+    """
+    Sample covariance matrix of the columns of a (days, instruments) array.
+    """
+    if len(returns) < 2:
+        return np.full((returns.shape[1], returns.shape[1]), np.nan)
+    centered = returns - returns.mean(axis=0)
+    return centered.T @ centered / (len(returns) - 1)
+
+
+def correlation(cov):
+    deviation = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.outer(deviation, deviation)
+    np.fill_diagonal(corr, 1.0)
+    return corr
+
+
+def instrument_set_key(instruments, start, end):
+    """
+    Cache key of the covariance of `instruments`, (pk, version) pairs in pk
+    order: a new bar or action of one of them changes it, those of other
+    instruments do not.
+    """
+    state = ','.join(f'{pk}:{version}' for pk, version in instruments)
+    return COVARIANCE_KEY.format(hashlib.md5(state.encode()).hexdigest(), start, end)
+
+
+def portfolio_risk(portfolio_ids, end=None, days=RISK_WINDOW, benchmark=None, currency='USD', confidence=CONFIDENCE):
+    """
+    Risk of the current holdings of `portfolio_ids` over the `days` days up
+    to `end`, today by default, in `currency`. Returns {portfolio_id: Risk}.
+
+    Closes of every instrument held are read once, adjusted for splits and
+    dividends and converted into `currency` at each day's rate, into one
+    aligned (day, instrument) array, so returns include currency moves.
+    Portfolios are grouped by the set of instruments they hold; the
+    covariance matrix of a set is computed once and cached per set, window,
+    currency and the versions of the set's instruments and, for foreign
+    ones, of the rates, so portfolios holding the same instruments share
+    it. Days on which no instrument of a set moved, weekends and holidays,
+    are left out of it. Days without a rate count as unchanged.
+    """
+    end = end or timezone.localdate()
+    start = end - datetime.timedelta(days=days)
+    benchmark = settings.RISK_BENCHMARK if benchmark is None else benchmark
+
+    holdings = {pk: {} for pk in portfolio_ids}
+    rows = (
+        Position.objects.filter(portfolio_id__in=portfolio_ids)
+        .exclude(quantity=0)
+        .values_list('portfolio_id', 'instrument_id', 'instrument__symbol', 'instrument__currency', 'quantity')
+    )
+    instruments = {}
+    for portfolio_id, instrument_id, symbol, instrument_currency, quantity in rows:
+        holdings[portfolio_id][instrument_id] = float(quantity)
+        instruments[instrument_id] = (symbol, instrument_currency)
+    benchmark_row = Instrument.objects.filter(symbol=benchmark).values_list('pk', 'currency').first()
+    benchmark_id = None
+    if benchmark_row is not None:
+        benchmark_id = benchmark_row[0]
+        instruments.setdefault(benchmark_id, (benchmark, benchmark_row[1]))
+
+    pairs = sorted((pk, symbol) for pk, (symbol, _) in instruments.items())
+    columns = {pk: column for column, (pk, _) in enumerate(pairs)}
+    closes = adjusted_close_matrix(pairs, start, days + 1)
+    # Weights use the prices the holdings are valued at, not adjusted ones.
+    prices = get_price_store().close_matrix(pairs, end, 1)[0]
+    fx_version = get_fx_version()
+    day_dates = np.datetime64(start, 'D') + np.arange(days + 1)
+    for code in {instrument_currency for _, instrument_currency in instruments.values()} - {currency}:
+        foreign = [columns[pk] for pk, (_, instrument_currency) in instruments.items() if instrument_currency == code]
+        rates = pair_rates(code, currency, day_dates, fx_version)
+        closes[:, foreign] *= rates[:, None]
+        prices[foreign] *= rates[-1]
+    returns = daily_returns(closes)
+    prices = np.nan_to_num(prices)
+
+    groups = {}
+    for pk, held in holdings.items():
+        groups.setdefault(tuple(sorted(held)), []).append(pk)
+    versions = get_instrument_versions([symbol for _, symbol in pairs])
+    keys = {}
+    for ids in groups:
+        if not ids:
+            continue
+        state = [(pk, versions[instruments[pk][0]]) for pk in ids]
+        if any(instruments[pk][1] != currency for pk in ids):
+            state.append((currency, fx_version))
+        keys[ids] = instrument_set_key(state, start, end)
+    cached = cache.get_many(keys.values())
+    computed = {}
+    z = NormalDist().inv_cdf(confidence)
+
+    results = {}
+    for ids, members in groups.items():
+        if not ids:
+            for pk in members:
+                results[pk] = Risk(0.0, np.nan, np.nan, np.nan, np.nan, [], np.zeros((0, 0)))
+            continue
+        set_columns = [columns[pk] for pk in ids]
+        set_returns = returns[:, set_columns]
+        traded = set_returns.any(axis=1)
+        set_returns = set_returns[traded]
+        cov = cached.get(keys[ids])
+        if cov is None:
+            cov = computed[keys[ids]] = covariance(set_returns)
+
+        # (instrument, portfolio) market values in `currency`.
+        values = np.array([[holdings[pk][instrument_id] for pk in members] for instrument_id in ids])
+        values *= prices[set_columns][:, None]
+        total = values.sum(axis=0)
+        weights = np.divide(values, total, out=np.full(values.shape, np.nan), where=total != 0)
+
+        series = set_returns @ weights
+        deviation = np.sqrt(np.einsum('ik,ij,jk->k', weights, cov, weights))
+        if len(series):
+            historical = -np.quantile(series, 1 - confidence, axis=0) * total
+            parametric = (z * deviation - series.mean(axis=0)) * total
+        else:
+            historical = parametric = np.full(len(members), np.nan)
+        beta = np.full(len(members), np.nan)
+        if benchmark_id is not None and len(series) > 1:
+            market = returns[traded, columns[benchmark_id]]
+            market = market - market.mean()
+            if market @ market:
+                beta = (series - series.mean(axis=0)).T @ market / (market @ market)
+
+        symbols = [instruments[instrument_id][0] for instrument_id in ids]
+        corr = correlation(cov)
+        for k, pk in enumerate(members):
+            results[pk] = Risk(
+                float(total[k]), float(deviation[k] * np.sqrt(TRADING_DAYS)), float(historical[k]),
+                float(parametric[k]), float(beta[k]), symbols, corr,
+            )
+    if computed:
+        cache.set_many(computed, COVARIANCE_CACHE_TIMEOUT)
+    return results
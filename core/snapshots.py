@@ -0,0 +1,275 @@
+import datetime
+import functools
+import itertools
+import math
+import operator
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min, OuterRef, Q, Subquery
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .fx import get_version as get_fx_version, pair_rates, rates_recorded
+from .models import Portfolio, PortfolioSnapshot, Position, SnapshotCheckpoint, Transaction
+from .portfolio_cache import invalidate_portfolios
+from .positions import QUANTUM, apply_transaction, transactions_recorded
+from .prices import prices_appended
+from .valuation import value_portfolios
+
+# Checkpoints trail the refreshed day by this many days, so that late
+# prices and backdated trades of the last week resume from a checkpoint
+# instead of replaying the whole ledger.
+CHECKPOINT_LAG = 7
+
+
+class Holding:
+    """
+    Average cost state of one instrument during a replay.
+    """
+    __slots__ = ('instrument_id', 'quantity', 'cost_basis', 'realized_gain', 'transaction_count')
+
+    def __init__(self, instrument_id, quantity=Decimal(0), cost_basis=Decimal(0), realized_gain=Decimal(0)):
+        self.instrument_id = instrument_id
+        self.quantity = quantity
+        self.cost_basis = cost_basis
+        self.realized_gain = realized_gain
+        self.transaction_count = 0
+
+    def copy(self):
+        return Holding(self.instrument_id, self.quantity, self.cost_basis, self.realized_gain)
+
+
+def stale_before(date):
+    return Q(snapshot_dirty_from__isnull=True) | Q(snapshot_dirty_from__gt=date)
+
+
+def mark_dirty(dates):
+    """
+    Marks the snapshots of the portfolios in `dates`, a mapping of portfolio
+    id to date, stale from that date on. A marker only moves back in time
+    until the refresh clears it. One UPDATE per distinct date.
+    """
+    by_date = {}
+    for portfolio_id, date in dates.items():
+        by_date.setdefault(date, []).append(portfolio_id)
+    for date, portfolio_ids in by_date.items():
+        Portfolio.objects.filter(stale_before(date), pk__in=portfolio_ids).update(snapshot_dirty_from=date)
+
+
+def mark_instrument_dirty(symbol, date):
+    """
+    Marks every portfolio that held `symbol` on or after `date`: one that
+    still holds it, or traded it on or after that day.
+    """
+    mark_holders_dirty(Q(instrument__symbol=symbol), date)
+
+
+def mark_holders_dirty(instruments, date):
+    holders = (
+        Position.objects.filter(instruments)
+        .filter(~Q(quantity=0) | Q(last_date__gte=date))
+        .values('portfolio_id')
+    )
+    Portfolio.objects.filter(stale_before(date), pk__in=holders).update(snapshot_dirty_from=date)
+
+
+def mark_all_dirty():
+    """
+    Marks every portfolio stale from its first transaction and drops the
+    checkpoints, so that the next refresh rebuilds all snapshots.
+    """
+    SnapshotCheckpoint.objects.all().delete()
+    first = Transaction.objects.filter(portfolio=OuterRef('pk')).order_by('date').values('date')[:1]
+    Portfolio.objects.update(snapshot_dirty_from=Subquery(first))
+
+
+def roll_forward(today):
+    """
+    Marks every portfolio whose snapshots end before `today` stale from the
+    day after its last one, so that a day without a new price or trade gets
+    its row too. One index probe on (portfolio, date) per portfolio.
+    """
+    last = PortfolioSnapshot.objects.filter(portfolio=OuterRef('pk')).order_by('-date').values('date')[:1]
+    behind = Portfolio.objects.annotate(last=Subquery(last)).filter(last__lt=today).values_list('pk', 'last')
+    mark_dirty({pk: date + datetime.timedelta(days=1) for pk, date in behind})
+
+
+@receiver(transactions_recorded)
+def transactions_changed(sender, dates, **kwargs):
+    mark_dirty(dates)
+
+
+@receiver(prices_appended)
+def prices_changed(sender, symbol, date, **kwargs):
+    mark_instrument_dirty(symbol, date)
+
+
+@receiver(rates_recorded)
+def rates_changed(sender, pairs, date, **kwargs):
+    # Pairs without stored rates are crossed, so any rate of a currency can
+    # change its conversion.
+    currencies = set().union(*pairs) - {settings.SNAPSHOT_CURRENCY}
+    mark_holders_dirty(Q(instrument__currency__in=currencies), date)
+
+
+def in_currency(rows, currency):
+    """
+    Converts the price and fees of ledger `rows`, which end with the
+    instrument's currency, into `currency` at the rate of their day. Rows
+    without a known rate count at zero, as the valuation values them.
+    """
+    version = get_fx_version()
+    rates = {}
+    for *row, price, fees, date, code in rows:
+        if code != currency:
+            rate = rates.get((code, date))
+            if rate is None:
+                rate = float(pair_rates(code, currency, [date], version)[0])
+                rate = rates[code, date] = Decimal(0) if math.isnan(rate) else Decimal(rate)
+            price, fees = price * rate, fees * rate
+        yield *row, price, fees, date
+
+
+def daily_totals(holdings, rows, origin, days, checkpoint_date):
+    """
+    Folds `rows`, (instrument_id, kind, quantity, price, fees, date) in date
+    order, into `holdings`. Returns the total cost basis and realized gain
+    at the end of each of `days` days from `origin`, and a copy of the
+    holdings at the end of `checkpoint_date`.
+    """
+    cost = sum((holding.cost_basis for holding in holdings.values()), Decimal(0))
+    realized = sum((holding.realized_gain for holding in holdings.values()), Decimal(0))
+    cost_series, realized_series = [], []
+    checkpoint = None
+    for instrument_id, kind, quantity, price, fees, date in rows:
+        if checkpoint is None and date > checkpoint_date:
+            checkpoint = {pk: holding.copy() for pk, holding in holdings.items()}
+        day = (date - origin).days
+        while len(cost_series) < day:
+            cost_series.append(cost)
+            realized_series.append(realized)
+        holding = holdings.get(instrument_id)
+        if holding is None:
+            holding = holdings[instrument_id] = Holding(instrument_id)
+        cost -= holding.cost_basis
+        realized -= holding.realized_gain
+        apply_transaction(holding, kind, quantity, price, fees)
+        cost += holding.cost_basis
+        realized += holding.realized_gain
+    while len(cost_series) < days:
+        cost_series.append(cost)
+        realized_series.append(realized)
+    if checkpoint is None:
+        checkpoint = {pk: holding.copy() for pk, holding in holdings.items()}
+    return cost_series, realized_series, checkpoint
+
+
+def refresh_batch(dirty, today):
+    """
+    Rewrites the snapshots of the portfolios in `dirty`, a mapping of
+    portfolio id to its dirty marker, from the marker to `today`.
+    """
+    PortfolioSnapshot.objects.filter(
+        functools.reduce(operator.or_, (Q(portfolio_id=pk, date__gte=date) for pk, date in dirty.items()))
+    ).delete()
+    # Snapshots start with the first transaction.
+    first = dict(
+        Transaction.objects.filter(portfolio_id__in=dirty)
+        .values('portfolio_id').annotate(first=Min('date')).order_by()
+        .values_list('portfolio_id', 'first')
+    )
+    starts = {pk: max(date, first[pk]) for pk, date in dirty.items() if pk in first and first[pk] <= today}
+    SnapshotCheckpoint.objects.filter(portfolio_id__in=dirty.keys() - starts.keys()).delete()
+    if not starts:
+        return
+
+    origin = min(starts.values())
+    days = (today - origin).days + 1
+    currency = settings.SNAPSHOT_CURRENCY
+    valuation = value_portfolios(list(starts), origin, today, currency=currency)
+
+    # A checkpoint before the stale range is still valid, the ledger has
+    # not changed up to it.
+    holdings = {pk: {} for pk in starts}
+    resume = {}
+    for checkpoint in SnapshotCheckpoint.objects.filter(portfolio_id__in=starts):
+        if checkpoint.date < starts[checkpoint.portfolio_id]:
+            resume[checkpoint.portfolio_id] = checkpoint.date
+            holdings[checkpoint.portfolio_id][checkpoint.instrument_id] = Holding(
+                checkpoint.instrument_id, checkpoint.quantity, checkpoint.cost_basis, checkpoint.realized_gain,
+            )
+    rows = (
+        Transaction.objects.filter(
+            functools.reduce(operator.or_, (
+                Q(portfolio_id=pk, date__gt=resume[pk]) if pk in resume else Q(portfolio_id=pk) for pk in starts
+            )),
+            date__lte=today,
+        )
+        .order_by('portfolio_id', 'date', 'pk')
+        .values_list(
+            'portfolio_id', 'instrument_id', 'kind', 'quantity', 'price', 'fees', 'date', 'instrument__currency',
+        )
+        .iterator(chunk_size=10000)
+    )
+    # Both are in pk order, so every ledger is streamed once.
+    ledgers = itertools.groupby(in_currency(rows, currency), operator.itemgetter(0))
+    ledger = next(ledgers, None)
+
+    checkpoint_date = today - datetime.timedelta(days=CHECKPOINT_LAG)
+    snapshots, checkpoints = [], []
+    for pk in sorted(starts):
+        matched = ledger is not None and ledger[0] == pk
+        history = (row[1:] for row in ledger[1]) if matched else ()
+        cost, realized, checkpoint = daily_totals(holdings[pk], history, origin, days, checkpoint_date)
+        if matched:
+            ledger = next(ledgers, None)
+        market_value = valuation.market_value[valuation.row(pk)]
+        for day in range((starts[pk] - origin).days, days):
+            value = Decimal(market_value[day]).quantize(QUANTUM)
+            snapshots.append(PortfolioSnapshot(
+                portfolio_id=pk, date=origin + datetime.timedelta(days=day), market_value=value,
+                cost_basis=cost[day], realized_gain=realized[day], unrealized_gain=value - cost[day],
+            ))
+        if pk not in resume or resume[pk] <= checkpoint_date:
+            checkpoints.extend(
+                SnapshotCheckpoint(
+                    portfolio_id=pk, instrument_id=holding.instrument_id, date=checkpoint_date,
+                    quantity=holding.quantity, cost_basis=holding.cost_basis, realized_gain=holding.realized_gain,
+                )
+                for holding in checkpoint.values()
+            )
+    PortfolioSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    SnapshotCheckpoint.objects.filter(portfolio_id__in={checkpoint.portfolio_id for checkpoint in checkpoints}).delete()
+    SnapshotCheckpoint.objects.bulk_create(checkpoints, batch_size=1000)
+
+
+def refresh_snapshots(today=None, batch_size=100):
+    """
+    Rolls every portfolio forward to `today`, then recomputes the stale
+    snapshots of every marked portfolio, from its marker up to `today`,
+    `batch_size` portfolios per database transaction.
+    Only the ledger after the latest valid checkpoint is replayed. Marked
+    portfolios are locked while they are refreshed, so a concurrent writer
+    marks them again only after the refresh committed. Returns the number
+    of portfolios refreshed.
+    """
+    today = today or timezone.localdate()
+    roll_forward(today)
+    refreshed = 0
+    while True:
+        with transaction.atomic():
+            dirty = dict(
+                Portfolio.objects.select_for_update(skip_locked=True)
+                .filter(snapshot_dirty_from__lte=today)
+                .order_by('pk')
+                .values_list('pk', 'snapshot_dirty_from')[:batch_size]
+            )
+            if not dirty:
+                return refreshed
+            refresh_batch(dirty, today)
+            Portfolio.objects.filter(pk__in=dirty).update(snapshot_dirty_from=None)
+        # Pages built from the snapshots are cached under these versions.
+        invalidate_portfolios(dirty)
+        refreshed += len(dirty)
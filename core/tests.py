@@ -1,3 +1,1600 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import random
+import tempfile
+import threading
+import statistics
+import time
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, router
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import StreamingHttpResponse
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from accounts import urls as accounts_urls
+from accounts.forms import CustomUserCreationForm
+from accounts.models import Profile
+from . import urls as core_urls
+from .adjustments import ADJUSTMENTS_KEY, adjusted_bars, adjusted_close_matrix, get_adjustments, record_actions
+from .dashboard import Dashboard
+from .fx import convert, get_version, pair_rates, rate_cache, record_rates
+from .imports import import_transactions
+from .lots import AVERAGE, FIFO, LIFO, METHODS, Lots, update_lots, yearly_report
+from .metrics import registry
+from .models import (
+    CorporateAction, ExchangeRate, Instrument, LotCheckpoint, Portfolio, PortfolioSnapshot, Position, Price, RealizedGain,
+    SnapshotCheckpoint, Transaction,
+)
+from .prices import BAR, DatabasePriceStore, MemmapPriceStore, date_to_ts, prices_appended
+from .positions import InsufficientQuantity, rebuild_position, record_transaction, record_transactions
+from .quotes import Quote, StubQuoteProvider, aget_quotes, get_fetcher, get_quotes, load_fetcher
+from .returns import compute_returns, portfolio_returns, time_weighted, xirr
+from .risk import TRADING_DAYS, covariance, portfolio_risk
+from .snapshots import refresh_snapshots
+from .valuation import value_portfolios
+from .routers import PIN_COOKIE, replica_reads
+
+User = get_user_model()
+
+
+@override_settings(METRICS_SAMPLE_RATE=1.0)
+class MetricsTests(TestCase):
+    def setUp(self):
+        registry.clear()
+
+    def metrics(self):
+        response = self.client.get(reverse('core:metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode()
+
+    def test_records_requests_latency_sql_and_templates_per_view(self):
+        self.client.get(reverse('core:index'))
+        self.client.get(reverse('accounts:profile', kwargs={'username': 'missing'}))
+        body = self.metrics()
+        self.assertIn('django_view_requests_total{view="core:index"} 1', body)
+        self.assertIn('django_view_latency_seconds_bucket{view="core:index",le="+Inf"} 1', body)
+        self.assertIn('django_view_latency_seconds_count{view="accounts:profile"} 1', body)
+        self.assertIn('django_view_sql_queries_total{view="accounts:profile"} 1', body)
+        self.assertIn('django_view_sql_queries_total{view="core:index"} 0', body)
+        template_line = next(line for line in body.splitlines()
+                             if line.startswith('django_view_template_seconds_total{view="core:index"}'))
+        self.assertGreater(float(template_line.split()[-1]), 0)
+
+    @override_settings(METRICS_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_only_record_latency(self):
+        self.client.get(reverse('accounts:profile', kwargs={'username': 'missing'}))
+        body = self.metrics()
+        self.assertIn('django_view_requests_total{view="accounts:profile"} 1', body)
+        self.assertIn('django_view_sampled_requests_total{view="accounts:profile"} 0', body)
+        self.assertIn('django_view_sql_queries_total{view="accounts:profile"} 0', body)
+
+    def test_unresolved_paths_are_grouped(self):
+        self.client.get('/no/such/page/')
+        self.assertIn('django_view_requests_total{view="<unresolved>"} 1', self.metrics())
+
+    def test_metrics_endpoint_is_not_gated_by_email_verification(self):
+        User.objects.create_user('xena', 'xena@example.com', 'StrongPass123')
+        self.client.login(username='xena', password='StrongPass123')
+        self.metrics()
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_metrics_endpoint_rejects_other_addresses(self):
+        response = self.client.get(reverse('core:metrics'))
+        self.assertEqual(response.status_code, 403)
+
+
+ROUTE_BENCH_MODE = os.getenv('ROUTE_BENCH')  # 'record' or 'compare'
+ROUTE_BENCH_BASELINE = Path(os.getenv('ROUTE_BENCH_BASELINE', settings.BASE_DIR / 'route_bench_baseline.json'))
+ROUTE_BENCH_ITERATIONS = int(os.getenv('ROUTE_BENCH_ITERATIONS', 100))
+ROUTE_BENCH_THRESHOLD = float(os.getenv('ROUTE_BENCH_THRESHOLD', 0.25))
+# Tail latency is noisier, so it gets a wider margin.
+ROUTE_BENCH_P99_THRESHOLD = float(os.getenv('ROUTE_BENCH_P99_THRESHOLD', 1.0))
+# Latency differences below this are noise on sub-millisecond routes.
+ROUTE_BENCH_MIN_DELTA_MS = 1.0
+
+PERSONAS = ('anonymous', 'unconfirmed', 'confirmed')
+
+# Maximum number of queries per (route, persona) for a repeated GET request,
+# i.e. once per-session state such as the cached email confirmation is set.
+QUERY_BUDGETS = {
+    'core:index': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 3},
+    'core:metrics': {'anonymous': 0, 'unconfirmed': 0, 'confirmed': 0},
+    'core:dashboard_widget': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 3},
+    'core:import_transactions': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 3},
+    'core:export_transactions': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 3},
+    'core:export_positions': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:login': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:logout': {'anonymous': 0, 'unconfirmed': 4, 'confirmed': 4},
+    'accounts:register': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:password_change': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:base_currency': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:account_activation_sent': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:resend_activation_email': {'anonymous': 0, 'unconfirmed': 3, 'confirmed': 2},
+    'accounts:activate': {'anonymous': 1, 'unconfirmed': 3, 'confirmed': 3},
+    'accounts:account_activation_complete': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:password_reset': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:password_reset_done': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:password_reset_confirm': {'anonymous': 1, 'unconfirmed': 2, 'confirmed': 3},
+    'accounts:password_reset_complete': {'anonymous': 0, 'unconfirmed': 2, 'confirmed': 2},
+    'accounts:profile': {'anonymous': 1, 'unconfirmed': 2, 'confirmed': 3},
+}
+
+
+def calibrate():
+    """
+    Times a fixed CPU workload, so that a comparison can allow for a
+    machine that is slower or busier than when the baseline was recorded.
+    """
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        sum(i * i for i in range(200000))
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def route_names():
+    names = []
+    for urlconf in (core_urls, accounts_urls):
+        names += [f'{urlconf.app_name}:{pattern.name}' for pattern in urlconf.urlpatterns if pattern.name]
+    return names
+
+
+class RouteBenchmarkTests(TestCase):
+    """
+    Drives every named route of core.urls and accounts.urls with a GET as an
+    anonymous, an unconfirmed and a confirmed user. Query budgets are always
+    checked. With ROUTE_BENCH=record the p50/p99 latencies are written to
+    ROUTE_BENCH_BASELINE; with ROUTE_BENCH=compare they are checked against
+    it and the test fails when one regressed by more than ROUTE_BENCH_THRESHOLD
+    (ROUTE_BENCH_P99_THRESHOLD for p99).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = {
+            'unconfirmed': User.objects.create_user('bench-unconfirmed', 'unconfirmed@example.com', 'StrongPass123'),
+            'confirmed': User.objects.create_user('bench-confirmed', 'confirmed@example.com', 'StrongPass123'),
+        }
+        cls.users['confirmed'].profile.email_confirmed = True
+        cls.users['confirmed'].profile.save()
+        cls.portfolio = Portfolio.objects.create(owner=cls.users['confirmed'], name='Bench')
+
+    def setUp(self):
+        cache.clear()
+
+    def route_url(self, name):
+        # Routes with arguments get ones that render the page without changing
+        # state, e.g. activation and reset links with an invalid token.
+        uidb64 = urlsafe_base64_encode(force_bytes(self.users['unconfirmed'].pk))
+        kwargs = {
+            'accounts:activate': {'uidb64': uidb64, 'token': 'invalid-token'},
+            'accounts:password_reset_confirm': {'uidb64': uidb64, 'token': 'invalid-token'},
+            'accounts:profile': {'username': self.users['confirmed'].username},
+            'core:import_transactions': {'pk': self.portfolio.pk},
+            'core:export_transactions': {'pk': self.portfolio.pk, 'export_format': 'csv'},
+            'core:export_positions': {'export_format': 'csv'},
+            'core:dashboard_widget': {'widget': 'summary'},
+        }.get(name, {})
+        return reverse(name, kwargs=kwargs)
+
+    def request(self, client, persona, url):
+        if persona != 'anonymous':
+            # Outside the measurement, logout would otherwise end the session.
+            client.force_login(self.users[persona])
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            client.get(url)
+            elapsed = time.perf_counter() - start
+        return elapsed * 1000, len(queries)
+
+    def test_every_route_has_a_query_budget(self):
+        self.assertEqual(sorted(QUERY_BUDGETS), sorted(route_names()))
+
+    def test_query_budgets(self):
+        for name in route_names():
+            url = self.route_url(name)
+            for persona in PERSONAS:
+                with self.subTest(route=name, persona=persona):
+                    client = Client()
+                    self.request(client, persona, url)
+                    _, queries = self.request(client, persona, url)
+                    self.assertLessEqual(queries, QUERY_BUDGETS[name][persona])
+
+    @skipUnless(ROUTE_BENCH_MODE in ('record', 'compare'), 'set ROUTE_BENCH=record or ROUTE_BENCH=compare')
+    def test_latency_baseline(self):
+        calibration = calibrate()
+        results = {}
+        for name in route_names():
+            url = self.route_url(name)
+            for persona in PERSONAS:
+                client = Client()
+                self.request(client, persona, url)  # warm up caches
+                timings = sorted(self.request(client, persona, url)[0] for _ in range(ROUTE_BENCH_ITERATIONS))
+                results[f'{name} {persona}'] = {
+                    'p50_ms': round(statistics.median(timings), 3),
+                    'p99_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 3),
+                }
+
+        calibration = statistics.median([calibration, calibrate()])
+
+        if ROUTE_BENCH_MODE == 'record':
+            baseline = {'calibration_ms': round(calibration, 3), 'routes': results}
+            ROUTE_BENCH_BASELINE.write_text(json.dumps(baseline, indent=2, sort_keys=True) + '\n')
+            return
+
+        baseline = json.loads(ROUTE_BENCH_BASELINE.read_text())
+        speed = calibration / baseline['calibration_ms']
+        regressions = []
+        for key, result in results.items():
+            for metric, threshold in (('p50_ms', ROUTE_BENCH_THRESHOLD), ('p99_ms', ROUTE_BENCH_P99_THRESHOLD)):
+                before = baseline['routes'].get(key, {}).get(metric)
+                if before is None:
+                    continue
+                before = round(before * speed, 3)
+                after = result[metric]
+                if after - before > ROUTE_BENCH_MIN_DELTA_MS and after > before * (1 + threshold):
+                    regressions.append(f'{key} {metric}: {before} ms -> {after} ms')
+        self.assertFalse(regressions, 'Latency regressions:\n' + '\n'.join(regressions))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class PrimaryReplicaRouterTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        # Rows written straight to the replica tell which database served a read.
+        replica_user = User(username='on-replica', email='on-replica@example.com')
+        User.objects.using('replica').bulk_create([replica_user])
+        Profile.objects.using('replica').bulk_create([
+            Profile(user_id=replica_user.pk, email_normalized='on-replica@example.com'),
+        ])
+
+    def test_reads_use_primary_by_default(self):
+        self.assertFalse(User.objects.filter(username='on-replica').exists())
+
+    def test_reads_inside_replica_reads_use_replica(self):
+        with replica_reads():
+            self.assertTrue(User.objects.filter(username='on-replica').exists())
+
+    def test_writes_go_to_primary_even_for_replica_instances(self):
+        with replica_reads():
+            user = User.objects.get(username='on-replica')
+        self.assertEqual(user._state.db, 'replica')
+        self.assertEqual(router.db_for_write(User, instance=user), 'default')
+
+    def test_profile_page_reads_from_replica(self):
+        response = self.client.get(reverse('accounts:profile', kwargs={'username': 'on-replica'}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_pin_cookie_sends_reads_to_primary(self):
+        self.client.cookies[PIN_COOKIE] = '1'
+        response = self.client.get(reverse('accounts:profile', kwargs={'username': 'on-replica'}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_write_pins_the_client_to_primary(self):
+        user = User.objects.create_user('yuri', 'yuri@example.com', 'StrongPass123')
+        uid = urlsafe_base64_encode(force_bytes(user.pk))
+        token = default_token_generator.make_token(user)
+        response = self.client.get(reverse('accounts:activate', kwargs={'uidb64': uid, 'token': token}))
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+        # The confirmation just written is read back from the primary.
+        response = self.client.get(reverse('accounts:account_activation_sent'))
+        self.assertRedirects(response, reverse('accounts:profile', kwargs={'username': 'yuri'}),
+                             fetch_redirect_response=False)
+
+    def test_read_only_request_does_not_pin(self):
+        response = self.client.get(reverse('accounts:profile', kwargs={'username': 'on-replica'}))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_registration_email_check_reads_from_replica(self):
+        form = CustomUserCreationForm(data={
+            'username': 'zoe',
+            'email': 'On-Replica@example.com',
+            'password1': 'StrongPass123',
+            'password2': 'StrongPass123',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('email', form.errors)
+
+
+class PositionEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('investor', 'investor@example.com', 'StrongPass123')
+        cls.portfolio = Portfolio.objects.create(owner=owner, name='Main')
+        cls.instrument = Instrument.objects.create(symbol='ACME')
+        cls.other = Instrument.objects.create(symbol='OTHER')
+
+    def record(self, kind, day, quantity, price, fees=0, instrument=None):
+        return record_transaction(
+            self.portfolio, instrument or self.instrument, kind, datetime.date(2024, 1, day), quantity, price, fees,
+        )
+
+    def position(self, instrument=None):
+        return Position.objects.get(portfolio=self.portfolio, instrument=instrument or self.instrument)
+
+    def assertMatchesRebuild(self, position):
+        rebuilt = rebuild_position(position.portfolio_id, position.instrument_id)
+        for field in ('quantity', 'cost_basis', 'realized_gain', 'transaction_count', 'last_date'):
+            self.assertEqual(getattr(position, field), getattr(rebuilt, field), field)
+
+    def test_buys_and_sells_keep_average_cost(self):
+        self.record(Transaction.BUY, 1, 10, 100, fees=5)
+        self.record(Transaction.BUY, 2, 10, 110)
+        self.record(Transaction.SELL, 3, 5, 120, fees=1)
+        position = self.position()
+        self.assertEqual(position.quantity, 15)
+        self.assertEqual(position.cost_basis, Decimal('1578.75'))
+        self.assertEqual(position.realized_gain, Decimal('72.75'))
+        self.assertEqual(position.average_cost, Decimal('105.25'))
+        self.assertMatchesRebuild(position)
+
+    def test_selling_everything_clears_cost_basis(self):
+        self.record(Transaction.BUY, 1, 3, Decimal('33.33'))
+        self.record(Transaction.SELL, 2, 3, 40)
+        position = self.position()
+        self.assertEqual(position.quantity, 0)
+        self.assertEqual(position.cost_basis, 0)
+        self.assertEqual(position.realized_gain, Decimal('20.01'))
+
+    def test_overselling_is_rejected_and_rolled_back(self):
+        self.record(Transaction.BUY, 1, 5, 100)
+        with self.assertRaises(InsufficientQuantity):
+            self.record(Transaction.SELL, 2, 6, 100)
+        self.assertEqual(Transaction.objects.count(), 1)
+        self.assertEqual(self.position().quantity, 5)
+
+    def test_append_cost_does_not_grow_with_history(self):
+        record_transactions([
+            Transaction(portfolio=self.portfolio, instrument=self.instrument, kind=Transaction.BUY,
+                        date=datetime.date(2024, 1, 1), quantity=1, price=100)
+            for _ in range(200)
+        ])
+        # Lock the position, insert the transaction, update the position,
+        # mark the snapshots stale.
+        with self.assertNumQueries(6):
+            self.record(Transaction.SELL, 2, 50, 120)
+        self.assertEqual(self.position().quantity, 150)
+
+    def test_backdated_buy_without_later_sells_is_applied_incrementally(self):
+        self.record(Transaction.BUY, 5, 10, 100)
+        self.record(Transaction.BUY, 2, 10, 90)
+        position = self.position()
+        self.assertEqual(position.last_date, datetime.date(2024, 1, 5))
+        self.assertEqual(position.cost_basis, 1900)
+        self.assertMatchesRebuild(position)
+
+    def test_backdated_transactions_before_a_sell_replay_the_holding(self):
+        self.record(Transaction.BUY, 1, 10, 100)
+        self.record(Transaction.SELL, 5, 10, 150)
+        self.record(Transaction.BUY, 3, 10, 200)
+        position = self.position()
+        self.assertEqual(position.quantity, 10)
+        # The sell now applies to the average of both buys.
+        self.assertEqual(position.cost_basis, 1500)
+        self.assertEqual(position.realized_gain, 0)
+        self.assertMatchesRebuild(position)
+
+        # Valid on its own date, but leaves too little for the later sell.
+        with self.assertRaises(InsufficientQuantity):
+            self.record(Transaction.SELL, 4, 15, 100)
+        self.assertEqual(self.position().quantity, 10)
+
+    def test_bulk_recording_matches_one_by_one(self):
+        rows = [
+            (self.instrument, Transaction.BUY, 1, 10, 100),
+            (self.other, Transaction.BUY, 1, 4, 50),
+            (self.instrument, Transaction.SELL, 3, 4, 120),
+            (self.other, Transaction.BUY, 2, 4, 60),
+            # Out of order for ACME, which is replayed at the end.
+            (self.instrument, Transaction.BUY, 2, 2, 80),
+        ]
+        stored = record_transactions([
+            Transaction(portfolio=self.portfolio, instrument=instrument, kind=kind,
+                        date=datetime.date(2024, 1, day), quantity=quantity, price=price)
+            for instrument, kind, day, quantity, price in rows
+        ], batch_size=2)
+        self.assertEqual(stored, 5)
+        for instrument, quantity in ((self.instrument, 8), (self.other, 8)):
+            position = self.position(instrument)
+            self.assertEqual(position.quantity, quantity)
+            self.assertMatchesRebuild(position)
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+class ValuationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('valuer', 'valuer@example.com', 'StrongPass123')
+        cls.main = Portfolio.objects.create(owner=cls.owner, name='Main')
+        cls.other = Portfolio.objects.create(owner=cls.owner, name='Other')
+        cls.empty = Portfolio.objects.create(owner=cls.owner, name='Empty')
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        Price.objects.bulk_create([
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 1), close=10),
+            # No ACME price on the 3rd, the 2nd carries forward.
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 2), close=11),
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 4), close=12),
+            Price(instrument=cls.bolt, date=datetime.date(2024, 1, 3), close=100),
+        ])
+        for portfolio, instrument, kind, day, quantity, price in (
+            (cls.main, cls.acme, Transaction.BUY, 1, 10, 10),
+            (cls.main, cls.bolt, Transaction.BUY, 3, 1, 100),
+            (cls.main, cls.acme, Transaction.SELL, 4, 5, 12),
+            (cls.other, cls.bolt, Transaction.BUY, 2, 2, 90),
+        ):
+            record_transaction(portfolio, instrument, kind, datetime.date(2024, 1, day), quantity, price)
+
+    def test_values_portfolios_over_a_date_range(self):
+        valuation = value_portfolios(
+            [self.main.pk, self.other.pk, self.empty.pk], datetime.date(2024, 1, 2), datetime.date(2024, 1, 4),
+        )
+        self.assertEqual(valuation.dates.tolist(), [datetime.date(2024, 1, day) for day in (2, 3, 4)])
+        main = valuation.row(self.main.pk)
+        np.testing.assert_allclose(valuation.market_value[main], [110, 210, 160])
+        np.testing.assert_allclose(valuation.cash[main], [-100, -200, -140])
+        np.testing.assert_allclose(valuation.pnl[main], [10, 10, 20])
+        np.testing.assert_allclose(valuation.daily_pnl[main], [10, 0, 10])
+        # BOLT has no price before the 3rd.
+        other = valuation.row(self.other.pk)
+        np.testing.assert_allclose(valuation.market_value[other], [0, 200, 200])
+        np.testing.assert_allclose(valuation.pnl[valuation.row(self.empty.pk)], [0, 0, 0])
+
+    def test_batch_uses_a_fixed_number_of_queries(self):
+        # Trades, opening positions, symbols and two for the price store.
+        with self.assertNumQueries(5):
+            value_portfolios([self.main.pk, self.other.pk], datetime.date(2024, 1, 1), datetime.date(2024, 1, 31))
+
+    def test_chunking_does_not_change_the_result(self):
+        args = ([self.main.pk, self.other.pk, self.empty.pk], datetime.date(2024, 1, 1), datetime.date(2024, 1, 10))
+        whole = value_portfolios(*args)
+        chunked = value_portfolios(*args, max_cells=1)
+        np.testing.assert_allclose(whole.market_value, chunked.market_value)
+        np.testing.assert_allclose(whole.pnl, chunked.pnl)
+
+    def test_index_shows_the_users_portfolios(self):
+        refresh_snapshots()
+        self.owner.profile.email_confirmed = True
+        self.owner.profile.save()
+        self.client.force_login(self.owner)
+        response = self.client.get(reverse('core:index'))
+        self.assertContains(response, 'Your portfolios')
+        summary = response.context['dashboard'].summary
+        self.assertEqual([row['name'] for row in summary['portfolios']], ['Empty', 'Main', 'Other'])
+        self.assertAlmostEqual(summary['total_value'], 360)
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+class SnapshotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('snapper', 'snapper@example.com', 'StrongPass123')
+        cls.main = Portfolio.objects.create(owner=cls.owner, name='Main')
+        cls.other = Portfolio.objects.create(owner=cls.owner, name='Other')
+        cls.empty = Portfolio.objects.create(owner=cls.owner, name='Empty')
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        Price.objects.bulk_create([
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 1), close=10),
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 2), close=11),
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 4), close=12),
+            Price(instrument=cls.bolt, date=datetime.date(2024, 1, 3), close=100),
+        ])
+        for portfolio, instrument, kind, day, quantity, price in (
+            (cls.main, cls.acme, Transaction.BUY, 1, 10, 10),
+            (cls.main, cls.bolt, Transaction.BUY, 3, 1, 100),
+            (cls.main, cls.acme, Transaction.SELL, 4, 5, 12),
+            (cls.other, cls.bolt, Transaction.BUY, 2, 2, 90),
+        ):
+            record_transaction(portfolio, instrument, kind, datetime.date(2024, 1, day), quantity, price)
+
+    def snapshots(self, portfolio):
+        return list(
+            PortfolioSnapshot.objects.filter(portfolio=portfolio).order_by('date')
+            .values_list('date', 'market_value', 'cost_basis', 'realized_gain', 'unrealized_gain')
+        )
+
+    def rebuilt(self, portfolio, today):
+        PortfolioSnapshot.objects.all().delete()
+        SnapshotCheckpoint.objects.all().delete()
+        Portfolio.objects.update(snapshot_dirty_from=datetime.date(2024, 1, 1))
+        refresh_snapshots(today)
+        return self.snapshots(portfolio)
+
+    def test_recording_transactions_marks_the_portfolio(self):
+        self.main.refresh_from_db()
+        self.assertEqual(self.main.snapshot_dirty_from, datetime.date(2024, 1, 1))
+        self.assertEqual(refresh_snapshots(datetime.date(2024, 1, 4)), 2)
+        self.assertFalse(Portfolio.objects.filter(snapshot_dirty_from__isnull=False).exists())
+
+        record_transaction(self.main, self.bolt, Transaction.BUY, datetime.date(2024, 1, 3), 1, 100)
+        record_transactions([
+            Transaction(portfolio=self.other, instrument=self.acme, kind=Transaction.BUY,
+                        date=datetime.date(2024, 1, day), quantity=1, price=10)
+            for day in (4, 2)
+        ])
+        self.assertEqual(
+            dict(Portfolio.objects.filter(snapshot_dirty_from__isnull=False).values_list('pk', 'snapshot_dirty_from')),
+            {self.main.pk: datetime.date(2024, 1, 3), self.other.pk: datetime.date(2024, 1, 2)},
+        )
+
+    def test_appending_prices_marks_the_holders(self):
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        DatabasePriceStore().append('ACME', np.array([(date_to_ts(datetime.date(2024, 1, 5)), 0, 0, 0, 13, 0)], dtype=BAR))
+        self.assertEqual(
+            dict(Portfolio.objects.filter(snapshot_dirty_from__isnull=False).values_list('pk', 'snapshot_dirty_from')),
+            {self.main.pk: datetime.date(2024, 1, 5)},
+        )
+
+    def test_refresh_writes_daily_totals(self):
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        self.assertEqual(self.snapshots(self.main), [
+            (datetime.date(2024, 1, 1), 100, 100, 0, 0),
+            (datetime.date(2024, 1, 2), 110, 100, 0, 10),
+            (datetime.date(2024, 1, 3), 210, 200, 0, 10),
+            (datetime.date(2024, 1, 4), 160, 150, 10, 10),
+        ])
+        # Snapshots start with the first transaction, BOLT has no price before the 3rd.
+        self.assertEqual([row[:2] for row in self.snapshots(self.other)], [
+            (datetime.date(2024, 1, 2), 0), (datetime.date(2024, 1, 3), 200), (datetime.date(2024, 1, 4), 200),
+        ])
+        self.assertEqual(self.snapshots(self.empty), [])
+
+    def test_refresh_only_rewrites_the_stale_range(self):
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        PortfolioSnapshot.objects.filter(portfolio=self.main, date=datetime.date(2024, 1, 1)).update(market_value=-1)
+        Price.objects.create(instrument=self.acme, date=datetime.date(2024, 1, 3), close=20)
+        Portfolio.objects.filter(pk=self.main.pk).update(snapshot_dirty_from=datetime.date(2024, 1, 3))
+        self.assertEqual(refresh_snapshots(datetime.date(2024, 1, 4)), 1)
+        self.assertEqual([row[1] for row in self.snapshots(self.main)], [-1, 110, 300, 160])
+
+    def test_refresh_resumes_from_the_checkpoint(self):
+        refresh_snapshots(datetime.date(2024, 1, 20))
+        self.assertEqual(set(SnapshotCheckpoint.objects.values_list('date', flat=True)), {datetime.date(2024, 1, 13)})
+        # Only the ledger after the checkpoint is replayed, on top of it.
+        SnapshotCheckpoint.objects.filter(portfolio=self.main, instrument=self.acme).update(cost_basis=1050)
+        record_transaction(self.main, self.acme, Transaction.BUY, datetime.date(2024, 1, 19), 1, 12)
+        refresh_snapshots(datetime.date(2024, 1, 20))
+        self.assertEqual([row[2] for row in self.snapshots(self.main)[-3:]], [150, 1162, 1162])
+
+    def test_incremental_refresh_matches_a_full_rebuild(self):
+        refresh_snapshots(datetime.date(2024, 1, 20))
+        record_transaction(self.main, self.acme, Transaction.BUY, datetime.date(2024, 1, 16), 4, 12)
+        record_transaction(self.main, self.acme, Transaction.SELL, datetime.date(2024, 1, 18), 3, 15)
+        refresh_snapshots(datetime.date(2024, 1, 20))
+        # Before the checkpoint, which is replayed from the start.
+        record_transaction(self.main, self.bolt, Transaction.SELL, datetime.date(2024, 1, 5), 1, 110)
+        refresh_snapshots(datetime.date(2024, 1, 20))
+        incremental = self.snapshots(self.main)
+        self.assertEqual(len(incremental), 20)
+        self.assertEqual(incremental, self.rebuilt(self.main, datetime.date(2024, 1, 20)))
+
+    def test_refresh_rolls_forward_without_new_events(self):
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        self.assertEqual(refresh_snapshots(datetime.date(2024, 1, 6)), 2)
+        self.assertEqual(self.snapshots(self.main)[-3:], [
+            (datetime.date(2024, 1, 4), 160, 150, 10, 10),
+            (datetime.date(2024, 1, 5), 160, 150, 10, 10),
+            (datetime.date(2024, 1, 6), 160, 150, 10, 10),
+        ])
+        self.assertEqual(self.snapshots(self.other)[-1][0], datetime.date(2024, 1, 6))
+        self.assertEqual(refresh_snapshots(datetime.date(2024, 1, 6)), 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('refresh_snapshots', stdout=out)
+        self.assertIn('Refreshed 2 portfolio(s), 0 still stale', out.getvalue())
+        self.assertTrue(PortfolioSnapshot.objects.filter(portfolio=self.main).exists())
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+class DashboardTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('dasher', 'dasher@example.com', 'StrongPass123')
+        cls.owner.profile.email_confirmed = True
+        cls.owner.profile.save()
+        cls.main = Portfolio.objects.create(owner=cls.owner, name='Main')
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        Price.objects.bulk_create([
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 1), close=12),
+            Price(instrument=cls.bolt, date=datetime.date(2024, 1, 1), close=40),
+        ])
+        record_transaction(cls.main, cls.acme, Transaction.BUY, datetime.date(2024, 1, 1), 10, 10)
+        record_transaction(cls.main, cls.bolt, Transaction.BUY, datetime.date(2024, 1, 1), 1, 30)
+
+    def setUp(self):
+        cache.clear()
+        # Quotes are also kept by the process-wide fetcher.
+        load_fetcher.cache_clear()
+        self.client.force_login(self.owner)
+
+    def test_widgets(self):
+        response = self.client.get(reverse('core:index'))
+        dashboard = response.context['dashboard']
+        self.assertEqual(
+            [(holding['symbol'], holding['market_value'], holding['unrealized_gain']) for holding in dashboard.holdings],
+            [('ACME', 120, 20), ('BOLT', 40, 10)],
+        )
+        self.assertEqual([(row['symbol'], row['share']) for row in dashboard.allocation], [('ACME', 75), ('BOLT', 25)])
+        self.assertEqual([tx.instrument.symbol for tx in dashboard.transactions], ['BOLT', 'ACME'])
+        self.assertContains(response, 'Recent transactions')
+        self.assertContains(response, reverse('core:dashboard_widget', kwargs={'widget': 'holdings'}))
+
+    def test_widget_endpoint_returns_a_fragment(self):
+        response = self.client.get(reverse('core:dashboard_widget', kwargs={'widget': 'allocation'}))
+        self.assertContains(response, '75.0%')
+        self.assertNotContains(response, '<html')
+        self.assertEqual(self.client.get(reverse('core:dashboard_widget', kwargs={'widget': 'nope'})).status_code, 404)
+
+    def test_fragments_are_cached_until_the_portfolio_changes(self):
+        url = reverse('core:dashboard_widget', kwargs={'widget': 'holdings'})
+        with CaptureQueriesContext(connection) as cold:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as warm:
+            self.client.get(url)
+        self.assertFalse([query for query in warm.captured_queries if 'core_position' in query['sql']])
+        self.assertTrue([query for query in cold.captured_queries if 'core_position' in query['sql']])
+
+        record_transaction(self.main, self.bolt, Transaction.BUY, datetime.date(2024, 1, 2), 1, 30)
+        self.assertContains(self.client.get(url), '80.00')
+
+    def test_quoted_widgets_follow_the_quote_version(self):
+        url = reverse('core:dashboard_widget', kwargs={'widget': 'holdings'})
+        summary_url = reverse('core:dashboard_widget', kwargs={'widget': 'summary'})
+
+        def get(url, version, price):
+            with patch('core.views.quote_version', return_value=version), \
+                    patch('core.dashboard.get_quotes', return_value={'ACME': Quote('ACME', price, 0, 'stub')}):
+                return self.client.get(url)
+
+        self.assertContains(get(url, 1, 20), '200.00')
+        self.assertContains(get(url, 1, 30), '200.00')
+        response = get(url, 2, 30)
+        self.assertContains(response, '300.00')
+        self.assertNotEqual(response.headers['ETag'], get(url, 1, 30).headers['ETag'])
+        self.assertEqual(get(summary_url, 1, 30).headers['ETag'], get(summary_url, 2, 30).headers['ETag'])
+
+    def test_conditional_get(self):
+        url = reverse('core:index')
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+        self.assertEqual(self.client.get(url, headers={'if-none-match': etag}).status_code, 304)
+
+        DatabasePriceStore().append('ACME', np.array([(date_to_ts(datetime.date(2024, 1, 2)), 0, 0, 0, 13, 0)], dtype=BAR))
+        response = self.client.get(url, headers={'if-none-match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        # Widgets have tags of their own.
+        widget = self.client.get(reverse('core:dashboard_widget', kwargs={'widget': 'summary'}))
+        self.assertNotEqual(widget.headers['ETag'], response.headers['ETag'])
+
+
+def random_ledger(portfolio, instruments, count, seed, start=datetime.date(2021, 1, 1)):
+    """
+    Unsaved transactions in date order that never sell more than is held.
+    """
+    rng = random.Random(seed)
+    held = dict.fromkeys(instruments, 0)
+    ledger = []
+    for day in sorted(rng.randrange(3 * 365) for _ in range(count)):
+        instrument = rng.choice(instruments)
+        if held[instrument] and rng.random() < 0.4:
+            kind, quantity = Transaction.SELL, rng.randint(1, held[instrument])
+            held[instrument] -= quantity
+        else:
+            kind, quantity = Transaction.BUY, rng.randint(1, 20)
+            held[instrument] += quantity
+        ledger.append(Transaction(
+            portfolio=portfolio, instrument=instrument, kind=kind, date=start + datetime.timedelta(days=day),
+            quantity=quantity, price=Decimal(rng.randint(1000, 20000)) / 100, fees=Decimal(rng.randint(0, 300)) / 100,
+        ))
+    return ledger
+
+
+def reference_gains(portfolio, method):
+    """
+    Realized gain of every sell with plain lists of [quantity, cost] lots.
+    """
+    lots, gains = {}, {}
+    for tx in portfolio.transactions.order_by('date', 'pk'):
+        open_lots = lots.setdefault(tx.instrument_id, [])
+        if tx.kind == Transaction.BUY:
+            cost = (tx.quantity * tx.price + tx.fees).quantize(Decimal('1e-8'))
+            if method == AVERAGE and open_lots:
+                open_lots[0] = [open_lots[0][0] + tx.quantity, open_lots[0][1] + cost]
+            else:
+                open_lots.append([tx.quantity, cost])
+            continue
+        remaining, cost = tx.quantity, Decimal(0)
+        while remaining:
+            lot = open_lots[-1] if method == LIFO else open_lots[0]
+            if lot[0] <= remaining:
+                remaining -= lot[0]
+                cost += lot[1]
+                open_lots.remove(lot)
+            else:
+                part = (lot[1] * remaining / lot[0]).quantize(Decimal('1e-8'))
+                lot[0] -= remaining
+                lot[1] -= part
+                cost += part
+                remaining = 0
+        gains[tx.pk] = (tx.quantity * tx.price - tx.fees).quantize(Decimal('1e-8')) - cost
+    return gains
+
+
+class TaxLotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('lots', 'lots@example.com', 'StrongPass123')
+        cls.instruments = [Instrument.objects.create(symbol=symbol) for symbol in ('ACME', 'BOLT', 'CORE')]
+
+    def setUp(self):
+        self.portfolio = Portfolio.objects.create(owner=self.owner, name='Taxes')
+
+    def gains(self, method):
+        return dict(
+            RealizedGain.objects.filter(portfolio=self.portfolio, method=method).values_list('transaction_id', 'gain')
+        )
+
+    def test_randomized_ledgers_match_the_reference(self):
+        for seed in range(3):
+            with self.subTest(seed=seed):
+                self.portfolio.transactions.all().delete()
+                Position.objects.filter(portfolio=self.portfolio).delete()
+                record_transactions(random_ledger(self.portfolio, self.instruments, 400, seed))
+                for method in METHODS:
+                    LotCheckpoint.objects.filter(portfolio=self.portfolio).delete()
+                    update_lots(self.portfolio.pk, method)
+                    self.assertEqual(self.gains(method), reference_gains(self.portfolio, method))
+                # Average cost is what the position engine books as well.
+                self.assertEqual(
+                    sum(self.gains(AVERAGE).values()),
+                    sum(position.realized_gain for position in self.portfolio.positions.all()),
+                )
+
+    def test_appends_resume_from_the_checkpoint(self):
+        ledger = random_ledger(self.portfolio, self.instruments, 300, 7)
+        record_transactions(ledger[:200])
+        self.assertEqual(update_lots(self.portfolio.pk, FIFO), 200)
+        record_transactions(ledger[200:])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(update_lots(self.portfolio.pk, FIFO), 100)
+        self.assertFalse([query for query in queries.captured_queries if 'DELETE' in query['sql']])
+        self.assertEqual(self.gains(FIFO), reference_gains(self.portfolio, FIFO))
+        self.assertEqual(update_lots(self.portfolio.pk, FIFO), 0)
+
+    def test_backdated_transaction_rematches_the_ledger(self):
+        record_transactions(random_ledger(self.portfolio, self.instruments, 100, 3))
+        update_lots(self.portfolio.pk, LIFO)
+        record_transaction(self.portfolio, self.instruments[0], Transaction.BUY, datetime.date(2020, 6, 1), 5, 1)
+        self.assertEqual(update_lots(self.portfolio.pk, LIFO), 101)
+        self.assertEqual(self.gains(LIFO), reference_gains(self.portfolio, LIFO))
+
+    def test_fifo_lots_are_compacted(self):
+        lots = Lots()
+        for day in range(200):
+            lots.buy(Decimal(1), Decimal(day), datetime.date(2024, 1, 1), FIFO)
+        self.assertEqual(lots.sell(Decimal('150.5'), FIFO), sum(range(150)) + Decimal('75'))
+        self.assertEqual((len(lots), lots.held), (50, Decimal('49.5')))
+        self.assertLess(len(lots.quantity), 200)
+        self.assertEqual(Lots.load(lots.dump()).sell(Decimal('0.5'), FIFO), Decimal('75'))
+
+    def test_yearly_report(self):
+        acme = self.instruments[0]
+        record_transaction(self.portfolio, acme, Transaction.BUY, datetime.date(2023, 1, 2), 10, 10, fees=1)
+        record_transaction(self.portfolio, acme, Transaction.BUY, datetime.date(2023, 6, 1), 10, 20)
+        record_transaction(self.portfolio, acme, Transaction.SELL, datetime.date(2023, 12, 1), 15, 30, fees=2)
+        record_transaction(self.portfolio, acme, Transaction.SELL, datetime.date(2024, 3, 1), 5, 10)
+        report = yearly_report(self.portfolio.pk, FIFO)
+        self.assertEqual(
+            [(row['year'], row['sales'], row['proceeds'], row['cost_basis'], row['gain']) for row in report],
+            [(2023, 1, 448, 201, 247), (2024, 1, 50, 100, -50)],
+        )
+        # The first lot's fee is split between both sells.
+        self.assertEqual([row['gain'] for row in yearly_report(self.portfolio.pk, LIFO)], [Decimal('197.5'), Decimal('-0.5')])
+
+        out = StringIO()
+        call_command('realized_gains', str(self.portfolio.pk), '--by-instrument', stdout=out)
+        self.assertIn('2023 ACME: 1 sale(s), proceeds 448.00, cost 201.00, gain 247.00', out.getvalue())
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+class ReturnsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('returner', 'returner@example.com', 'StrongPass123')
+        cls.main = Portfolio.objects.create(owner=cls.owner, name='Main')
+        cls.empty = Portfolio.objects.create(owner=cls.owner, name='Empty')
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        Price.objects.bulk_create([
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 1), close=10),
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 2), close=11),
+            Price(instrument=cls.acme, date=datetime.date(2024, 1, 4), close=12),
+            Price(instrument=cls.bolt, date=datetime.date(2024, 1, 3), close=100),
+        ])
+        for instrument, kind, day, quantity, price in (
+            (cls.acme, Transaction.BUY, 1, 10, 10),
+            (cls.bolt, Transaction.BUY, 3, 1, 100),
+            (cls.acme, Transaction.SELL, 4, 5, 12),
+        ):
+            record_transaction(cls.main, instrument, kind, datetime.date(2024, 1, day), quantity, price)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_xirr_solves_a_batch_of_series(self):
+        # The example of the XIRR function in spreadsheets.
+        dates = [datetime.date(2008, 1, 1), datetime.date(2008, 3, 1), datetime.date(2008, 10, 30),
+                 datetime.date(2009, 2, 15), datetime.date(2009, 4, 1)]
+        times = np.array([(date - dates[0]).days for date in dates]) / 365
+        rates = xirr([
+            [-10000, 2750, 4250, 3250, 2750],
+            [-100, 0, 0, 0, 50],
+            # Never paid back, no rate.
+            [-100, -100, 0, 0, 0],
+        ], times)
+        np.testing.assert_allclose(rates[:2], [0.373362535, 0.5 ** (365 / 456) - 1])
+        self.assertTrue(np.isnan(rates[2]))
+        np.testing.assert_allclose(xirr([[-100, 121], [-100, 110]], [[0, 2], [0, 1]]), [0.1, 0.1])
+
+    def test_time_weighted_ignores_the_size_of_flows(self):
+        # +10% then +10%, with money added in between.
+        market_value = np.array([[100, 110, 1221], [0, 0, 0]], dtype=float)
+        inflow = np.array([[0, 0, 1000], [0, 0, 0]], dtype=float)
+        growth = time_weighted(market_value, inflow, np.zeros_like(inflow))
+        np.testing.assert_allclose(growth[0], 0.21)
+        self.assertTrue(np.isnan(growth[1]))
+
+    def test_returns_of_portfolios_and_holdings(self):
+        returns = compute_returns([self.main.pk, self.empty.pk], datetime.date(2024, 1, 1), datetime.date(2024, 1, 4))
+        main = returns[self.main.pk]
+        self.assertAlmostEqual(main.twr, 1.1 * 220 / 210 - 1)
+        self.assertAlmostEqual(main.holdings[self.acme.pk][1], 0.2)
+        self.assertAlmostEqual(main.holdings[self.bolt.pk][1], 0)
+        # Buys on the 1st and 3rd, the sale and the closing value on the 4th.
+        discount = (1 + main.xirr) ** (-np.array([1, 3, 4]) / 365)
+        self.assertAlmostEqual(float(np.dot([-100, -100, 220], discount)), 0, places=6)
+        self.assertTrue(np.isnan(returns[self.empty.pk].xirr))
+        self.assertEqual(returns[self.empty.pk].holdings, {})
+
+    def test_returns_are_memoized_until_the_ledger_or_prices_change(self):
+        period = (datetime.date(2024, 1, 1), datetime.date(2024, 1, 4))
+        first = portfolio_returns([self.main.pk], *period)[self.main.pk]
+        with self.assertNumQueries(0):
+            self.assertEqual(portfolio_returns([self.main.pk], *period)[self.main.pk].twr, first.twr)
+
+        record_transaction(self.main, self.acme, Transaction.BUY, datetime.date(2024, 1, 3), 1, 20)
+        second = portfolio_returns([self.main.pk], *period)[self.main.pk]
+        self.assertNotAlmostEqual(second.twr, first.twr)
+
+        DatabasePriceStore().append('BOLT', np.array([(date_to_ts(datetime.date(2024, 1, 4)), 0, 0, 0, 90, 0)], dtype=BAR))
+        self.assertNotAlmostEqual(portfolio_returns([self.main.pk], *period)[self.main.pk].twr, second.twr)
+
+
+
+class PairStubProvider(StubQuoteProvider):
+    batch_size = 2
+    timeout = 0.5
+
+    def __init__(self):
+        super().__init__(delay=0.01)
+
+
+class PartialStubProvider(StubQuoteProvider):
+    def __init__(self):
+        super().__init__(prices={'ACME': 12.5})
+
+
+class FailingProvider(StubQuoteProvider):
+    async def fetch(self, symbols):
+        self.calls.append(list(symbols))
+        raise ConnectionError('upstream down')
+
+
+class HangingProvider(StubQuoteProvider):
+    timeout = 0.01
+
+    def __init__(self):
+        super().__init__(delay=1)
+
+
+@override_settings(QUOTE_CACHE_TTL=60, QUOTE_BREAKER_THRESHOLD=2, QUOTE_BREAKER_RESET=30)
+class QuoteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        load_fetcher.cache_clear()
+        self.addCleanup(load_fetcher.cache_clear)
+
+    def providers(self):
+        return get_fetcher().providers
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PairStubProvider'])
+    def test_concurrent_requests_fetch_each_symbol_once(self):
+        async def two_users():
+            return await asyncio.gather(aget_quotes(['ACME', 'BOLT', 'CORE']), aget_quotes(['BOLT', 'CORE', 'DYNA']))
+
+        first, second = async_to_sync(two_users)()
+        self.assertEqual(list(first), ['ACME', 'BOLT', 'CORE'])
+        self.assertEqual(list(second), ['BOLT', 'CORE', 'DYNA'])
+        self.assertEqual(first['BOLT'].price, second['BOLT'].price)
+        calls = self.providers()[0].calls
+        self.assertEqual(sorted(sum(calls, [])), ['ACME', 'BOLT', 'CORE', 'DYNA'])
+        self.assertTrue(all(len(batch) <= 2 for batch in calls))
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PairStubProvider'], QUOTE_CACHE_TTL=0)
+    def test_concurrent_sync_requests_share_fetches_in_flight(self):
+        # Every get_quotes() call runs on an event loop of its own.
+        barrier = threading.Barrier(4)
+        results = []
+
+        def load():
+            barrier.wait()
+            results.append(get_quotes(['ACME', 'BOLT']))
+
+        threads = [threading.Thread(target=load) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([sorted(quotes) for quotes in results], [['ACME', 'BOLT']] * 4)
+        self.assertEqual(self.providers()[0].calls, [['ACME', 'BOLT']])
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PairStubProvider'])
+    def test_quotes_are_cached(self):
+        get_quotes(['ACME', 'ACME'])
+        get_quotes(['ACME'])
+        self.assertEqual(self.providers()[0].calls, [['ACME']])
+        with override_settings(QUOTE_CACHE_TTL=0):
+            get_quotes(['ACME'])
+            self.assertEqual(len(get_fetcher().providers[0].calls), 1)
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PairStubProvider'])
+    def test_local_quotes_are_bounded(self):
+        get_fetcher().local.max_entries = 2
+        get_quotes(['ACME', 'BOLT'])
+        get_quotes(['ACME', 'CORE'])
+        self.assertEqual(len(get_fetcher().local), 2)
+        # BOLT was evicted here but is still in the shared cache.
+        get_quotes(['ACME', 'BOLT', 'CORE'])
+        self.assertEqual(sorted(sum(self.providers()[0].calls, [])), ['ACME', 'BOLT', 'CORE'])
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PartialStubProvider', 'core.tests.PairStubProvider'])
+    def test_symbols_fall_back_to_the_next_provider(self):
+        quotes = get_quotes(['ACME', 'BOLT'])
+        self.assertEqual((quotes['ACME'].price, quotes['ACME'].provider), (12.5, 'PartialStubProvider'))
+        self.assertEqual(quotes['BOLT'].provider, 'PairStubProvider')
+        self.assertEqual(self.providers()[1].calls, [['BOLT']])
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.FailingProvider', 'core.tests.PairStubProvider'], QUOTE_CACHE_TTL=0)
+    def test_failing_provider_is_skipped_by_its_breaker(self):
+        failing, fallback = self.providers()
+        for _ in range(3):
+            self.assertEqual(get_quotes(['ACME'])['ACME'].provider, 'PairStubProvider')
+        self.assertEqual(len(failing.calls), 2)
+        self.assertTrue(failing.breaker.is_open)
+        self.assertEqual(failing.breaker.last_error, 'ConnectionError: upstream down')
+
+        # After the reset timeout one call is let through again.
+        failing.breaker.opened_at -= 30
+        get_quotes(['ACME'])
+        self.assertEqual(len(failing.calls), 3)
+        self.assertTrue(failing.breaker.is_open)
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.HangingProvider', 'core.tests.PairStubProvider'])
+    def test_slow_provider_times_out(self):
+        self.assertEqual(get_quotes(['ACME'])['ACME'].provider, 'PairStubProvider')
+        self.assertEqual(self.providers()[0].breaker.failures, 1)
+
+    @override_settings(QUOTE_PROVIDERS=['core.quotes.PriceStoreQuoteProvider'], PRICE_STORE='core.prices.DatabasePriceStore')
+    def test_price_store_provider_quotes_the_latest_close(self):
+        acme = Instrument.objects.create(symbol='ACME')
+        Price.objects.bulk_create([
+            Price(instrument=acme, date=datetime.date(2024, 1, 1), close=10),
+            Price(instrument=acme, date=datetime.date(2024, 1, 2), close=11),
+        ])
+        quotes = get_quotes(['ACME', 'NOPE'])
+        self.assertEqual(list(quotes), ['ACME'])
+        self.assertEqual(quotes['ACME'].price, 11)
+        self.assertEqual(quotes['ACME'].timestamp, date_to_ts(datetime.date(2024, 1, 2)))
+
+    @override_settings(QUOTE_PROVIDERS=['core.tests.PairStubProvider'])
+    def test_command(self):
+        out = StringIO()
+        call_command('fetch_quotes', symbols=['ACME', 'BOLT'], stdout=out)
+        self.assertIn('Fetched 2 of 2 quote(s)', out.getvalue())
+        self.assertIsNotNone(cache.get('core:quote:ACME'))
+
+
+class ExchangeRateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        ExchangeRate.objects.bulk_create([
+            ExchangeRate(base='EUR', quote='USD', date=datetime.date(2023, 12, 29), rate=Decimal('1.10')),
+            ExchangeRate(base='EUR', quote='USD', date=datetime.date(2024, 1, 3), rate=Decimal('1.20')),
+            ExchangeRate(base='USD', quote='PLN', date=datetime.date(2024, 1, 2), rate=Decimal('4.00')),
+        ])
+
+    def setUp(self):
+        cache.clear()
+        rate_cache.clear()
+
+    def days(self, *days):
+        return np.array([datetime.date(2024, 1, day) for day in days], dtype='datetime64[D]')
+
+    def test_rates_are_carried_forward_inverted_and_crossed(self):
+        np.testing.assert_allclose(pair_rates('EUR', 'USD', self.days(1, 2, 3, 31)), [1.1, 1.1, 1.2, 1.2])
+        np.testing.assert_allclose(pair_rates('USD', 'EUR', self.days(3)), [1 / 1.2])
+        np.testing.assert_allclose(pair_rates('EUR', 'PLN', self.days(1, 2, 3)), [np.nan, 4.4, 4.8])
+        self.assertTrue(np.isnan(pair_rates('GBP', 'USD', self.days(3))).all())
+
+    def test_convert_costs_no_queries_once_slices_are_cached(self):
+        dates = np.repeat(self.days(2, 3), 500)
+        currencies = np.array(['EUR', 'USD', 'PLN', 'EUR'] * 250)
+        convert(np.ones(1000), currencies, dates, 'USD')
+        with self.assertNumQueries(0):
+            converted = convert(np.full(1000, 8.0), currencies, dates, 'USD')
+        np.testing.assert_allclose(converted[[0, 1, 2, 500]], [8.8, 8, 2, 9.6])
+
+    def test_recording_rates_invalidates_cached_slices(self):
+        version = get_version()
+        pair_rates('EUR', 'USD', self.days(5))
+        record_rates([ExchangeRate(base='EUR', quote='USD', date=datetime.date(2024, 1, 5), rate=Decimal('1.30'))])
+        self.assertNotEqual(get_version(), version)
+        np.testing.assert_allclose(pair_rates('EUR', 'USD', self.days(4, 5)), [1.2, 1.3])
+        record_rates([ExchangeRate(base='EUR', quote='USD', date=datetime.date(2024, 1, 5), rate=Decimal('1.25'))])
+        np.testing.assert_allclose(pair_rates('EUR', 'USD', self.days(5)), [1.25])
+
+    def test_dashboard_shows_holdings_in_the_base_currency(self):
+        owner = User.objects.create_user('fx', 'fx@example.com', 'StrongPass123')
+        owner.profile.email_confirmed = True
+        owner.profile.base_currency = 'PLN'
+        owner.profile.save()
+        portfolio = Portfolio.objects.create(owner=owner, name='Euro')
+        sap = Instrument.objects.create(symbol='SAP', currency='EUR')
+        Price.objects.create(instrument=sap, date=datetime.date(2024, 1, 3), close=100)
+        record_transaction(portfolio, sap, Transaction.BUY, datetime.date(2024, 1, 3), 2, 90)
+        self.client.force_login(owner)
+        load_fetcher.cache_clear()
+        with override_settings(PRICE_STORE='core.prices.DatabasePriceStore'):
+            response = self.client.get(reverse('core:dashboard_widget', kwargs={'widget': 'holdings'}))
+        holding = response.context['dashboard'].holdings[0]
+        self.assertEqual((holding['market_value'], round(holding['value'], 6)), (200, 960))
+        self.assertContains(response, 'Value (PLN)')
+
+    @override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+    def test_snapshots_are_kept_in_the_snapshot_currency(self):
+        owner = User.objects.create_user('fx', 'fx@example.com', 'StrongPass123')
+        portfolio = Portfolio.objects.create(owner=owner, name='Mixed')
+        sap = Instrument.objects.create(symbol='SAP', currency='EUR')
+        acme = Instrument.objects.create(symbol='ACME')
+        Price.objects.create(instrument=sap, date=datetime.date(2024, 1, 3), close=100)
+        Price.objects.create(instrument=acme, date=datetime.date(2024, 1, 3), close=10)
+        record_transaction(portfolio, sap, Transaction.BUY, datetime.date(2024, 1, 3), 2, 90)
+        record_transaction(portfolio, acme, Transaction.BUY, datetime.date(2024, 1, 3), 5, 10)
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        snapshots = PortfolioSnapshot.objects.filter(portfolio=portfolio).order_by('date')
+        self.assertEqual(
+            [(snapshot.market_value, snapshot.cost_basis, snapshot.unrealized_gain) for snapshot in snapshots],
+            [(290, 266, 24), (290, 266, 24)],
+        )
+
+        # A new rate revalues the holdings in euros from its day on.
+        record_rates([ExchangeRate(base='EUR', quote='USD', date=datetime.date(2024, 1, 4), rate=Decimal('1.30'))])
+        portfolio.refresh_from_db()
+        self.assertEqual(portfolio.snapshot_dirty_from, datetime.date(2024, 1, 4))
+        refresh_snapshots(datetime.date(2024, 1, 4))
+        snapshots = PortfolioSnapshot.objects.filter(portfolio=portfolio).order_by('date')
+        self.assertEqual([(snapshot.market_value, snapshot.cost_basis) for snapshot in snapshots], [(290, 266), (310, 266)])
+
+        dashboard = Dashboard([(portfolio.pk, portfolio.name)], 'PLN')
+        dashboard.today = datetime.date(2024, 1, 4)
+        summary = dashboard.summary
+        self.assertAlmostEqual(summary['total_value'], 310 * 4)
+        self.assertAlmostEqual(summary['portfolios'][0]['cost_basis'], 266 * 4)
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore')
+class AdjustmentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        Price.objects.bulk_create([
+            Price(instrument=instrument, date=datetime.date(2024, 1, day), close=close)
+            for instrument in (cls.acme, cls.bolt)
+            for day, close in ((1, 100), (2, 100), (3, 52), (4, 50), (5, 51))
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def ts(self, day):
+        return date_to_ts(datetime.date(2024, 1, day))
+
+    def test_splits_and_dividends_adjust_earlier_prices(self):
+        record_actions([
+            CorporateAction(instrument=self.acme, kind=CorporateAction.SPLIT, ex_date=datetime.date(2024, 1, 3), ratio=2),
+            CorporateAction(instrument=self.acme, kind=CorporateAction.DIVIDEND, ex_date=datetime.date(2024, 1, 5),
+                            amount=Decimal('2.5')),
+        ])
+        bars = adjusted_bars('ACME', self.ts(1), self.ts(5))
+        dividend = 1 - 2.5 / 50
+        np.testing.assert_allclose(bars['close'], [50 * dividend, 50 * dividend, 52 * dividend, 50 * dividend, 51])
+        self.assertEqual(bars['volume'].tolist(), [0] * 5)
+        self.assertEqual(list(Price.objects.filter(instrument=self.acme).values_list('close', flat=True)),
+                         [100, 100, 52, 50, 51])
+        matrix = adjusted_close_matrix([(self.acme.pk, 'ACME'), (self.bolt.pk, 'BOLT')], datetime.date(2024, 1, 1), 5)
+        np.testing.assert_allclose(matrix[:, 0], bars['close'])
+        np.testing.assert_allclose(matrix[:, 1], [100, 100, 52, 50, 51])
+
+    def test_factors_are_cached_per_instrument(self):
+        get_adjustments(['ACME', 'BOLT'])
+        with self.assertNumQueries(1):
+            adjusted_bars('ACME', self.ts(1), self.ts(5))
+        record_actions([
+            CorporateAction(instrument=self.bolt, kind=CorporateAction.SPLIT, ex_date=datetime.date(2024, 1, 3), ratio=2),
+        ])
+        self.assertIsNotNone(cache.get(ADJUSTMENTS_KEY.format('ACME')))
+        self.assertIsNone(cache.get(ADJUSTMENTS_KEY.format('BOLT')))
+        self.assertEqual(adjusted_bars('BOLT', self.ts(1), self.ts(1))['close'].tolist(), [50])
+
+        # A close before the latest ex date changes dividend factors.
+        get_adjustments(['BOLT'])
+        DatabasePriceStore().append('BOLT', np.array([(self.ts(6), 0, 0, 0, 55, 0)], dtype=BAR))
+        self.assertIsNotNone(cache.get(ADJUSTMENTS_KEY.format('BOLT')))
+        Price.objects.filter(instrument=self.bolt, date=datetime.date(2024, 1, 2)).delete()
+        DatabasePriceStore().append('BOLT', np.array([(self.ts(2), 0, 0, 0, 90, 0)], dtype=BAR))
+        self.assertIsNone(cache.get(ADJUSTMENTS_KEY.format('BOLT')))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('add_corporate_action', 'ACME', '2024-01-03', '--split', '2', stdout=out)
+        self.assertIn('Recorded Split 2 of ACME on 2024-01-03.', out.getvalue())
+        self.assertEqual(adjusted_bars('ACME', self.ts(2), self.ts(2))['close'].tolist(), [50])
+        with self.assertRaisesMessage(CommandError, 'already recorded'):
+            call_command('add_corporate_action', 'ACME', '2024-01-03', '--split', '2')
+
+
+@override_settings(PRICE_STORE='core.prices.DatabasePriceStore', RISK_BENCHMARK='SPY')
+class RiskTests(TestCase):
+    end = datetime.date(2024, 3, 1)
+    days = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        owner = User.objects.create_user('risky', 'risky@example.com')
+        cls.acme = Instrument.objects.create(symbol='ACME')
+        cls.bolt = Instrument.objects.create(symbol='BOLT')
+        cls.spy = Instrument.objects.create(symbol='SPY')
+        rng = np.random.default_rng(25)
+        market = rng.normal(0, 0.01, cls.days + 1)
+        cls.closes = {
+            cls.acme: 50 * np.exp((1.5 * market + rng.normal(0, 0.005, cls.days + 1)).cumsum()),
+            cls.bolt: 20 * np.exp(rng.normal(0, 0.02, cls.days + 1).cumsum()),
+            cls.spy: 400 * np.exp(market.cumsum()),
+        }
+        first = cls.end - datetime.timedelta(days=cls.days)
+        Price.objects.bulk_create([
+            Price(instrument=instrument, date=first + datetime.timedelta(days=day), close=Decimal(f'{close:.4f}'))
+            for instrument, closes in cls.closes.items()
+            for day, close in enumerate(closes)
+        ])
+        cls.main = Portfolio.objects.create(owner=owner, name='Main')
+        cls.twin = Portfolio.objects.create(owner=owner, name='Twin')
+        cls.solo = Portfolio.objects.create(owner=owner, name='Solo')
+        cls.empty = Portfolio.objects.create(owner=owner, name='Empty')
+        for portfolio, acme, bolt in ((cls.main, 10, 5), (cls.twin, 20, 10), (cls.solo, 3, 0)):
+            record_transaction(portfolio, cls.acme, Transaction.BUY, first, acme, 1)
+            if bolt:
+                record_transaction(portfolio, cls.bolt, Transaction.BUY, first, bolt, 1)
+
+    def setUp(self):
+        cache.clear()
+
+    def returns(self, instrument):
+        closes = np.array(Price.objects.filter(instrument=instrument).order_by('date').values_list('close', flat=True),
+                          dtype=float)
+        return closes[1:] / closes[:-1] - 1, closes[-1]
+
+    def risk(self):
+        return portfolio_risk([self.main.pk, self.twin.pk, self.solo.pk, self.empty.pk], self.end, self.days)
+
+    def test_matches_reference(self):
+        (acme, acme_close), (bolt, bolt_close) = self.returns(self.acme), self.returns(self.bolt)
+        market, _ = self.returns(self.spy)
+        values = np.array([10 * acme_close, 5 * bolt_close])
+        series = np.column_stack([acme, bolt]) @ (values / values.sum())
+
+        risk = self.risk()
+        main = risk[self.main.pk]
+        self.assertAlmostEqual(main.value, values.sum())
+        self.assertAlmostEqual(main.volatility, series.std(ddof=1) * np.sqrt(TRADING_DAYS))
+        self.assertAlmostEqual(main.historical_var, -np.quantile(series, 0.05) * values.sum())
+        self.assertAlmostEqual(
+            main.parametric_var, (1.6448536269514722 * series.std(ddof=1) - series.mean()) * values.sum(), places=6,
+        )
+        self.assertAlmostEqual(main.beta, np.polyfit(market, series, 1)[0])
+        self.assertEqual(main.symbols, ['ACME', 'BOLT'])
+        np.testing.assert_allclose(main.correlation, np.corrcoef(acme, bolt))
+
+        # Same weights, twice the value.
+        twin = risk[self.twin.pk]
+        self.assertAlmostEqual(twin.volatility, main.volatility)
+        self.assertAlmostEqual(twin.historical_var, 2 * main.historical_var)
+        self.assertAlmostEqual(risk[self.solo.pk].volatility, acme.std(ddof=1) * np.sqrt(TRADING_DAYS))
+        self.assertAlmostEqual(risk[self.solo.pk].beta, np.polyfit(market, acme, 1)[0])
+        self.assertEqual(risk[self.empty.pk].value, 0)
+        self.assertTrue(np.isnan(risk[self.empty.pk].volatility))
+
+    def test_covariance_is_shared_and_cached(self):
+        with patch('core.risk.covariance', wraps=covariance) as computed:
+            self.risk()
+            # Once for {ACME, BOLT}, held by two portfolios, once for {ACME}.
+            self.assertEqual(computed.call_count, 2)
+            before = self.risk()[self.main.pk].volatility
+            self.assertEqual(computed.call_count, 2)
+            portfolio_risk([self.main.pk], self.end, self.days - 1)
+            self.assertEqual(computed.call_count, 3)
+
+            # Adjusted returns change with corporate actions.
+            record_actions([CorporateAction(instrument=self.bolt, kind=CorporateAction.DIVIDEND,
+                                            ex_date=self.end - datetime.timedelta(days=5), amount=1)])
+            after = self.risk()[self.main.pk].volatility
+            # Only the set holding BOLT is computed again.
+            self.assertEqual(computed.call_count, 4)
+        self.assertNotAlmostEqual(before, after)
+
+    def test_returns_include_currency_moves(self):
+        euro = Instrument.objects.create(symbol='EURO', currency='EUR')
+        first = self.end - datetime.timedelta(days=self.days)
+        rates = 1.1 * np.exp(np.random.default_rng(26).normal(0, 0.005, self.days + 1).cumsum())
+        Price.objects.bulk_create([
+            Price(instrument=euro, date=first + datetime.timedelta(days=day), close=10) for day in range(self.days + 1)
+        ])
+        record_rates([
+            ExchangeRate(base='EUR', quote='USD', date=first + datetime.timedelta(days=day), rate=Decimal(f'{rate:.6f}'))
+            for day, rate in enumerate(rates)
+        ])
+        record_transaction(self.empty, euro, Transaction.BUY, first, 100, 10)
+        rates = np.array(ExchangeRate.objects.order_by('date').values_list('rate', flat=True), dtype=float)
+        changes = rates[1:] / rates[:-1] - 1
+
+        risk = portfolio_risk([self.empty.pk], self.end, self.days)[self.empty.pk]
+        self.assertAlmostEqual(risk.value, 1000 * rates[-1])
+        self.assertAlmostEqual(risk.volatility, changes.std(ddof=1) * np.sqrt(TRADING_DAYS))
+        # In its own currency the instrument never moved.
+        risk = portfolio_risk([self.empty.pk], self.end, self.days, currency='EUR')[self.empty.pk]
+        self.assertEqual(risk.value, 1000)
+        self.assertTrue(np.isnan(risk.volatility))
+
+
+class PriceStoreTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = Path(directory.name)
+        self.store = MemmapPriceStore(self.root)
+
+    def bars(self, *days_and_closes):
+        bars = np.zeros(len(days_and_closes), dtype=BAR)
+        for i, (day, close) in enumerate(days_and_closes):
+            bars[i] = (date_to_ts(datetime.date(2024, 1, day)), close, close, close, close, 1000)
+        return bars
+
+    def test_append_sorts_and_skips_stored_bars(self):
+        self.assertEqual(self.store.append('ACME', self.bars((3, 12), (1, 10), (2, 11))), 3)
+        self.assertEqual(self.store.append('ACME', self.bars((2, 99), (4, 13), (4, 14))), 1)
+        series = self.store.series('ACME')
+        self.assertEqual(series['close'].tolist(), [10, 11, 12, 14])
+        self.assertEqual((self.root / 'ACME.1d.bars').stat().st_size, 4 * BAR.itemsize)
+
+    def test_concurrent_appends_keep_the_series_sorted(self):
+        self.store.append('ACME', self.bars((1, 10)))
+        # Mapped now, so every appender below starts from a stale mapping.
+        self.store.series('ACME')
+        batches = [self.bars(*((day, day) for day in range(first, 29, 3))) for first in (2, 3, 4)]
+        errors = []
+
+        def append(batch):
+            try:
+                MemmapPriceStore(self.root).append('ACME', batch)
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=append, args=(batch,)) for batch in batches]
+        # The receivers would query the test database from other threads.
+        with patch.object(prices_appended, 'receivers', []):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        ts = self.store.series('ACME')['ts']
+        self.assertTrue((np.diff(ts) > 0).all())
+
+    def test_append_drops_a_partial_record(self):
+        self.store.append('ACME', self.bars((1, 10)))
+        with open(self.root / 'ACME.1d.bars', 'ab') as file:
+            file.write(b'\0' * 5)
+        self.assertEqual(self.store.append('ACME', self.bars((2, 11))), 1)
+        self.assertEqual(self.store.series('ACME')['close'].tolist(), [10, 11])
+
+    def test_range_reads_are_views_of_the_mapping(self):
+        self.store.append('ACME', self.bars(*((day, day) for day in range(1, 31))))
+        bars = self.store.bars('ACME', date_to_ts(datetime.date(2024, 1, 10)), date_to_ts(datetime.date(2024, 1, 12)))
+        self.assertEqual(bars['close'].tolist(), [10, 11, 12])
+        self.assertTrue(np.shares_memory(bars, self.store.series('ACME')))
+        self.assertIsInstance(bars.base, np.memmap)
+
+    def test_series_are_kept_per_interval(self):
+        self.store.append('ACME', self.bars((1, 10)), interval='1h')
+        self.assertEqual(len(self.store.series('ACME', '1h')), 1)
+        self.assertEqual(len(self.store.series('ACME')), 0)
+        with self.assertRaises(ValueError):
+            self.store.series('ACME', '../1d')
+
+    def test_close_matrix_carries_closes_forward(self):
+        self.store.append('ACME', self.bars((1, 10), (2, 11), (4, 12)))
+        self.store.append('BOLT', self.bars((3, 100)))
+        matrix = self.store.close_matrix([(1, 'ACME'), (2, 'BOLT'), (3, 'NONE')], datetime.date(2024, 1, 2), 4)
+        np.testing.assert_array_equal(matrix[:, 0], [11, 11, 12, 12])
+        np.testing.assert_array_equal(matrix[:, 1], [np.nan, 100, 100, 100])
+        self.assertTrue(np.isnan(matrix[:, 2]).all())
+
+    def test_stores_agree(self):
+        instrument = Instrument.objects.create(symbol='ACME')
+        bars = self.bars((1, 10), (2, 11), (5, 12))
+        self.store.append('ACME', bars)
+        DatabasePriceStore().append('ACME', bars)
+        args = ([(instrument.pk, 'ACME')], datetime.date(2023, 12, 31), 10)
+        np.testing.assert_array_equal(self.store.close_matrix(*args), DatabasePriceStore().close_matrix(*args))
+
+    def test_database_store_skips_stored_bars(self):
+        store = DatabasePriceStore()
+        self.assertEqual(store.append('ACME', self.bars((1, 10), (2, 11))), 2)
+        sent = []
+        receiver = lambda **kwargs: sent.append(kwargs['date'])
+        prices_appended.connect(receiver)
+        self.addCleanup(prices_appended.disconnect, receiver)
+        self.assertEqual(store.append('ACME', self.bars((1, 99), (2, 99))), 0)
+        self.assertEqual(sent, [])
+        self.assertEqual(store.append('ACME', self.bars((2, 99), (3, 12))), 1)
+        self.assertEqual(sent, [datetime.date(2024, 1, 3)])
+        self.assertEqual(list(Price.objects.order_by('date').values_list('close', flat=True)), [10, 11, 12])
+
+    def test_append_prices_command(self):
+        csv_path = self.root / 'prices.csv'
+        csv_path.write_text(
+            'symbol,date,open,high,low,close,volume\n'
+            'ACME,2024-01-02,10,12,9,11,5000\n'
+            'ACME,2024-01-01,9,10,8,10,4000\n'
+            'BOLT,2024-01-01,,,,100,\n'
+        )
+        out = StringIO()
+        with override_settings(PRICE_STORE_DIR=self.root):
+            call_command('append_prices', str(csv_path), stdout=out)
+            call_command('append_prices', str(csv_path), stdout=out)
+        self.assertIn('Appended 3 bar(s), skipped 0', out.getvalue())
+        self.assertIn('Appended 0 bar(s), skipped 3', out.getvalue())
+        self.assertEqual(sorted(Instrument.objects.values_list('symbol', flat=True)), ['ACME', 'BOLT'])
+        acme = MemmapPriceStore(self.root).series('ACME')
+        self.assertEqual(acme['high'].tolist(), [10, 12])
+        self.assertEqual(acme['volume'].tolist(), [4000, 5000])
+
+
+class TransactionImportTests(TestCase):
+    CSV = (
+        'Date,Symbol,Kind,Quantity,Price,Fees\n'
+        '2024-01-02,acme,BUY,10,100.00,1\n'
+        '2024-01-02,acme,buy,10,100,1\n'
+        '2024-01-03,BOLT,buy,5,20,\n'
+        '2024-01-04,ACME,sell,4,110,1\n'
+        '2024-01-05,ACME,hold,1,1,\n'
+        'not-a-date,ACME,buy,1,1,\n'
+        '2024-01-06,ACME,buy,-1,1,\n'
+        '\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('importer', 'importer@example.com', 'StrongPass123')
+        cls.owner.profile.email_confirmed = True
+        cls.owner.profile.save()
+        cls.portfolio = Portfolio.objects.create(owner=cls.owner, name='Broker')
+
+    def test_imports_valid_rows_and_reports_invalid_ones(self):
+        reports = []
+        report = import_transactions(self.portfolio, StringIO(self.CSV), chunk_size=2, progress=reports.append)
+        self.assertEqual((report.rows, report.created, report.duplicates, report.error_count), (7, 4, 0, 3))
+        self.assertEqual(len(reports), 2)
+        self.assertEqual(report.errors[0], "Line 6: kind 'hold' is not buy or sell.")
+        position = Position.objects.get(portfolio=self.portfolio, instrument__symbol='ACME')
+        # The two identical buys on the same day are both kept.
+        self.assertEqual(position.quantity, 16)
+        self.assertTrue(Instrument.objects.filter(symbol='BOLT').exists())
+
+    def test_importing_again_writes_nothing(self):
+        import_transactions(self.portfolio, StringIO(self.CSV))
+        with CaptureQueriesContext(connection) as queries:
+            report = import_transactions(self.portfolio, StringIO(self.CSV))
+        self.assertEqual((report.created, report.duplicates), (0, 4))
+        self.assertFalse([q for q in queries if q['sql'].startswith(('INSERT', 'UPDATE'))])
+        self.assertEqual(Transaction.objects.filter(portfolio=self.portfolio).count(), 4)
+
+    def test_overlapping_export_only_adds_new_rows(self):
+        import_transactions(self.portfolio, StringIO(self.CSV))
+        extended = self.CSV + '2024-01-08,BOLT,sell,5,25,\n'
+        report = import_transactions(self.portfolio, StringIO(extended))
+        self.assertEqual((report.created, report.duplicates), (1, 4))
+
+    def test_identical_fills_apart_are_both_kept(self):
+        csv_text = (
+            'date,symbol,kind,quantity,price\n2024-01-02,AAPL,buy,10,100\n'
+            '2024-01-02,MSFT,buy,1,300\n2024-01-02,AAPL,buy,10,100\n'
+        )
+        report = import_transactions(self.portfolio, StringIO(csv_text))
+        self.assertEqual((report.rows, report.created), (3, 3))
+        self.assertEqual(Position.objects.get(portfolio=self.portfolio, instrument__symbol='AAPL').quantity, 20)
+        report = import_transactions(self.portfolio, StringIO(csv_text))
+        self.assertEqual((report.created, report.duplicates), (0, 3))
+
+    def test_identical_rows_on_different_dates_are_all_kept(self):
+        csv_text = (
+            'date,symbol,kind,quantity,price\n2024-01-02,AAPL,buy,10,100\n2024-01-02,AAPL,buy,10,100\n'
+            '2024-01-03,AAPL,buy,10,100\n2024-01-03,AAPL,buy,10,100\n2024-01-04,AAPL,buy,10,100\n'
+        )
+        report = import_transactions(self.portfolio, StringIO(csv_text), chunk_size=2)
+        self.assertEqual((report.rows, report.created), (5, 5))
+        self.assertEqual(len(set(Transaction.objects.values_list('fingerprint', flat=True))), 5)
+        report = import_transactions(self.portfolio, StringIO(csv_text), chunk_size=2)
+        self.assertEqual((report.created, report.duplicates), (0, 5))
+
+    def test_overselling_stops_the_import(self):
+        csv_text = 'date,symbol,kind,quantity,price\n2024-01-02,ACME,buy,1,10\n2024-01-03,ACME,sell,2,10\n'
+        report = import_transactions(self.portfolio, StringIO(csv_text))
+        self.assertTrue(report.aborted)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_missing_columns_are_rejected(self):
+        with self.assertRaisesMessage(ValueError, 'Missing column(s): kind, price.'):
+            import_transactions(self.portfolio, StringIO('date,symbol,quantity\n'))
+
+    def test_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / 'export.csv'
+        path.write_text('\ufeff' + self.CSV, encoding='utf-8')
+        out, err = StringIO(), StringIO()
+        call_command('import_transactions', str(self.portfolio.pk), str(path), stdout=out, stderr=err)
+        self.assertIn('Done: 7 row(s) read, 4 imported, 0 already imported, 3 invalid', out.getvalue())
+        self.assertIn('Line 7:', err.getvalue())
+
+    def test_upload_view(self):
+        self.client.force_login(self.owner)
+        url = reverse('core:import_transactions', kwargs={'pk': self.portfolio.pk})
+        upload = SimpleUploadedFile('export.csv', self.CSV.encode(), content_type='text/csv')
+        response = self.client.post(url, {'file': upload})
+        self.assertContains(response, '4 imported')
+        self.assertEqual(response.context['report'].error_count, 3)
+
+        response = self.client.post(url, {'file': SimpleUploadedFile('bad.csv', b'a,b\n1,2\n')})
+        self.assertContains(response, 'Missing column(s)')
+
+    def test_upload_view_only_serves_the_owner(self):
+        other = User.objects.create_user('intruder', 'intruder@example.com', 'StrongPass123')
+        other.profile.email_confirmed = True
+        other.profile.save()
+        self.client.force_login(other)
+        response = self.client.get(reverse('core:import_transactions', kwargs={'pk': self.portfolio.pk}))
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportTests(TestCase):
+    CSV = (
+        'date,symbol,kind,quantity,price,fees\n'
+        '2024-01-02,ACME,buy,10,100.5,1\n'
+        '2024-01-03,BOLT,buy,5,20,0\n'
+        '2024-01-04,ACME,sell,4,110,1\n'
+    )
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('exporter', 'exporter@example.com', 'StrongPass123')
+        cls.owner.profile.email_confirmed = True
+        cls.owner.profile.save()
+        cls.portfolio = Portfolio.objects.create(owner=cls.owner, name='Long Term')
+        import_transactions(cls.portfolio, StringIO(cls.CSV))
+
+    def setUp(self):
+        self.client.force_login(self.owner)
+
+    def url(self, export_format='csv'):
+        return reverse('core:export_transactions', kwargs={'pk': self.portfolio.pk, 'export_format': export_format})
+
+    def test_csv_export_streams_the_ledger(self):
+        response = self.client.get(self.url())
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="long-term-transactions.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'date,symbol,kind,quantity,price,fees')
+        self.assertEqual(lines[1], '2024-01-02,ACME,buy,10.00000000,100.50000000,1.00000000')
+        self.assertEqual(len(lines), 4)
+
+    def test_csv_export_imports_back(self):
+        content = b''.join(self.client.get(self.url()).streaming_content).decode()
+        copy = Portfolio.objects.create(owner=self.owner, name='Copy')
+        report = import_transactions(copy, StringIO(content))
+        self.assertEqual(report.created, 3)
+        self.assertEqual(
+            list(Position.objects.filter(portfolio=copy).order_by('instrument__symbol').values_list('quantity', 'cost_basis')),
+            list(Position.objects.filter(portfolio=self.portfolio).order_by('instrument__symbol').values_list('quantity', 'cost_basis')),
+        )
+
+    def test_jsonl_export(self):
+        response = self.client.get(self.url('jsonl'))
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(rows[2], {
+            'date': '2024-01-04', 'symbol': 'ACME', 'kind': 'sell',
+            'quantity': '4.00000000', 'price': '110.00000000', 'fees': '1.00000000',
+        })
+
+    def test_gzip_when_accepted(self):
+        plain = b''.join(self.client.get(self.url()).streaming_content)
+        response = self.client.get(self.url(), headers={'accept-encoding': 'gzip, deflate'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), plain)
+
+    def test_rows_are_read_in_chunks(self):
+        with override_settings(EXPORT_CHUNK_SIZE=1), patch('core.exports.BUFFER_SIZE', 1):
+            response = self.client.get(self.url())
+            self.assertEqual(len(list(response.streaming_content)), 4)
+
+    def test_positions_export(self):
+        response = self.client.get(reverse('core:export_positions', kwargs={'export_format': 'csv'}))
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'portfolio,symbol,quantity,cost_basis,realized_gain,last_date')
+        self.assertTrue(lines[1].startswith('Long Term,ACME,6.00000000,'))
+
+    def test_unknown_format_and_other_users_portfolios_are_not_found(self):
+        self.assertEqual(self.client.get(self.url('xml')).status_code, 404)
+        other = User.objects.create_user('other', 'other@example.com', 'StrongPass123')
+        self.client.force_login(other)
+        # Unconfirmed users are sent to confirm their email first.
+        self.assertRedirects(self.client.get(self.url()), reverse('accounts:account_activation_sent'))
+        other.profile.email_confirmed = True
+        other.profile.save()
+        self.assertEqual(self.client.get(self.url()).status_code, 404)
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(self.url())
+        self.assertRedirects(response, f'{reverse("accounts:login")}?next={self.url()}', fetch_redirect_response=False)
@@ -4,4 +4,10 @@ from . import views
 app_name = 'core'
 urlpatterns = [
     path('', views.index, name='index'),
+    path('metrics', views.metrics, name='metrics'),
+    path('dashboard/<str:widget>', views.dashboard_widget, name='dashboard_widget'),
+    path('portfolios/<int:pk>/import', views.import_transactions, name='import_transactions'),
+    path('portfolios/<int:pk>/transactions.<str:export_format>', views.export_transactions,
+         name='export_transactions'),
+    path('portfolios/positions.<str:export_format>', views.export_positions, name='export_positions'),
 ]
@@ -0,0 +1,168 @@
+import datetime
+
+import numpy as np
+from django.db.models import Case, DecimalField, F, Sum, When
+
+from .fx import convert, pair_rates
+from .models import Instrument, Transaction
+from .prices import get_price_store
+
+# Upper bound on portfolios x days x instruments held in one holdings array.
+MAX_CELLS = 4000000
+
+AMOUNT = DecimalField(max_digits=30, decimal_places=8)
+
+
+class Valuation:
+    """
+    Daily series for a batch of portfolios. Every array has one row per
+    portfolio, in `portfolio_ids` order, and one column per day of `dates`.
+
+    market_value: holdings valued at the latest close on or before the day.
+    cash: net cash from trades since inception, sells minus buys and fees.
+    pnl: market_value + cash, the gain since inception.
+    daily_pnl: change of pnl from the previous day.
+    """
+    __slots__ = ('portfolio_ids', 'dates', 'market_value', 'cash', 'pnl', 'daily_pnl', '_rows')
+
+    def __init__(self, portfolio_ids, dates, market_value, cash, pnl, daily_pnl):
+        self.portfolio_ids = portfolio_ids
+        self.dates = dates
+        self.market_value = market_value
+        self.cash = cash
+        self.pnl = pnl
+        self.daily_pnl = daily_pnl
+        self._rows = {pk: row for row, pk in enumerate(portfolio_ids)}
+
+    def row(self, portfolio_id):
+        return self._rows[portfolio_id]
+
+
+def signed(when_sell, otherwise):
+    return Case(When(kind=Transaction.SELL, then=when_sell), default=otherwise, output_field=AMOUNT)
+
+
+def cash_flow():
+    gross = F('quantity') * F('price')
+    return signed(gross - F('fees'), -gross - F('fees'))
+
+
+def chunk_rows(columns_per_row, days, max_cells):
+    """
+    Splits portfolio rows into consecutive chunks whose holdings array,
+    rows x days x instrument columns used by the chunk, stays under `max_cells`.
+    """
+    chunk, used = [], set()
+    for row, row_columns in enumerate(columns_per_row):
+        merged = used | row_columns
+        if chunk and (len(chunk) + 1) * days * max(len(merged), 1) > max_cells:
+            yield chunk, sorted(used)
+            chunk, merged = [], set(row_columns)
+        chunk.append(row)
+        used = merged
+    if chunk:
+        yield chunk, sorted(used)
+
+
+def value_portfolios(portfolio_ids, start, end, max_cells=MAX_CELLS, currency=None):
+    """
+    Values many portfolios for every day from `start` to `end` inclusive
+    with three queries in total plus those of the price store. Holdings are accumulated and priced as
+    NumPy arrays, in chunks of portfolios bounded by `max_cells`.
+
+    Amounts are in each instrument's own currency, or in `currency` if
+    given: closes and cash flows are then converted at the rate of their
+    day, and holdings are valued at zero on days without a rate.
+    """
+    portfolio_ids = list(portfolio_ids)
+    rows = {pk: row for row, pk in enumerate(portfolio_ids)}
+    # One extra day in front, so that the first day has a daily_pnl too.
+    origin = start - datetime.timedelta(days=1)
+    days = (end - origin).days + 1
+
+    # Converted cash is summed per day, at that day's rate.
+    grouping = ('portfolio_id', 'instrument_id') if currency is None else ('portfolio_id', 'instrument_id', 'date')
+    opening = list(
+        Transaction.objects.filter(portfolio_id__in=portfolio_ids, date__lte=origin)
+        .values(*grouping)
+        .annotate(net_quantity=Sum(signed(-F('quantity'), F('quantity'))), net_cash=Sum(cash_flow()))
+        .values_list(*grouping, 'net_quantity', 'net_cash')
+    )
+    trades = list(
+        Transaction.objects.filter(portfolio_id__in=portfolio_ids, date__gt=origin, date__lte=end)
+        .annotate(signed_quantity=signed(-F('quantity'), F('quantity')), cash=cash_flow())
+        .values_list('portfolio_id', 'instrument_id', 'date', 'signed_quantity', 'cash')
+    )
+
+    instruments_per_row = [set() for _ in portfolio_ids]
+    for portfolio_id, instrument_id, *_ in opening + trades:
+        instruments_per_row[rows[portfolio_id]].add(instrument_id)
+    instrument_ids = sorted(set().union(*instruments_per_row))
+    columns = {pk: column for column, pk in enumerate(instrument_ids)}
+    instruments = list(
+        Instrument.objects.filter(pk__in=instrument_ids).order_by('pk').values_list('pk', 'symbol', 'currency')
+    )
+    currencies = np.array([code for _, _, code in instruments], dtype=object)
+    prices = get_price_store().close_matrix([(pk, symbol) for pk, symbol, _ in instruments], origin, days)
+    if currency is not None:
+        day_dates = np.datetime64(origin, 'D') + np.arange(days)
+        for code in set(currencies) - {currency}:
+            prices[:, currencies == code] *= pair_rates(code, currency, day_dates)[:, None]
+    # Days before an instrument's first close value it at zero.
+    prices = np.nan_to_num(prices)
+
+    def to_arrays(records):
+        if not records:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype='datetime64[D]'), np.zeros(0), np.zeros(0)
+        fields = list(zip(*records))
+        row = np.fromiter((rows[pk] for pk in fields[0]), dtype=np.int64, count=len(records))
+        column = np.fromiter((columns[pk] for pk in fields[1]), dtype=np.int64, count=len(records))
+        if len(fields) == 5:
+            date = np.array(fields[2], dtype='datetime64[D]')
+        else:
+            date = np.full(len(records), np.datetime64(origin, 'D'))
+        return row, column, date, np.array(fields[-2], dtype=float), np.array(fields[-1], dtype=float)
+
+    row, column, date, quantity, cash = (
+        np.concatenate(parts) for parts in zip(to_arrays(opening), to_arrays(trades))
+    )
+    # Opening totals all fall on the day in front.
+    day = np.maximum((date - np.datetime64(origin, 'D')).astype(np.int64), 0)
+    if currency is not None and len(cash):
+        cash = np.nan_to_num(convert(cash, currencies[column], date, currency))
+
+    cash_series = np.zeros((len(portfolio_ids), days))
+    np.add.at(cash_series, (row, day), cash)
+    np.cumsum(cash_series, axis=1, out=cash_series)
+
+    market_value = np.zeros((len(portfolio_ids), days))
+    columns_per_row = [{columns[pk] for pk in instruments} for instruments in instruments_per_row]
+    for chunk, chunk_columns in chunk_rows(columns_per_row, days, max_cells):
+        if not chunk_columns:
+            continue
+        members = np.array(chunk)
+        local_row = np.full(len(portfolio_ids), -1)
+        local_row[members] = np.arange(len(chunk))
+        local_column = np.full(len(instrument_ids), -1)
+        local_column[chunk_columns] = np.arange(len(chunk_columns))
+        selected = local_row[row] >= 0
+
+        holdings = np.zeros((len(chunk), days, len(chunk_columns)))
+        np.add.at(
+            holdings,
+            (local_row[row[selected]], day[selected], local_column[column[selected]]),
+            quantity[selected],
+        )
+        np.cumsum(holdings, axis=1, out=holdings)
+        market_value[members] = np.einsum('pdi,di->pd', holdings, prices[:, chunk_columns])
+
+    pnl = market_value + cash_series
+    return Valuation(
+        portfolio_ids,
+        np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1),
+        market_value[:, 1:],
+        cash_series[:, 1:],
+        pnl[:, 1:],
+        np.diff(pnl, axis=1),
+    )
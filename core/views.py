@@ -1,8 +1,65 @@
-from django.shortcuts import render
+import io
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db import router
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.text import slugify
+from . import exports, imports
+from .dashboard import QUOTED_PARTS, WIDGETS, Dashboard
+from .forms import TransactionImportForm
+from .metrics import registry
+from .models import Portfolio, Transaction
+from .portfolio_cache import combined_version, dashboard_etag
+from .quotes import quote_version
+from .routers import replica_reads
 
 # Create your views here.
+@replica_reads()
 def index(request):
-    return render(request, 'core/index.html')
+    if not request.user.is_authenticated:
+        return render(request, 'core/index.html')
+    return dashboard_response(request, 'core/index.html', 'index')
+
+
+@login_required
+@replica_reads()
+def dashboard_widget(request, widget):
+    """
+    One dashboard widget as an HTML fragment, so that the page can refresh
+    it without rendering the whole page.
+    """
+    if widget not in WIDGETS:
+        raise Http404
+    return dashboard_response(request, f'core/widgets/{widget}.html', widget)
+
+
+def dashboard_response(request, template_name, part):
+    """
+    Renders `template_name` with the user's dashboard, or answers 304 when
+    the client's copy is current. The version covers the user's portfolios,
+    prices, exchange rates, the day and the user's base currency, and also
+    keys the fragment cache of every widget. Parts showing live quotes are
+    keyed by the quote version too.
+    """
+    portfolios = list(request.user.portfolios.order_by('name').values_list('pk', 'name'))
+    currency = request.user.profile.base_currency
+    version = f'{combined_version(portfolios)}:{timezone.localdate().isoformat()}:{currency}'
+    quotes = quote_version()
+    etag = dashboard_etag(request.user, f'{version}:{quotes}' if part in QUOTED_PARTS else version, part)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = render(request, template_name, {
+            'dashboard': Dashboard(portfolios, currency),
+            'dashboard_version': version,
+            'quote_version': quotes,
+        })
+    response.headers['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 
 def handler404(request, exception):
@@ -11,3 +68,68 @@ def handler404(request, exception):
 
 def handler500(request):
     return render(request, 'core/500.html', status=500)
+
+
+def metrics(request):
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def import_transactions(request, pk):
+    portfolio = get_object_or_404(Portfolio, pk=pk, owner=request.user)
+    report = None
+    if request.method == 'POST':
+        form = TransactionImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            # Large uploads are spooled to disk by Django, and the import
+            # reads them line by line.
+            stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            try:
+                report = imports.import_transactions(portfolio, stream)
+            except ValueError as exc:
+                form.add_error('file', str(exc))
+    else:
+        form = TransactionImportForm()
+    return render(request, 'core/import_transactions.html', {'portfolio': portfolio, 'form': form, 'report': report})
+
+
+def streaming_export(request, filename, export_format, header, rows):
+    """
+    Streams `rows` as CSV or JSON lines, gzipped on the fly when the client
+    accepts it. Nothing but the current chunk is held in memory.
+    """
+    if export_format not in exports.FORMATS:
+        raise Http404
+    write_lines, content_type = exports.FORMATS[export_format]
+    chunks = exports.encode(write_lines(header, rows))
+    compress = exports.accepts_gzip(request)
+    if compress:
+        chunks = exports.gzip_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{export_format}"'
+    return response
+
+
+@login_required
+@replica_reads()
+def export_transactions(request, pk, export_format):
+    portfolio = get_object_or_404(Portfolio, pk=pk, owner=request.user)
+    # Rows are read after the view returns, outside replica_reads(), so
+    # the database is chosen now.
+    rows = exports.transaction_rows(portfolio, using=router.db_for_read(Transaction))
+    return streaming_export(
+        request, f'{slugify(portfolio.name) or "portfolio"}-transactions', export_format,
+        exports.TRANSACTION_FIELDS, rows,
+    )
+
+
+@login_required
+@replica_reads()
+def export_positions(request, export_format):
+    rows = exports.position_rows(request.user, using=router.db_for_read(Transaction))
+    return streaming_export(request, 'positions', export_format, exports.POSITION_FIELDS, rows)
@@ -47,21 +47,25 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',
+    'core.routers.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
-    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.CachedAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'accounts.middleware.EmailVerificationMiddleware'
+    'accounts.middleware.EmailVerificationMiddleware',
+    'accounts.ratelimit.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'investments_tracker.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render timing for core.metrics.MetricsMiddleware
+        'BACKEND': 'core.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,16 +92,47 @@ DATABASES = {
         'PASSWORD': 'password',
         'HOST': 'localhost',
         'PORT': '5432',
+        # Keep connections open between requests, checked before reuse.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas, one per host in DB_REPLICA_HOSTS (comma separated).
+for index, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(','))):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# With psycopg 3 connections can come from a pool instead of being kept
+# per thread; Django requires CONN_MAX_AGE = 0 then.
+if os.getenv('DB_POOL', 'False') == 'True':
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = 0
+        database['OPTIONS'] = {'pool': True}
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+# Seconds a client reads from the primary after one of its requests wrote.
+REPLICA_PIN_SECONDS = 5
+
 # Use SQLite in memory for tests
 import sys
 if 'test' in sys.argv:
-    DATABASES['default'] = {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': ':memory:',
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
+        # A separate database standing in for a replica in the router tests.
+        'replica': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        },
     }
+    DATABASE_REPLICAS = []
     # Migrations turned off for tests
     class DisableMigrations:
         def __contains__(self, item):
@@ -126,6 +161,32 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.HashingPoolBackend',
+]
+
+PASSWORD_HASHERS = [
+    'accounts.hashers.ConfigurablePBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.ScryptPasswordHasher',
+]
+
+# PBKDF2 work factor, set per environment. The test suite uses a cheap one.
+PASSWORD_HASHER_ITERATIONS = int(os.getenv(
+    'PASSWORD_HASHER_ITERATIONS', 1000 if 'test' in sys.argv else 1_000_000
+))
+
+# Threads that hash passwords for the async auth views, and how many hashing
+# jobs may be queued or running before new ones are rejected with 503.
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASHING_MAX_PENDING = int(os.getenv('PASSWORD_HASHING_MAX_PENDING', PASSWORD_HASHING_WORKERS * 8))
+
+# Seconds an authenticated user and profile are reused by this process
+# without querying the database, 0 disables the cache.
+AUTH_USER_CACHE_TTL = float(os.getenv('AUTH_USER_CACHE_TTL', 5))
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -163,3 +224,61 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True')
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
+
+# Outbox delivery (see accounts.outbox and the send_outbox command)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 100))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_DELAY = 30  # seconds, doubled after every failed attempt
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 3600
+EMAIL_OUTBOX_LEASE = 300  # seconds a claimed batch stays hidden from other senders
+
+# Rate limiting (see accounts.ratelimit). Rules are keyed by URL name; 'ip'
+# and 'user' give the allowed rate per client address and per user, where
+# 'user' is the logged in user or the username/email submitted in the form.
+RATELIMIT_ENABLED = 'test' not in sys.argv  # tests enable it where needed
+RATELIMIT_BACKEND = 'accounts.ratelimit.CacheBackend'  # or 'accounts.ratelimit.LocalMemoryBackend'
+RATELIMIT_CACHE = 'default'
+RATELIMITS = {
+    'accounts:login': {'methods': ('POST',), 'ip': '30/m', 'user': '5/m'},
+    'accounts:register': {'methods': ('POST',), 'ip': '10/h'},
+    'accounts:resend_activation_email': {'ip': '10/h', 'user': '3/h'},
+    'accounts:password_reset': {'methods': ('POST',), 'ip': '10/h', 'user': '3/h'},
+    'core:import_transactions': {'methods': ('POST',), 'user': '20/h'},
+}
+
+# Per-view metrics served at /metrics (see core.metrics). Latency is recorded
+# for every request, SQL and template timings for a sampled share of them.
+METRICS_ENABLED = True
+METRICS_SAMPLE_RATE = float(os.getenv('METRICS_SAMPLE_RATE', 0.1))
+METRICS_ALLOWED_IPS = os.getenv('METRICS_ALLOWED_IPS', '127.0.0.1').split(',')
+
+# Rows fetched per round trip by the streaming exports (see core.exports).
+# On PostgreSQL they are read through a server-side cursor, which does not
+# work behind a transaction pooler unless DISABLE_SERVER_SIDE_CURSORS is set.
+EXPORT_CHUNK_SIZE = 2000
+
+# Where valuation and charts read prices from (see core.prices). The memmap
+# store keeps one file per symbol and interval under PRICE_STORE_DIR.
+PRICE_STORE = os.getenv('PRICE_STORE', 'core.prices.MemmapPriceStore')  # or 'core.prices.DatabasePriceStore'
+PRICE_STORE_DIR = os.getenv('PRICE_STORE_DIR', BASE_DIR / 'var' / 'prices')
+
+# Live quotes (see core.quotes). Providers are asked in order; symbols one
+# cannot quote fall back to the next. Quotes are shared through the cache
+# for QUOTE_CACHE_TTL seconds, and a provider that failed
+# QUOTE_BREAKER_THRESHOLD times in a row is skipped for QUOTE_BREAKER_RESET seconds.
+QUOTE_PROVIDERS = ['core.quotes.PriceStoreQuoteProvider']
+QUOTE_CACHE_TTL = 60
+QUOTE_BREAKER_THRESHOLD = 5
+QUOTE_BREAKER_RESET = 30
+
+# Currencies a user can choose as the base currency of their dashboard (see
+# core.fx). Pairs without stored rates are converted through FX_PIVOT_CURRENCY.
+CURRENCIES = ['USD', 'EUR', 'PLN']
+FX_PIVOT_CURRENCY = 'USD'
+# Currency the portfolio snapshots are kept in (see core.snapshots), each
+# trade and close converted at the rate of its day. After changing it, run
+# refresh_snapshots --rebuild.
+SNAPSHOT_CURRENCY = 'USD'
+
+# Symbol of the index portfolio betas are measured against (see core.risk).
+RISK_BENCHMARK = os.getenv('RISK_BENCHMARK', 'SPY')